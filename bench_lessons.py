@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+build_lessons.py 的性能基准
+
+功能：
+- 生成 10 / 1k / 100k / 1M 句的合成语料（法语 + 中文 + 英文，带重音、撇号、分段），
+  缓存在工作目录里，下次直接复用
+- 每个阶段在单独的子进程里跑：读取、HTML / MD / CSV / XLSX 导出、搜索索引、目录页、TTS
+  （TTS 打到本地的假服务上，不花钱也不需要凭证）
+- slots 阶段对比内存：同样的句子分别存成 dict 和 __slots__ 的 Sentence，
+  各在一个子进程里建满 N 个，报告常驻内存增长和 tracemalloc 统计的 Python 堆
+- 记录耗时、CPU 时间、每秒句数、峰值内存，结果写成 JSON
+- --baseline 和上一次的结果比较，超过 --threshold 的变慢 / 变胖算回归，退出码 1
+
+用法：
+    python bench_lessons.py                          # 默认 10 / 1k / 100k / 1M 全部阶段
+    python bench_lessons.py --sizes 10,1000 --stages html,csv
+    python bench_lessons.py --sizes 1000000 --stages slots
+    python bench_lessons.py --baseline bench_results/old.json --threshold 0.15
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_DIR = Path(__file__).parent
+SCRIPT = BASE_DIR / "build_lessons.py"
+RESULTS_DIR = BASE_DIR / "bench_results"
+
+DEFAULT_SIZES = (10, 1_000, 100_000, 1_000_000)
+STAGES = ("load", "html", "md", "csv", "xlsx", "search", "index", "tts", "slots")
+# slots 阶段拆成两个子进程：同样的句子存成 dict / Sentence
+SLOTS_VARIANTS = ("slots.dict", "slots.obj")
+SENTENCES_PER_LESSON = 500
+TTS_MAX_SENTENCES = 5_000    # TTS 阶段最多合成这么多句（假服务也要走 HTTP，1M 句太久）
+CORPUS_VERSION = 1           # 改了语料生成方式就加一，旧的缓存语料会重新生成
+RESULTS_VERSION = 1
+
+
+# ========== 合成语料 ==========
+
+# (法语, 中文, 英文) 片段，拼成 "主语 + 情态动词 + 动词 + 宾语 + 时间地点"
+SUBJECTS = [
+    ("Je voudrais", "我想", "I would like to"),
+    ("Tu peux", "你可以", "You can"),
+    ("Nous aimerions", "我们想", "We would like to"),
+    ("Vous devez", "您得", "You must"),
+    ("Elle préfère", "她更想", "She prefers to"),
+    ("On va", "我们要", "We are going to"),
+    ("Mon frère aimerait", "我哥哥想", "My brother would like to"),
+    ("La serveuse va", "女服务员要", "The waitress is going to"),
+]
+VERBS = [
+    ("réserver", "预订", "book"),
+    ("acheter", "买", "buy"),
+    ("goûter", "尝尝", "taste"),
+    ("commander", "点", "order"),
+    ("trouver", "找到", "find"),
+    ("payer", "付", "pay for"),
+    ("prendre", "拿", "take"),
+    ("essayer", "试试", "try"),
+]
+OBJECTS = [
+    ("une table pour deux", "一张两人桌", "a table for two"),
+    ("l'addition", "账单", "the bill"),
+    ("un café crème", "一杯奶油咖啡", "a coffee with cream"),
+    ("des billets de train", "几张火车票", "some train tickets"),
+    ("la chambre d'hôtel", "酒店房间", "the hotel room"),
+    ("un pain au chocolat", "一个巧克力面包", "a chocolate croissant"),
+    ("une bouteille d'eau gazeuse", "一瓶气泡水", "a bottle of sparkling water"),
+    ("le plat du jour", "今日特色菜", "the dish of the day"),
+    ("un cadeau pour ma mère", "给我妈妈的礼物", "a present for my mother"),
+    ("des crêpes à la crème", "奶油可丽饼", "some cream crêpes"),
+]
+PLACES = [
+    ("ce soir", "今晚", "tonight"),
+    ("demain matin", "明天早上", "tomorrow morning"),
+    ("à la gare", "在火车站", "at the station"),
+    ("près de l'église", "在教堂附近", "near the church"),
+    ("au marché", "在市场", "at the market"),
+    ("cet été", "今年夏天", "this summer"),
+    ("avant midi", "中午之前", "before noon"),
+    ("à {n} heures", "{n}点", "at {n} o'clock"),
+    ("pour {n} personnes", "给{n}个人", "for {n} people"),
+]
+SECTIONS = ["Au restaurant", "À la gare", "À l'hôtel", "Au marché", "Chez le médecin"]
+
+
+def synthetic_sentence(rng: random.Random) -> Dict[str, str]:
+    subject, verb, obj, place = (rng.choice(pieces) for pieces in (SUBJECTS, VERBS, OBJECTS, PLACES))
+    n = str(rng.randint(2, 12))
+    fr = f"{subject[0]} {verb[0]} {obj[0]} {place[0]}".replace("{n}", n)
+    zh = f"{subject[1]}{place[1]}{verb[1]}{obj[1]}".replace("{n}", n)
+    en = f"{subject[2]} {verb[2]} {obj[2]} {place[2]}".replace("{n}", n)
+    if rng.random() < 0.3:
+        return {"fr": f"Est-ce que {fr[0].lower()}{fr[1:]} ?", "zh": zh + "吗？", "en": en + "?"}
+    return {"fr": fr + ".", "zh": zh + "。", "en": en + "." if rng.random() < 0.5 else ""}
+
+
+def generate_corpus(workdir: Path, size: int) -> Path:
+    """在 workdir/n<size>/ 下生成语料和一份 build_lessons.py（产物都落在这个目录里）。"""
+    root = workdir / f"n{size}"
+    stamp = root / ".corpus"
+    if stamp.exists() and stamp.read_text() == f"{CORPUS_VERSION}:{size}":
+        shutil.copy2(SCRIPT, root / SCRIPT.name)
+        return root
+
+    if root.exists():
+        shutil.rmtree(root)
+    (root / "lessons").mkdir(parents=True)
+    shutil.copy2(SCRIPT, root / SCRIPT.name)
+
+    rng = random.Random(size)
+    started = time.perf_counter()
+    lesson_count = -(-size // SENTENCES_PER_LESSON)
+    for n in range(lesson_count):
+        count = min(SENTENCES_PER_LESSON, size - n * SENTENCES_PER_LESSON)
+        sentences = []
+        for i in range(count):
+            s = synthetic_sentence(rng)
+            s["section"] = SECTIONS[(i // 50) % len(SECTIONS)]
+            sentences.append(s)
+        lesson = {
+            "id": f"bench_{n:05d}",
+            "title": f"Leçon {n + 1} : {SECTIONS[n % len(SECTIONS)]}",
+            "title_zh": f"第 {n + 1} 课",
+            "description_zh": "基准测试用的合成语料",
+            "category": SECTIONS[n % len(SECTIONS)],
+            "sentences": sentences,
+        }
+        path = root / "lessons" / f"bench_{n:05d}.json"
+        path.write_text(json.dumps(lesson, ensure_ascii=False, indent=2), encoding="utf-8")
+    stamp.write_text(f"{CORPUS_VERSION}:{size}")
+    print(f"[OK] 语料: {root}（{size} 句，{lesson_count} 个 lesson，{time.perf_counter() - started:.1f}s）")
+    return root
+
+
+# ========== 假 TTS 服务 ==========
+
+# MPEG-2 Layer III 24 kHz 64 kbps 的一帧（和 Google TTS 返回的格式一样），内容是静音
+FAKE_MP3_FRAME = bytes.fromhex("fff384c4") + bytes(188)
+
+
+class FakeTtsHandler(BaseHTTPRequestHandler):
+    """模拟 texttospeech REST 接口：按文本长度返回若干静音帧。"""
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        audio = FAKE_MP3_FRAME * (5 + len(body["input"]["text"]) // 10)
+        out = json.dumps({"audioContent": base64.b64encode(audio).decode()}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+@contextlib.contextmanager
+def fake_tts_server() -> Any:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTtsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+
+
+# ========== 单个阶段（在子进程里跑） ==========
+
+def _peak_rss_mb() -> float:
+    """本进程到目前为止的峰值常驻内存（MB）。"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = ProcessMemoryCounters(cb=ctypes.sizeof(ProcessMemoryCounters))
+    ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                             ctypes.byref(counters), counters.cb)
+    return counters.PeakWorkingSetSize / (1024 * 1024)
+
+
+def _slots_rows(bl: Any, variant: str, size: int) -> List[Any]:
+    """size 句合成句子，slots.dict 存成 dict，slots.obj 存成 Sentence（同一个种子，字符串完全一样）。"""
+    rng = random.Random(size)
+    if variant == "slots.dict":
+        return [{"id": i, **synthetic_sentence(rng), "section": ""} for i in range(size)]
+    return [bl.Sentence.from_dict({"id": i, **synthetic_sentence(rng)}) for i in range(size)]
+
+
+def run_slots_stage(variant: str, size: int) -> Dict[str, Any]:
+    """建满 size 个 dict / Sentence 并一直持有，返回耗时、常驻内存增长和 Python 堆大小。
+
+    先不开 tracemalloc 建一遍，量常驻内存（tracemalloc 自己的记录也占内存）；
+    释放后再在 tracemalloc 下建一遍，取它统计的当前分配量。
+    """
+    import build_lessons as bl
+
+    rss_before = _peak_rss_mb()
+    wall, cpu = time.perf_counter(), time.process_time()
+    rows = _slots_rows(bl, variant, size)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    peak = _peak_rss_mb()
+    del rows
+
+    tracemalloc.start()
+    rows = _slots_rows(bl, variant, size)
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return {
+        "stage": variant,
+        "sentences": size,
+        "seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "sentences_per_sec": round(size / wall, 1) if wall > 0 else None,
+        "peak_rss_mb": round(peak, 1),
+        "rss_growth_mb": round(max(0.0, peak - rss_before), 1),
+        "traced_mb": round(traced / (1024 * 1024), 1),
+    }
+
+
+def run_stage(stage: str, root: Path) -> Dict[str, Any]:
+    """在 root（语料目录）里跑一个阶段，返回计时和内存。准备工作不计时。"""
+    sys.path.insert(0, str(root))
+    os.chdir(root)
+    if stage in SLOTS_VARIANTS:
+        # 不读语料文件：只比较同样的句子在内存里的两种存法
+        return run_slots_stage(stage, int((root / ".corpus").read_text().split(":")[1]))
+    import build_lessons as bl
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        lessons = bl.load_lessons()
+    sentences = sum(len(lesson.sentences) for lesson in lessons)
+    manifest = {"version": bl.MANIFEST_VERSION, "lessons": {}, "index_pages": {}}
+    for lesson in lessons:
+        manifest["lessons"][lesson.id] = {"outputs": {fmt: "" for fmt in bl.LESSON_SINKS}}
+
+    stack = contextlib.ExitStack()
+    if stage == "tts":
+        endpoint = stack.enter_context(fake_tts_server())
+        os.environ["TTS_API_ENDPOINT"] = endpoint
+        if bl.AUDIO_ROOT.exists():
+            shutil.rmtree(bl.AUDIO_ROOT)
+        if bl.AUDIO_STORE.exists():
+            shutil.rmtree(bl.AUDIO_STORE)
+        limiter = bl.TtsRateLimiter(1e9, 1e12)
+        picked, sentences = [], 0
+        for lesson in lessons:
+            if sentences >= TTS_MAX_SENTENCES:
+                break
+            picked.append(lesson)
+            sentences += len(lesson.sentences)
+    bl.OUTPUT_DIR.mkdir(exist_ok=True)
+    rss_before = _peak_rss_mb()
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    with stack, contextlib.redirect_stdout(io.StringIO()):
+        if stage == "load":
+            # 重新读一遍，并把流式的 sentences 也真正遍历完
+            sentences = sum(1 for lesson in bl.iter_lessons() for _ in lesson.sentences)
+        elif stage in bl.LESSON_SINKS:
+            for lesson in lessons:
+                bl.export_lesson(lesson, [stage])
+        elif stage == "search":
+            bl.build_search_index(lessons)
+        elif stage == "index":
+            bl.export_index_html(lessons, manifest)
+        elif stage == "tts":
+            for lesson in picked:
+                bl.generate_lesson_tts(lesson, workers=8, limiter=limiter)
+        else:
+            raise ValueError(f"未知阶段: {stage}")
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    peak = _peak_rss_mb()
+    return {
+        "stage": stage,
+        "sentences": sentences,
+        "seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "sentences_per_sec": round(sentences / wall, 1) if wall > 0 else None,
+        "peak_rss_mb": round(peak, 1),
+        "rss_growth_mb": round(max(0.0, peak - rss_before), 1),
+    }
+
+
+def run_stage_subprocess(stage: str, root: Path) -> Dict[str, Any] | None:
+    """每个阶段一个新进程：峰值内存互不干扰，也不会吃到上一阶段的缓存。"""
+    with tempfile.NamedTemporaryFile("r", suffix=".json", delete=False) as f:
+        result_path = Path(f.name)
+    try:
+        proc = subprocess.run(
+            [sys.executable, str(Path(__file__).resolve()), "--run-stage", stage,
+             "--root", str(root), "--result", str(result_path)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"[ERROR] 阶段 {stage} 失败（{root.name}）：")
+            print(proc.stderr[-2000:])
+            return None
+        return json.loads(result_path.read_text(encoding="utf-8"))
+    finally:
+        result_path.unlink(missing_ok=True)
+
+
+# ========== 结果与比较 ==========
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    print(f"{'规模':>9}  {'阶段':<10} {'句/秒':>11} {'耗时(s)':>9} {'CPU(s)':>9} {'峰值内存(MB)':>12} "
+          f"{'增长(MB)':>9} {'Python 堆(MB)':>13}")
+    for r in results:
+        rate = f"{r['sentences_per_sec']:,.0f}" if r["sentences_per_sec"] else "-"
+        traced = f"{r['traced_mb']:.1f}" if "traced_mb" in r else "-"
+        print(f"{r['size']:>9,}  {r['stage']:<10} {rate:>11} {r['seconds']:>9.3f} "
+              f"{r['cpu_seconds']:>9.3f} {r['peak_rss_mb']:>12.1f} {r['rss_growth_mb']:>9.1f} {traced:>13}")
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """和基线比较耗时和内存增长，返回回归说明。太短（< 10 ms / < 1 MB）的差异当成噪声。"""
+    old = {(r["size"], r["stage"]): r for r in baseline.get("results", [])}
+    regressions: List[str] = []
+    for r in results:
+        prev = old.get((r["size"], r["stage"]))
+        if prev is None:
+            continue
+        for field, floor, unit in (("seconds", 0.01, "s"), ("rss_growth_mb", 1.0, "MB"), ("traced_mb", 1.0, "MB")):
+            if field not in r or field not in prev:
+                continue
+            before, after = prev[field], r[field]
+            if after - before > floor and after > before * (1 + threshold):
+                regressions.append(f"{r['size']:,} 句 / {r['stage']}: {field} {before:g}{unit} -> {after:g}{unit}"
+                                   f"（+{(after / before - 1) * 100 if before else float('inf'):.0f}%）")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="build_lessons.py 各阶段的性能基准")
+    parser.add_argument("--sizes", default=",".join(str(n) for n in DEFAULT_SIZES),
+                        help="语料规模（句数），逗号分隔（默认 10,1000,100000,1000000）")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"要跑的阶段，逗号分隔（默认全部：{','.join(STAGES)}）")
+    parser.add_argument("--workdir", default=str(Path(tempfile.gettempdir()) / "fr_lessons_bench"),
+                        help="语料和产物放在哪里（语料会缓存复用）")
+    parser.add_argument("--output", help="结果 JSON 路径（默认 bench_results/<时间>.json）")
+    parser.add_argument("--baseline", help="和这份结果 JSON 比较")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="超过基线多少算回归（默认 0.2，即慢 / 多占 20%%）")
+    # 内部用：子进程里跑单个阶段
+    parser.add_argument("--run-stage", help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        result = run_stage(args.run_stage, Path(args.root))
+        Path(args.result).write_text(json.dumps(result), encoding="utf-8")
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"未知阶段: {', '.join(sorted(unknown))}")
+
+    workdir = Path(args.workdir)
+    results: List[Dict[str, Any]] = []
+    for size in sizes:
+        root = generate_corpus(workdir, size)
+        for stage in (variant for stage in stages for variant in (SLOTS_VARIANTS if stage == "slots" else (stage,))):
+            result = run_stage_subprocess(stage, root)
+            if result is not None:
+                results.append({"size": size, **result})
+                print(f"[OK] {size:,} 句 / {stage}: {result['seconds']:.3f}s，峰值 {result['peak_rss_mb']:.0f} MB")
+        by_stage = {r["stage"]: r for r in results if r["size"] == size}
+        if all(variant in by_stage for variant in SLOTS_VARIANTS):
+            plain, slotted = (by_stage[variant] for variant in SLOTS_VARIANTS)
+            print(f"[OK] {size:,} 句 / __slots__ 对比 dict：常驻内存 {plain['rss_growth_mb']:.0f} -> "
+                  f"{slotted['rss_growth_mb']:.0f} MB，Python 堆 {plain['traced_mb']:.0f} -> {slotted['traced_mb']:.0f} MB")
+
+    print()
+    print_table(results)
+
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "version": RESULTS_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"[OK] 结果: {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"[WARN] 相比 {args.baseline} 有 {len(regressions)} 项回归（阈值 {args.threshold:.0%}）：")
+            for line in regressions:
+                print("   ", line)
+            sys.exit(1)
+        print(f"[OK] 没有超过 {args.threshold:.0%} 的回归（基线 {args.baseline}）")
+
+
+if __name__ == "__main__":
+    main()
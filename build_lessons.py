@@ -6,17 +6,42 @@
 
 功能：
 - 从 lessons/*.json 读取配置
+  （超大的 lesson 可用 lessons/*.jsonl：第一行元数据，之后每行一个句子，构建时流式读取）
 - 为每个 lesson 生成：
     build/<id>.html      — 带音频播放按钮的网页
     build/<id>.md        — Markdown（可直接丢 Notion）
     build/<id>.csv       — CSV（也可导入 Notion / Excel）
-    build/<id>.xlsx      — Excel（需要 openpyxl）
+    build/<id>.xlsx      — Excel（流式直接写 SpreadsheetML，不需要 openpyxl）
     build/audio/<id>/<nn>.mp3 — Google Cloud TTS 生成的语音
-- 生成 build/index.html 作为总目录
+                                （实际内容存于共享音频库 build/.audio_store/）
+    build/audio/<id>/sprite.mp3 + sprite.json — 整课音频拼接与每句偏移，页面优先用它播放
+    build/audio/<id>/all.mp3（及 <section>_all.mp3）— 带停顿的连续播放音频
+- --xlsx-combined：另外生成 build/lessons.xlsx，所有 lesson 各占一个工作表
+- 构建时所有 lesson 的句子按规范化文本（撇号 / 空白 / NFC）去重并报告重复率；
+  --report-duplicates 另写出全局句子库 build/sentences.json，每句的原文和翻译只存一份，lesson 按 id 引用
+- stats.html：法语词汇统计（词频、覆盖率、每课新词 / 独有词），每课的切词结果缓存在
+  build/.analytics.json，只有改过的 lesson 重新统计；数据另存 build/stats.json（需要 numpy）
+- 生成 index.html 作为总目录，带全文搜索（索引分片在 build/search/）；
+  lesson 多时分页、按 category 分组（build/catalog/，另有 lessons.json 清单）
+- 课程页共用的样式 / 脚本压缩后写成 build/assets/lesson.<哈希>.css / .js，页面只引用它们
+- 为 HTML / MD / CSV / JSON 等文本产物生成 .gz / .br（可选依赖 brotli），供 nginx 直接发送
+- build/.manifest.json 记录每个产物的输入指纹，内容没变的 lesson 不会重新生成
+  （python build_lessons.py --force 可全量重建）
+- 可选的 SQLite 内容库：--import-db 把 lessons/ 同步进 lessons.db，--db 从库里读取，
+  --tag 只构建某个标签的 lesson，--find 跨 lesson 查句子
+- --near-dups：用 MinHash / LSH 找近似重复句（build/near_duplicates.json），
+  --merge-near-dups 另把它们合并成句子库里的共享条目（配合 --report-duplicates）
+- --daily [DATE]：从所有 lesson 的句子池里按种子和日期确定性地抽句，生成 lessons/daily_<DATE>.json
+  再照常构建；避开最近几天用过的句子，可按难度 / 少见词加权（索引在 build/.daily/）
+- python build_lessons.py --watch：改 lesson 即重建并自动刷新浏览器；
+  --serve：构建后在本地按线上方式预览（Range / ETag / 预压缩）
+- 每次构建把各阶段 / 各 lesson 的耗时、写入字节、缓存命中和 TTS 用量写到 build_report.json
+  并打印汇总表；--profile 另用 cProfile 采样，结果存 build_profile.pstats（两者都不进 git）
 
 依赖：
     python -m pip install google-cloud-texttospeech
-    （可选）python -m pip install openpyxl
+    （可选）python -m pip install brotli
+    （可选）python -m pip install numpy   # 词汇统计、近似重复检测
 
 并配置 GCP 凭证，例如（PowerShell）：
     $env:GOOGLE_APPLICATION_CREDENTIALS="C:\\path\\to\\your-key.json"
@@ -24,12 +49,42 @@
 
 from __future__ import annotations
 
+import argparse
+import array
+import asyncio
+import bisect
+import contextlib
+import io
+import itertools
+import math
 import json
+import mimetypes
+import mmap
+import operator
 import csv
+import functools
+import gzip
+import hashlib
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List
 import datetime
+import email.utils
 import os
+import posixpath
+import random
+import re
+import shutil
+import sqlite3
+import string
+import struct
+import sys
+import threading
+import time
+import unicodedata
+import urllib.parse
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = r"C:\Users\11796\OneDrive\桌面\Web Dev\dns-credit-08cf1716327e.json"
 
@@ -38,379 +93,2046 @@ BASE_DIR = Path(__file__).parent
 CONTENT_DIR = BASE_DIR / "lessons"
 OUTPUT_DIR = BASE_DIR / "build"
 AUDIO_ROOT = OUTPUT_DIR / "audio"
+AUDIO_STORE = OUTPUT_DIR / ".audio_store"
+AUDIO_MAP_NAME = "index.json"
+# 未被引用的音频 blob 作为缓存保留的总上限（超出按 LRU 清理）
+AUDIO_STORE_MAX_BYTES = 200 * 1024 * 1024
+MANIFEST_PATH = OUTPUT_DIR / ".manifest.json"
+
+MANIFEST_VERSION = 1
+
+# 各导出器的版本号：改了某个导出器的输出格式就把对应数字 +1，
+# 下次构建时所有 lesson 的该格式产物都会重新生成。
+EXPORTER_VERSIONS: Dict[str, int] = {
+    "html": 1,
+    "md": 1,
+    "csv": 1,
+    "xlsx": 2,
+}
 
 
 # ========== 工具函数 ==========
 
-def load_lessons() -> List[Dict[str, Any]]:
-    """读取 lessons/*.json 并附加一些默认字段。"""
-    lessons: List[Dict[str, Any]] = []
+def _sha256(*parts: str | bytes) -> str:
+    """把若干段 str/bytes 依次喂给 sha256，返回十六进制摘要。"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # 加长度前缀，避免 ("ab", "c") 与 ("a", "bc") 撞车
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class Sentence:
+    """一句话。用 __slots__ 代替 dict：大语料下每句省掉一个哈希表的开销。
+
+    section 可选，用于把句子分组（例如对话场景），合并音频时按 section 分段。
+    """
+
+    __slots__ = ("id", "fr", "zh", "en", "section")
+
+    def __init__(self, id: Any, fr: str, zh: str = "", en: str = "", section: str = ""):
+        self.id = id
+        self.fr = fr
+        self.zh = zh
+        self.en = en
+        self.section = section
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Sentence":
+        return cls(d.get("id"), d["fr"], d.get("zh", ""), d.get("en", ""), d.get("section", ""))
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {"id": self.id, "fr": self.fr, "zh": self.zh, "en": self.en}
+        if self.section:
+            d["section"] = self.section
+        return d
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Sentence):
+            return NotImplemented
+        return ((self.id, self.fr, self.zh, self.en, self.section)
+                == (other.id, other.fr, other.zh, other.en, other.section))
+
+    def __repr__(self) -> str:
+        extra = f", section={self.section!r}" if self.section else ""
+        return f"Sentence({self.id!r}, {self.fr!r}, {self.zh!r}, {self.en!r}{extra})"
+
+
+class Lesson:
+    """一个 lesson 的元数据 + sentences（list[Sentence] 或流式的 JsonlSentences）。
+
+    JSON 里其它未知字段原样放在 extra 里。
+    """
+
+    __slots__ = ("id", "title", "title_zh", "description", "description_zh", "category",
+                 "sentences", "source_path", "source_hash", "extra")
+
+    def __init__(self, id: str, sentences: "List[Sentence] | JsonlSentences",
+                 title: str = "", title_zh: str = "",
+                 description: str = "", description_zh: str = "", category: str = "",
+                 source_path: Path | None = None, source_hash: str = "",
+                 extra: Dict[str, Any] | None = None):
+        self.id = id
+        self.title = title or id
+        self.title_zh = title_zh
+        self.description = description
+        self.description_zh = description_zh
+        self.category = category
+        self.sentences = sentences
+        self.source_path = source_path
+        self.source_hash = source_hash
+        self.extra = extra or {}
+
+    def __repr__(self) -> str:
+        return f"Lesson({self.id!r}, title={self.title!r})"
+
+
+class JsonlSentences:
+    """lessons/*.jsonl 的 sentences：每次迭代都从文件里逐行流式读取，不常驻内存。
+
+    可以反复迭代（导出、TTS 各读一遍）；pickle 时只带文件路径，
+    所以 --jobs 的子进程也是自己去流式读取。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._len: int | None = None
+
+    def __iter__(self) -> Iterator[Sentence]:
+        with self.path.open(encoding="utf-8") as f:
+            next(f, None)  # 第一行是 lesson 元数据
+            for lineno, line in enumerate(f, start=2):
+                if not line.strip():
+                    continue
+                try:
+                    yield Sentence.from_dict(json.loads(line))
+                except (ValueError, KeyError) as e:
+                    raise ValueError(f"{self.path}:{lineno}: {e}") from None
+
+    def __len__(self) -> int:
+        if self._len is None:
+            with self.path.open(encoding="utf-8") as f:
+                next(f, None)
+                self._len = sum(1 for line in f if line.strip())
+        return self._len
+
+
+def _file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    """分块计算文件的 sha256，大文件也不会整个读进内存。"""
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _read_lesson_file(path: Path) -> Dict[str, Any]:
+    """读取一个 lesson 文件，返回带 _source_hash 的原始 dict（由 iter_lessons 转成 Lesson）。
+
+    - *.json：整个文件就是一个 lesson 对象（手写的小文件，直接解析）
+    - *.jsonl：第一行是元数据对象（不含 sentences），之后每行一个句子对象；
+      只读第一行，sentences 换成按需流式读取的 JsonlSentences
+    """
+    if path.suffix == ".jsonl":
+        with path.open(encoding="utf-8") as f:
+            data = json.loads(f.readline() or "{}")
+        if not isinstance(data, dict):
+            raise ValueError("第一行必须是 lesson 元数据对象")
+        data["sentences"] = JsonlSentences(path)
+        data["_source_hash"] = _lesson_file_hash(path)
+        return data
+
+    raw = path.read_bytes()
+    data = json.loads(raw.decode("utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("lesson 必须是 JSON 对象")
+    data["_source_hash"] = _lesson_file_hash(path, raw)
+    return data
+
+
+def _lesson_file_hash(path: Path, raw: bytes | None = None) -> str:
+    """lesson 文件的指纹（即 Lesson.source_hash），不需要解析 JSON。"""
+    if path.suffix == ".jsonl":
+        return _file_sha256(path)
+    return _sha256(path.read_bytes() if raw is None else raw)
+
+
+def load_lesson(path: Path) -> Lesson | None:
+    """读取一个 lesson 文件，缺省字段补默认值；格式不对时打印原因并返回 None。"""
+    try:
+        data = _read_lesson_file(path)
+    except Exception as e:
+        print(f"[ERROR] 解析 JSON 失败: {path} -> {e!r}")
+        return None
+
+    sentences = data.pop("sentences", None)
+    if isinstance(sentences, list):
+        try:
+            sentences = [Sentence.from_dict(s) for s in sentences]
+        except (KeyError, AttributeError, TypeError) as e:
+            print(f"[WARN] sentences 格式不对，跳过: {path} -> {e!r}")
+            return None
+    elif not isinstance(sentences, JsonlSentences):
+        print(f"[WARN] lesson 缺少 sentences 或类型不对，跳过: {path}")
+        return None
+
+    source_hash = data.pop("_source_hash")
+    known = {k: data.pop(k) for k in ("id", "title", "title_zh", "description", "description_zh",
+                                      "category")
+             if k in data}
+    known.setdefault("id", path.stem)
+
+    return Lesson(sentences=sentences, source_path=path, source_hash=source_hash,
+                  extra=data, **known)
+
+
+def iter_lessons() -> Iterator[Lesson]:
+    """逐个产出 lessons/*.json 与 lessons/*.jsonl 里的 lesson。"""
     if not CONTENT_DIR.exists():
         print(f"[WARN] lessons 目录不存在: {CONTENT_DIR}")
-        return lessons
+        return
 
-    for path in sorted(CONTENT_DIR.glob("*.json")):
-        try:
-            data = json.loads(path.read_text(encoding="utf-8"))
-        except Exception as e:
-            print(f"[ERROR] 解析 JSON 失败: {path} -> {e!r}")
-            continue
+    for path in _lesson_paths():
+        lesson = load_lesson(path)
+        if lesson is not None:
+            yield lesson
 
-        if "id" not in data:
-            data["id"] = path.stem
 
-        data.setdefault("title", data["id"])
-        data.setdefault("title_zh", "")
-        data.setdefault("description", "")
-        data.setdefault("description_zh", "")
-        data["_source_path"] = path
+def _lesson_paths() -> List[Path]:
+    return sorted([*CONTENT_DIR.glob("*.json"), *CONTENT_DIR.glob("*.jsonl")])
 
-        if "sentences" not in data or not isinstance(data["sentences"], list):
-            print(f"[WARN] lesson 缺少 sentences 或类型不对，跳过: {path}")
-            continue
 
-        lessons.append(data)
+def load_lessons(db: Path | None = None, tag: str | None = None) -> List[Lesson]:
+    """读取所有 lesson。*.jsonl 的句子不会在这里读入内存。
 
+    db 非空时改从 SQLite 内容库读取（见 load_lessons_from_db）；tag 非空时只保留带这个标签的 lesson。
+    """
+    if db is not None:
+        return load_lessons_from_db(db, tag)
+    lessons = list(iter_lessons())
+    if tag is not None:
+        lessons = [lesson for lesson in lessons if tag in _lesson_tags(lesson)]
     return lessons
 
 
+def _lesson_tags(lesson: Lesson) -> List[str]:
+    """lesson JSON 里的 "tags"（字符串列表，也可以是单个字符串）。"""
+    tags = lesson.extra.get("tags") or []
+    if isinstance(tags, str):
+        tags = [tags]
+    return sorted({str(t).strip() for t in tags if str(t).strip()})
+
+
+def _existing_lesson_ids(db: Path | None = None) -> set[str] | None:
+    """内容库里现有的 lesson id；按文件读取时返回 None（由 _lesson_source_exists 看文件是否还在）。"""
+    if db is None:
+        return None
+    conn = _connect_db(db)
+    try:
+        return {lesson_id for (lesson_id,) in conn.execute("SELECT id FROM lessons")}
+    finally:
+        conn.close()
+
+
+def _lesson_source_exists(lesson_id: str, entry: Dict[str, Any], existing: set[str] | None) -> bool:
+    """manifest 里的一条 lesson 记录是否还有源：内容库里还有这个 id，或者记下的源文件还在。
+    没记源文件的旧记录保留，留给下一次全量构建处理。"""
+    if existing is not None:
+        return lesson_id in existing
+    return "file" not in entry or (CONTENT_DIR / entry["file"]).exists()
+
+
+# ========== SQLite 内容库（可选，--db） ==========
+
+CONTENT_DB = BASE_DIR / "lessons.db"
+DB_SCHEMA_VERSION = 1
+# 句子的 rowid = lesson 编号 << 24 | 句号：一个 lesson 的句子在表里是一段连续的 rowid，
+# 按课读取 / 删除都是主键上的范围操作，不需要额外的索引
+DB_LESSON_SHIFT = 24
+DB_IDX_MASK = (1 << DB_LESSON_SHIFT) - 1
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lessons (
+    no INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL DEFAULT '',
+    title_zh TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    description_zh TEXT NOT NULL DEFAULT '',
+    category TEXT NOT NULL DEFAULT '',
+    extra TEXT NOT NULL DEFAULT '{}',
+    source TEXT NOT NULL DEFAULT '',
+    source_hash TEXT NOT NULL,
+    sentence_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS lessons_category ON lessons(category);
+CREATE TABLE IF NOT EXISTS sentences (
+    sid,
+    fr TEXT NOT NULL,
+    zh TEXT NOT NULL DEFAULT '',
+    en TEXT NOT NULL DEFAULT '',
+    section TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    lesson_id TEXT NOT NULL,
+    PRIMARY KEY (tag, lesson_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_lesson ON tags(lesson_id);
+"""
+# fr / en 的全文索引（外部内容表，原文只存一份）。只做"所有词都出现"的查询，
+# detail=none 不记词的位置，建索引快一倍多；remove_diacritics 让 "ete" 也能搜到 "été"
+DB_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS sentences_fts USING fts5(
+    fr, en, content='sentences', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', detail=none, columnsize=0
+)
+"""
+
+
+def _connect_db(path: Path) -> sqlite3.Connection:
+    """打开内容库：WAL 模式（导入时读者不被阻塞），没有表时建表。"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != DB_SCHEMA_VERSION:
+        conn.executescript(DB_SCHEMA)
+        conn.execute(f"PRAGMA user_version={DB_SCHEMA_VERSION}")
+    return conn
+
+
+def _db_has_fts(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sentences_fts'").fetchone() is not None
+
+
+def _db_rowid_range(lesson_no: int) -> tuple[int, int]:
+    low = lesson_no << DB_LESSON_SHIFT
+    return low, low | DB_IDX_MASK
+
+
+class DbSentences:
+    """内容库里某个 lesson 的 sentences：和 JsonlSentences 一样每次迭代都按需查询，不常驻内存。
+
+    只保存库路径和 lesson 编号，pickle 到 --jobs 的子进程后各自打开连接。
+    """
+
+    def __init__(self, db_path: Path, lesson_no: int, count: int | None = None):
+        self.db_path = db_path
+        self.lesson_no = lesson_no
+        self._len = count
+
+    def __iter__(self) -> Iterator[Sentence]:
+        conn = _connect_db(self.db_path)
+        try:
+            rows = conn.execute("SELECT sid, fr, zh, en, section FROM sentences "
+                                "WHERE rowid BETWEEN ? AND ? ORDER BY rowid",
+                                _db_rowid_range(self.lesson_no))
+            for row in rows:
+                yield Sentence(*row)
+        finally:
+            conn.close()
+
+    def __len__(self) -> int:
+        if self._len is None:
+            conn = _connect_db(self.db_path)
+            try:
+                self._len = conn.execute("SELECT COUNT(*) FROM sentences WHERE rowid BETWEEN ? AND ?",
+                                         _db_rowid_range(self.lesson_no)).fetchone()[0]
+            finally:
+                conn.close()
+        return self._len
+
+
+def _db_delete_sentences(conn: sqlite3.Connection, lesson_no: int, fts: bool) -> None:
+    rows = _db_rowid_range(lesson_no)
+    if fts:
+        # 外部内容表要先用旧内容把词项从全文索引里减掉
+        conn.execute("INSERT INTO sentences_fts(sentences_fts, rowid, fr, en) "
+                     "SELECT 'delete', rowid, fr, en FROM sentences WHERE rowid BETWEEN ? AND ?", rows)
+    conn.execute("DELETE FROM sentences WHERE rowid BETWEEN ? AND ?", rows)
+
+
+def _db_import_lesson(conn: sqlite3.Connection, lesson: Lesson, no: int | None, fts: bool) -> int:
+    """把一课写进内容库（no 非空时整课替换这个编号的旧内容），返回句数。
+
+    句号在写入前检查：超过 DB_IDX_MASK 的句子会占用下一课的 rowid 区间，直接抛 ValueError。
+    """
+    values = (lesson.title, lesson.title_zh, lesson.description, lesson.description_zh,
+              lesson.category, json.dumps(lesson.extra, ensure_ascii=False),
+              lesson.source_path.name if lesson.source_path else "", lesson.source_hash)
+    if no is not None:
+        _db_delete_sentences(conn, no, fts)
+        conn.execute("DELETE FROM tags WHERE lesson_id = ?", (lesson.id,))
+        conn.execute("UPDATE lessons SET title = ?, title_zh = ?, description = ?, "
+                     "description_zh = ?, category = ?, extra = ?, source = ?, source_hash = ? "
+                     "WHERE no = ?", (*values, no))
+    else:
+        no = conn.execute("INSERT INTO lessons (id, title, title_zh, description, description_zh, "
+                          "category, extra, source, source_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          (lesson.id, *values)).lastrowid
+
+    low = no << DB_LESSON_SHIFT
+
+    def sentence_rows() -> Iterator[tuple[Any, ...]]:
+        for idx, s in enumerate(lesson.sentences, start=1):
+            if idx > DB_IDX_MASK:
+                raise ValueError(f"{lesson.id}: 句子数超过内容库上限 {DB_IDX_MASK}")
+            yield low | idx, s.id, s.fr, s.zh, s.en, s.section
+
+    count = conn.executemany("INSERT INTO sentences (rowid, sid, fr, zh, en, section) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", sentence_rows()).rowcount
+    conn.execute("UPDATE lessons SET sentence_count = ? WHERE no = ?", (count, no))
+    if fts:
+        conn.execute("INSERT INTO sentences_fts(rowid, fr, en) "
+                     "SELECT rowid, fr, en FROM sentences WHERE rowid BETWEEN ? AND ?",
+                     _db_rowid_range(no))
+    conn.executemany("INSERT INTO tags VALUES (?, ?)",
+                     ((tag, lesson.id) for tag in _lesson_tags(lesson)))
+    return count
+
+
+def import_lessons_to_db(db_path: Path = CONTENT_DB) -> None:
+    """把 lessons/*.json / *.jsonl 同步进 SQLite 内容库。
+
+    按文件指纹增量：没变的 lesson 跳过，变了的整课替换（保留原编号），
+    lessons/ 里已删除的从库里删掉。所有写入在一个事务里用 executemany 批量完成，
+    全文索引只更新变化的 lesson；*.jsonl 的句子边读边写，百万句也不会整个读进内存。
+    """
+    if not CONTENT_DIR.exists():
+        # 不能当成"所有 lesson 都删了"去清空内容库
+        print(f"[WARN] lessons 目录不存在: {CONTENT_DIR}")
+        return
+    start = time.perf_counter()
+    conn = _connect_db(db_path)
+    try:
+        conn.executescript(DB_FTS_SCHEMA)
+    except sqlite3.OperationalError:
+        print("[WARN] 当前 SQLite 不支持 FTS5，--find 会退回逐行匹配")
+    fts = _db_has_fts(conn)
+
+    old = {lesson_id: (no, source_hash) for no, lesson_id, source_hash
+           in conn.execute("SELECT no, id, source_hash FROM lessons")}
+    by_source = {(source, source_hash): lesson_id for lesson_id, source, source_hash
+                 in conn.execute("SELECT id, source, source_hash FROM lessons")}
+    seen: set[str] = set()
+    imported = skipped = rows = 0
+    with conn:
+        # 显式开事务：下面每课的保存点都嵌在里面（最外层的保存点 RELEASE 时会直接提交）
+        conn.execute("BEGIN")
+        for path in _lesson_paths():
+            # 先只算文件指纹：没变的文件连 JSON 都不用解析
+            unchanged = by_source.get((path.name, _lesson_file_hash(path)))
+            if unchanged is not None and unchanged not in seen:
+                seen.add(unchanged)
+                skipped += 1
+                continue
+            lesson = load_lesson(path)
+            if lesson is None:
+                continue
+            if lesson.id in seen:
+                print(f"[WARN] lesson id 重复，跳过: {lesson.source_path}")
+                continue
+            seen.add(lesson.id)
+
+            # 每课一个保存点：这课的句子读到一半出错（*.jsonl 坏行、句子太多）时只撤销这一课，
+            # 库里保留它上一次导入的内容，其它 lesson 照常导入
+            conn.execute("SAVEPOINT import_lesson")
+            try:
+                count = _db_import_lesson(conn, lesson, old[lesson.id][0] if lesson.id in old else None, fts)
+            except ValueError as e:
+                conn.execute("ROLLBACK TO import_lesson")
+                print(f"[ERROR] {e}，跳过 lesson {lesson.id}")
+                continue
+            finally:
+                conn.execute("RELEASE import_lesson")
+            rows += count
+            imported += 1
+
+        removed = old.keys() - seen
+        for lesson_id in removed:
+            _db_delete_sentences(conn, old[lesson_id][0], fts)
+            conn.execute("DELETE FROM tags WHERE lesson_id = ?", (lesson_id,))
+            conn.execute("DELETE FROM lessons WHERE id = ?", (lesson_id,))
+    conn.execute("PRAGMA optimize")
+    conn.close()
+    print(f"[OK] 内容库: {db_path}（导入 {imported} 个 lesson / {rows} 句，未变化 {skipped} 个，"
+          f"删除 {len(removed)} 个，{time.perf_counter() - start:.2f}s）")
+
+
+def load_lessons_from_db(db_path: Path = CONTENT_DB, tag: str | None = None) -> List[Lesson]:
+    """从内容库读取 lesson 元数据；句子用 DbSentences 按需查询。
+
+    source_hash 沿用导入时的文件指纹，所以从 JSON 切换到内容库不会让产物重新生成。
+    tag 非空时只取带这个标签的 lesson（走 tags 表的主键）。
+    """
+    if not db_path.exists():
+        print(f"[ERROR] 内容库不存在: {db_path}，先运行 python build_lessons.py --import-db")
+        return []
+    conn = _connect_db(db_path)
+    try:
+        sql = ("SELECT no, id, title, title_zh, description, description_zh, category, extra, source_hash, "
+               "sentence_count FROM lessons")
+        params: tuple[str, ...] = ()
+        if tag is not None:
+            sql += " WHERE id IN (SELECT lesson_id FROM tags WHERE tag = ?)"
+            params = (tag,)
+        rows = conn.execute(sql + " ORDER BY source, id", params).fetchall()
+    finally:
+        conn.close()
+    return [Lesson(lesson_id, DbSentences(db_path, no, count), title=title, title_zh=title_zh,
+                   description=description, description_zh=description_zh, category=category,
+                   source_path=db_path, source_hash=source_hash, extra=json.loads(extra))
+            for (no, lesson_id, title, title_zh, description, description_zh, category, extra,
+                 source_hash, count) in rows]
+
+
+def find_sentences(db_path: Path, query: str, limit: int = 50) -> List[tuple[str, int, Sentence]]:
+    """在内容库里查包含 query 的句子，返回 [(lesson id, 句号, Sentence)]。
+
+    拉丁字母的词走 fr / en 的 FTS5 索引（所有词都要出现，忽略大小写和重音）；
+    含中文或库里没有全文索引时，退回对 fr / zh / en 的子串匹配。
+    """
+    conn = _connect_db(db_path)
+    try:
+        words = re.findall(r"[^\W_]+", query)
+        columns = (f"l.id, s.rowid & {DB_IDX_MASK}, s.sid, s.fr, s.zh, s.en, s.section FROM sentences s "
+                   f"JOIN lessons l ON l.no = s.rowid >> {DB_LESSON_SHIFT}")
+        if words and _db_has_fts(conn) and not _CJK_RUN.search(query):
+            rows = conn.execute(f"SELECT {columns} WHERE s.rowid IN "
+                                "(SELECT rowid FROM sentences_fts WHERE sentences_fts MATCH ?) "
+                                "ORDER BY s.rowid LIMIT ?",
+                                (" ".join(f'"{w}"' for w in words), limit)).fetchall()
+        else:
+            like = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            rows = conn.execute(f"SELECT {columns} "
+                                "WHERE s.fr LIKE ?1 ESCAPE '\\' OR s.zh LIKE ?1 ESCAPE '\\' "
+                                "OR s.en LIKE ?1 ESCAPE '\\' "
+                                "ORDER BY s.rowid LIMIT ?2", (like, limit)).fetchall()
+    finally:
+        conn.close()
+    return [(lesson_id, idx, Sentence(*rest)) for lesson_id, idx, *rest in rows]
+
+
+# ========== 模板：预编译 + 自动转义 ==========
+
+class Markup(str):
+    """已经是安全 HTML 的字符串，模板渲染时原样插入、不再转义。"""
+
+
+def escape_html(value: Any) -> str:
+    """转义 & < > "，结果既可放在文本里，也可放在双引号属性里。
+
+    模板里的属性一律用双引号，所以不转义单引号，法语的 l'addition 保持可读。
+    """
+    if type(value) is not str:
+        if isinstance(value, Markup):
+            return value
+        value = str(value)
+    return (value.replace("&", "&amp;").replace("<", "&lt;")
+                 .replace(">", "&gt;").replace('"', "&quot;"))
+
+
+class Template:
+    """str.format 语法（{name}、{{ / }}）的模板，构造时就切好静态片段。
+
+    编译结果是一个生成出来的 render 函数，函数体就是
+    "".join((静态片段, 值, 静态片段, ...))。渲染时先把所有值拼起来查一次有没有
+    需要转义的字符：绝大多数句子没有，直接拼接；有的话再逐个转义。
+    """
+
+    __slots__ = ("fields", "render")
+
+    def __init__(self, source: str):
+        chunks: List[str] = []
+        fields: List[str] = []
+        for literal, field, _spec, _conv in string.Formatter().parse(source):
+            if len(chunks) > len(fields):
+                chunks[-1] += literal  # 上一段后面没有字段，拼在一起
+            else:
+                chunks.append(literal)
+            if field is not None:
+                if not field.isidentifier():
+                    raise ValueError(f"模板字段必须是简单名字: {{{field}}}")
+                fields.append(field)
+        if len(chunks) == len(fields):
+            chunks.append("")
+
+        names = list(dict.fromkeys(fields))
+        params = "".join(f"{name}, " for name in names)
+        # 值统一先转成 str（数字等），Markup 保持原类型
+        convert = "".join(f"    if type({name}) is not str: {name} = _str({name})\n" for name in names)
+        probe = "".join(f"{name}, " for name in names)
+        escape = "".join(f"        {name} = _esc({name})\n" for name in names)
+        pieces = [repr(chunks[0])]
+        for field, chunk in zip(fields, chunks[1:]):
+            pieces += (field, repr(chunk))
+        code = (
+            f"def render(*, {params}_esc=escape_html, _str=_to_str):\n"
+            f"{convert}"
+            f"    probe = ''.join(({probe}))\n"
+            f"    if '&' in probe or '<' in probe or '>' in probe or '\"' in probe:\n"
+            f"{escape or '        pass'}\n"
+            f"    return ''.join(({', '.join(pieces)},))\n"
+        )
+        namespace: Dict[str, Any] = {"escape_html": escape_html, "_to_str": _to_str}
+        exec(code, namespace)
+
+        self.fields = tuple(names)
+        self.render = namespace["render"]
+
+
+def _to_str(value: Any) -> str:
+    return value if isinstance(value, str) else str(value)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(source: str) -> Template:
+    """模板源码 -> 编译结果（按源码缓存，每个模板只编译一次）。"""
+    return Template(source)
+
+
 # ========== 生成 HTML ==========
 
+# 所有课程页共用的样式和脚本。构建时压缩后写成 build/assets/lesson.<哈希>.css / .js，
+# 页面只放链接，浏览器逛多少课都只下载一次。
+LESSON_CSS = """
+body {
+    font-family: system-ui, -apple-system, BlinkMacSystemFont, "Segoe UI", sans-serif;
+    background-color: #f7f7f7;
+    margin: 0;
+    padding: 0;
+}
+header {
+    background: linear-gradient(135deg, #ffb347, #ffcc33);
+    padding: 1.2rem 1.5rem;
+    color: #222;
+    text-align: center;
+}
+header h1 {
+    margin: 0;
+    font-size: 1.6rem;
+}
+header p {
+    margin: 0.3rem 0 0;
+    font-size: 0.9rem;
+}
+main {
+    max-width: 900px;
+    margin: 0 auto;
+    padding: 1.2rem 1rem 2rem;
+}
+.tips {
+    background: #fff;
+    border-radius: 0.8rem;
+    padding: 0.8rem 1rem;
+    margin-bottom: 1rem;
+    box-shadow: 0 2px 4px rgba(0,0,0,0.04);
+    font-size: 0.9rem;
+    line-height: 1.4;
+}
+.phrase {
+    background: #fff;
+    border-radius: 0.9rem;
+    padding: 0.8rem 0.9rem;
+    margin-bottom: 0.6rem;
+    display: flex;
+    align-items: center;
+    gap: 0.8rem;
+    box-shadow: 0 1px 3px rgba(0,0,0,0.05);
+}
+.num {
+    font-weight: 600;
+    font-size: 0.85rem;
+    color: #ff9800;
+    width: 2.2rem;
+    text-align: center;
+}
+.text {
+    flex: 1;
+}
+.fr {
+    font-weight: 600;
+    margin-bottom: 0.15rem;
+}
+.zh {
+    font-size: 0.9rem;
+    color: #555;
+}
+.speak-btn {
+    border: none;
+    border-radius: 999px;
+    padding: 0.4rem 0.65rem;
+    cursor: pointer;
+    font-size: 0.9rem;
+    background: #ff9800;
+    color: #fff;
+    flex-shrink: 0;
+}
+.speak-btn:hover {
+    opacity: 0.9;
+}
+footer {
+    text-align: center;
+    font-size: 0.8rem;
+    color: #888;
+    padding: 1rem 0 1.5rem;
+}
+"""
+
+LESSON_JS = """
+const globalAudio = new Audio();
+
+function speakFallback(text) {
+    if (!("speechSynthesis" in window)) {
+        alert("Votre navigateur ne supporte pas la synthèse vocale.");
+        return;
+    }
+    const u = new SpeechSynthesisUtterance(text);
+    u.lang = "fr-FR";
+    u.rate = 0.85;
+    u.pitch = 1.0;
+    window.speechSynthesis.cancel();
+    window.speechSynthesis.speak(u);
+}
+
+// 整课音频 sprite：一个 mp3 + 每句的起止时间。页面打开就预加载，
+// 之后每次点击只是在同一个文件里 seek，重复播放全部走浏览器缓存。
+// 拿不到 sprite 时退回逐句的 data-audio 文件。
+const spriteUrl = document.querySelector("main").dataset.sprite || "";
+let sprite = null;
+let spriteLoading = null;
+let stopTimer = null;
+
+function loadSprite() {
+    if (!spriteUrl) {
+        return Promise.resolve(null);
+    }
+    if (!spriteLoading) {
+        spriteLoading = fetch(spriteUrl)
+            .then(function(r) { return r.ok ? r.json() : null; })
+            .then(function(index) {
+                if (index) {
+                    index.url = new URL(index.src, new URL(spriteUrl, location.href)).href;
+                    sprite = index;
+                    globalAudio.preload = "auto";
+                    globalAudio.src = sprite.url;
+                }
+                return sprite;
+            })
+            .catch(function() { return null; });
+    }
+    return spriteLoading;
+}
+
+function playFile(src, text) {
+    try {
+        globalAudio.pause();
+        globalAudio.src = src;
+        globalAudio.currentTime = 0;
+        globalAudio.play().catch(function() {
+            speakFallback(text);
+        });
+    } catch (e) {
+        console.error(e);
+        speakFallback(text);
+    }
+}
+
+function playSegment(seg, src, text) {
+    const start = function() {
+        globalAudio.currentTime = seg.start;
+        globalAudio.play().then(function() {
+            const ms = (seg.end - seg.start) * 1000 / (globalAudio.playbackRate || 1);
+            stopTimer = setTimeout(function() { globalAudio.pause(); }, ms);
+        }).catch(function() {
+            src ? playFile(src, text) : speakFallback(text);
+        });
+    };
+    globalAudio.pause();
+    if (globalAudio.src !== sprite.url) {
+        globalAudio.src = sprite.url;
+    }
+    if (globalAudio.readyState >= 1) {
+        start();
+    } else {
+        globalAudio.addEventListener("loadedmetadata", start, { once: true });
+    }
+}
+
+function playSentence(phraseEl) {
+    const text = phraseEl.dataset.fr || "";
+    const src = phraseEl.dataset.audio || "";
+    const num = phraseEl.dataset.num || "";
+
+    clearTimeout(stopTimer);
+    loadSprite().then(function(s) {
+        const seg = s && s.sentences[num];
+        if (seg) {
+            playSegment(seg, src, text);
+        } else if (src) {
+            playFile(src, text);
+        } else {
+            speakFallback(text);
+        }
+    });
+}
+
+loadSprite();
+"""
+
+# --inline-critical-css 时直接内联到页面里的首屏规则，其余样式异步加载
+LESSON_CRITICAL_SELECTORS = ("body", "header", "header h1", "header p", "main")
+
+HTML_STYLESHEET_TEMPLATE = """<link rel="stylesheet" href="{href}">"""
+
+HTML_CRITICAL_CSS_TEMPLATE = """<style>{css}</style>
+    <link rel="preload" href="{href}" as="style" onload="this.onload=null;this.rel='stylesheet'">
+    <noscript><link rel="stylesheet" href="{href}"></noscript>"""
+
+HTML_INLINE_CSS_TEMPLATE = """<style>{css}</style>"""
+
+HTML_SCRIPT_TEMPLATE = """<script src="{src}"></script>"""
+
+HTML_INLINE_SCRIPT_TEMPLATE = """<script>{js}</script>"""
+
 HTML_LESSON_TEMPLATE_HEAD = """<!DOCTYPE html>
 <html lang="fr">
 <head>
     <meta charset="UTF-8">
     <title>{title}</title>
     <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        body {{
-            font-family: system-ui, -apple-system, BlinkMacSystemFont, "Segoe UI", sans-serif;
-            background-color: #f7f7f7;
-            margin: 0;
-            padding: 0;
-        }}
-        header {{
-            background: linear-gradient(135deg, #ffb347, #ffcc33);
-            padding: 1.2rem 1.5rem;
-            color: #222;
-            text-align: center;
-        }}
-        header h1 {{
-            margin: 0;
-            font-size: 1.6rem;
-        }}
-        header p {{
-            margin: 0.3rem 0 0;
-            font-size: 0.9rem;
-        }}
-        main {{
-            max-width: 900px;
-            margin: 0 auto;
-            padding: 1.2rem 1rem 2rem;
-        }}
-        .tips {{
-            background: #fff;
-            border-radius: 0.8rem;
-            padding: 0.8rem 1rem;
-            margin-bottom: 1rem;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.04);
-            font-size: 0.9rem;
-            line-height: 1.4;
-        }}
-        .phrase {{
-            background: #fff;
-            border-radius: 0.9rem;
-            padding: 0.8rem 0.9rem;
-            margin-bottom: 0.6rem;
-            display: flex;
-            align-items: center;
-            gap: 0.8rem;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.05);
-        }}
-        .num {{
-            font-weight: 600;
-            font-size: 0.85rem;
-            color: #ff9800;
-            width: 2.2rem;
-            text-align: center;
-        }}
-        .text {{
-            flex: 1;
-        }}
-        .fr {{
-            font-weight: 600;
-            margin-bottom: 0.15rem;
-        }}
-        .zh {{
-            font-size: 0.9rem;
-            color: #555;
-        }}
-        .speak-btn {{
-            border: none;
-            border-radius: 999px;
-            padding: 0.4rem 0.65rem;
-            cursor: pointer;
-            font-size: 0.9rem;
-            background: #ff9800;
-            color: #fff;
-            flex-shrink: 0;
-        }}
-        .speak-btn:hover {{
-            opacity: 0.9;
-        }}
-        footer {{
-            text-align: center;
-            font-size: 0.8rem;
-            color: #888;
-            padding: 1rem 0 1.5rem;
-        }}
-    </style>
+    {styles}
 </head>
 <body>
     <header>
         <h1>{title}</h1>
         <p>{subtitle}</p>
     </header>
-    <main>
+    <main data-sprite="{sprite}">
         <section class="tips">
             <strong>使用方法：</strong>先看<b>法语句子</b>再对照<b>中文意思</b>，
             点右边的<b>▶️</b>听音频。优先播放 mp3，失败时用浏览器朗读兜底。
         </section>
 """
 
+HTML_PHRASE_TEMPLATE = """        <div class="phrase" id="{lesson_id}_{num}" data-num="{num}" data-fr="{fr}" data-audio="{audio}">
+            <div class="num">{num}</div>
+            <div class="text">
+                <div class="fr">{fr}</div>
+                <div class="zh">{zh}</div>
+            </div>
+            <button class="speak-btn" onclick="playSentence(this.closest('.phrase'))">▶️</button>
+        </div>"""
+
 HTML_LESSON_TEMPLATE_TAIL = """
     </main>
     <footer>
         Français · AWTZA
     </footer>
-    <script>
-        const globalAudio = new Audio();
-
-        function speakFallback(text) {
-            if (!("speechSynthesis" in window)) {
-                alert("Votre navigateur ne supporte pas la synthèse vocale.");
-                return;
-            }
-            const u = new SpeechSynthesisUtterance(text);
-            u.lang = "fr-FR";
-            u.rate = 0.85;
-            u.pitch = 1.0;
-            window.speechSynthesis.cancel();
-            window.speechSynthesis.speak(u);
-        }
-
-        function playSentence(phraseEl) {
-            const text = phraseEl.dataset.fr || "";
-            const src = phraseEl.dataset.audio || "";
-
-            if (src) {
-                try {
-                    globalAudio.pause();
-                    globalAudio.src = src;
-                    globalAudio.currentTime = 0;
-                    globalAudio.play().catch(function() {
-                        speakFallback(text);
-                    });
-                } catch (e) {
-                    console.error(e);
-                    speakFallback(text);
-                }
-            } else {
-                speakFallback(text);
-            }
-        }
-    </script>
+    {scripts}
 </body>
 </html>
 """
 
-def build_lesson_html(lesson: Dict[str, Any]) -> str:
-    head = HTML_LESSON_TEMPLATE_HEAD.format(
-        title=lesson["title"],
-        subtitle=lesson.get("title_zh", "") or lesson["id"],
+def minify_css(css: str) -> str:
+    """去注释、去多余空白、去每条规则最后的分号。只处理本脚本自己写的样式。"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+def minify_js(js: str) -> str:
+    """去缩进、空行和整行 // 注释；保留换行，不依赖分号自动插入规则出错。"""
+    kept = (line.strip() for line in js.splitlines())
+    return "\n".join(line for line in kept if line and not line.startswith("//"))
+
+
+@functools.lru_cache(maxsize=None)
+def critical_css(css: str, selectors: tuple[str, ...] = LESSON_CRITICAL_SELECTORS) -> str:
+    """从压缩后的样式里挑出 selectors 对应的规则（首屏布局），用于内联。"""
+    rules = re.findall(r"([^{}]+)\{([^{}]*)\}", css)
+    return "".join(f"{sel}{{{body}}}" for sel, body in rules if sel in selectors)
+
+
+def _lesson_styles(assets: Dict[str, str] | None) -> Markup:
+    """<head> 里的样式部分：有公共样式表就链接它（可选内联首屏规则），否则整段内联。"""
+    assets = assets or {}
+    href = assets.get(LESSON_CSS_REL)
+    if href is None:
+        return Markup(compile_template(HTML_INLINE_CSS_TEMPLATE).render(
+            css=Markup(minify_css(LESSON_CSS))))
+    if LESSON_CRITICAL_CSS_REL in assets:
+        return Markup(compile_template(HTML_CRITICAL_CSS_TEMPLATE).render(
+            css=Markup(critical_css(minify_css(LESSON_CSS))), href=href))
+    return Markup(compile_template(HTML_STYLESHEET_TEMPLATE).render(href=href))
+
+
+def _lesson_html_tail(assets: Dict[str, str] | None = None) -> str:
+    src = (assets or {}).get(LESSON_JS_REL)
+    if src is None:
+        scripts = compile_template(HTML_INLINE_SCRIPT_TEMPLATE).render(js=Markup(minify_js(LESSON_JS)))
+    else:
+        scripts = compile_template(HTML_SCRIPT_TEMPLATE).render(src=src)
+    return compile_template(HTML_LESSON_TEMPLATE_TAIL).render(scripts=Markup(scripts))
+
+
+def _phrase_block(lesson_id: str, idx: int, s: Sentence,
+                  assets: Dict[str, str] | None = None) -> str:
+    num = f"{idx:02d}"
+    audio = f"audio/{lesson_id}/{num}.mp3"
+    return compile_template(HTML_PHRASE_TEMPLATE).render(
+        lesson_id=lesson_id,
+        num=num,
+        fr=s.fr,
+        zh=s.zh,
+        audio=assets.get(audio, audio) if assets else audio,
     )
 
-    blocks: List[str] = []
-    sentences = lesson["sentences"]
-    lesson_id = lesson["id"]
 
-    for idx, s in enumerate(sentences, start=1):
-        fr = s["fr"]
-        zh = s.get("zh", "")
-        audio_rel = f"audio/{lesson_id}/{idx:02d}.mp3"
-        block = f'''        <div class="phrase" id="{lesson_id}_{idx:02d}" data-fr="{fr}" data-audio="{audio_rel}">
-            <div class="num">{idx:02d}</div>
-            <div class="text">
-                <div class="fr">{fr}</div>
-                <div class="zh">{zh}</div>
-            </div>
-            <button class="speak-btn" onclick="playSentence(this.closest('.phrase'))">▶️</button>
-        </div>'''
-        blocks.append(block)
+def _lesson_html_head(lesson: Lesson, assets: Dict[str, str] | None = None) -> str:
+    sprite = f"audio/{lesson.id}/{SPRITE_INDEX_NAME}"
+    return compile_template(HTML_LESSON_TEMPLATE_HEAD).render(
+        title=lesson.title,
+        subtitle=lesson.title_zh or lesson.id,
+        sprite=assets.get(sprite, sprite) if assets else sprite,
+        styles=_lesson_styles(assets),
+    )
 
-    body = "\n\n".join(blocks)
-    return head + body + HTML_LESSON_TEMPLATE_TAIL
 
+def build_lesson_html(lesson: Lesson, assets: Dict[str, str] | None = None) -> str:
+    """整页 HTML 字符串（导出文件时走 HtmlSink 流式写入，不经过这里）。
 
-def export_lesson_html(lesson: Dict[str, Any]) -> Path:
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = OUTPUT_DIR / f"{lesson['id']}.html"
-    html = build_lesson_html(lesson)
-    path.write_text(html, encoding="utf-8")
-    print(f"[OK] HTML: {path}")
-    return path
+    assets 是资源映射（build/ 下的相对路径 -> 实际路径），用于改写音频链接和
+    公共样式 / 脚本的地址；映射里没有 assets/lesson.css / .js 时样式和脚本直接内联。
+    """
+    blocks = [_phrase_block(lesson.id, idx, s, assets)
+              for idx, s in enumerate(lesson.sentences, start=1)]
+    return _lesson_html_head(lesson, assets) + "\n\n".join(blocks) + _lesson_html_tail(assets)
 
 
-# ========== 导出 CSV / MD / XLSX ==========
+# ========== 流式导出：每个 lesson 只遍历一次 sentences ==========
 
-def export_lesson_csv(lesson: Dict[str, Any]) -> Path:
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = OUTPUT_DIR / f"{lesson['id']}.csv"
-    with path.open("w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["#", "Français", "中文"])
-        for idx, s in enumerate(lesson["sentences"], start=1):
-            writer.writerow([idx, s["fr"], s.get("zh", "")])
-    print(f"[OK] CSV: {path}")
-    return path
+class LessonSink:
+    """一种导出格式。export_lesson 对每句调用 write_row，sink 边收边写文件。
 
+    子类设置 fmt（也是产物扩展名），实现 open / write_row / close；
+    open 返回 False 表示这次跳过该格式（例如缺少可选依赖）。
+    内容先写到 <产物>.tmp，close 时才替换正式文件；中途出错 abort 删掉临时文件，旧产物不受影响。
+    新格式只要写一个子类并登记到 LESSON_SINKS。
+    """
 
-def export_lesson_md(lesson: Dict[str, Any]) -> Path:
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = OUTPUT_DIR / f"{lesson['id']}.md"
-    lines: List[str] = []
-    for idx, s in enumerate(lesson["sentences"], start=1):
-        lines.append(f"## {idx:02d} {s['fr']}")
-        lines.append(s.get("zh", ""))
-        lines.append("")
-    path.write_text("\n".join(lines), encoding="utf-8")
-    print(f"[OK] MD:  {path}")
-    return path
+    fmt = ""
+    label = ""
 
+    def __init__(self, lesson: Lesson, assets: Dict[str, str] | None = None):
+        self.lesson = lesson
+        self.assets = assets or {}
+        self.path = OUTPUT_DIR / f"{lesson.id}.{self.fmt}"
+        self._tmp = self.path.with_name(self.path.name + ".tmp")
+        self._file: Any = None
 
-def export_lesson_xlsx(lesson: Dict[str, Any]) -> Path | None:
-    try:
-        from openpyxl import Workbook
-    except ImportError:
-        print("[WARN] 未安装 openpyxl，跳过 XLSX 导出。可以运行：python -m pip install openpyxl")
-        return None
+    def open(self) -> bool:
+        self._file = self._tmp.open("w", encoding="utf-8")
+        return True
 
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = OUTPUT_DIR / f"{lesson['id']}.xlsx"
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Phrases"
-    ws.append(["#", "Français", "中文"])
-    for idx, s in enumerate(lesson["sentences"], start=1):
-        ws.append([idx, s["fr"], s.get("zh", "")])
-    wb.save(path)
-    print(f"[OK] XLSX: {path}")
-    return path
+    def write_row(self, idx: int, s: Sentence) -> None:
+        raise NotImplementedError
 
+    def finish(self) -> None:
+        """写入结尾内容（如 HTML 的 TAIL），在关闭文件之前调用。"""
 
-# ========== Google Cloud TTS ==========
+    def close(self) -> Path:
+        self.finish()
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        print(f"[OK] {self.label} {self.path}")
+        return self.path
 
-def generate_lesson_tts(lesson: Dict[str, Any],
-                        speaking_rate: float = 0.85,
-                        voice_name: str | None = "fr-FR-Wavenet-D") -> None:
-    """为一个 lesson 生成 mp3。"""
-    try:
-        from google.cloud import texttospeech
-    except ImportError:
-        print("[ERROR] 未安装 google-cloud-texttospeech，无法生成 mp3。")
-        print("        请先运行：python -m pip install google-cloud-texttospeech")
-        return
+    def abort(self) -> None:
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        self._tmp.unlink(missing_ok=True)
 
-    try:
-        client = texttospeech.TextToSpeechClient()
-    except Exception as e:
-        print("[ERROR] 创建 TTS 客户端失败（多半是凭证问题）：", repr(e))
-        print("        请检查 GOOGLE_APPLICATION_CREDENTIALS 是否设置正确。")
-        return
 
-    lesson_id = lesson["id"]
-    sentences = lesson["sentences"]
-    audio_dir = AUDIO_ROOT / lesson_id
-    audio_dir.mkdir(parents=True, exist_ok=True)
+class HtmlSink(LessonSink):
+    fmt = "html"
+    label = "HTML:"
 
-    for idx, s in enumerate(sentences, start=1):
-        fr_text = s["fr"]
-        filename = audio_dir / f"{idx:02d}.mp3"
+    def open(self) -> bool:
+        super().open()
+        self._file.write(_lesson_html_head(self.lesson, self.assets))
+        return True
 
-        # 已存在就跳过，方便重复运行
-        if filename.exists():
-            print(f"[TTS] 跳过已有文件: {filename.name}")
-            continue
+    def write_row(self, idx: int, s: Sentence) -> None:
+        if idx > 1:
+            self._file.write("\n\n")
+        self._file.write(_phrase_block(self.lesson.id, idx, s, self.assets))
 
-        print(f"[TTS] 生成 {lesson_id} 第 {idx:02d} 句 -> {filename.name} : {fr_text}")
+    def finish(self) -> None:
+        self._file.write(_lesson_html_tail(self.assets))
 
-        synthesis_input = texttospeech.SynthesisInput(text=fr_text)
 
-        if voice_name:
-            voice = texttospeech.VoiceSelectionParams(
-                language_code="fr-FR",
-                name=voice_name,
-            )
-        else:
-            voice = texttospeech.VoiceSelectionParams(
-                language_code="fr-FR",
-            )
+class MdSink(LessonSink):
+    fmt = "md"
+    label = "MD: "
 
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
-            speaking_rate=speaking_rate,
-        )
+    def write_row(self, idx: int, s: Sentence) -> None:
+        if idx > 1:
+            self._file.write("\n")
+        self._file.write(f"## {idx:02d} {s.fr}\n{s.zh}\n")
 
-        try:
-            response = client.synthesize_speech(
-                input=synthesis_input,
-                voice=voice,
-                audio_config=audio_config,
-            )
-            filename.write_bytes(response.audio_content)
-        except Exception as e:
-            print(f"[ERROR] 生成 {lesson_id} 第 {idx:02d} 句失败: {e!r}")
-            continue
 
-    print(f"[OK] TTS 完成: {lesson_id}")
+class CsvSink(LessonSink):
+    fmt = "csv"
+    label = "CSV:"
 
+    def open(self) -> bool:
+        self._file = self._tmp.open("w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(["#", "Français", "中文"])
+        return True
 
+    def write_row(self, idx: int, s: Sentence) -> None:
+        self._writer.writerow([idx, s.fr, s.zh])
 
-# ========== 生成总 index.html（根目录） ==========
 
-# ========== 生成总 index.html（根目录，列出 build 里的所有 HTML） ==========
+# ---------- XLSX：直接流式写 SpreadsheetML ----------
 
-HTML_INDEX_TEMPLATE = """<!DOCTYPE html>
-<html lang="fr">
-<head>
-  <meta charset="UTF-8" />
-  <title>French Learning Index - fr.awtza.com</title>
-  <style>
-    body {{
-      font-family: system-ui, -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-      max-width: 900px;
-      margin: 2rem auto;
-      padding: 0 1rem;
-      background: #f7f7f7;
-    }}
-    h1 {{
-      margin-bottom: 0.5rem;
-    }}
-    .subtitle {{
-      color: #666;
-      margin-bottom: 1.5rem;
-      font-size: 0.9rem;
-    }}
-    ul {{
-      list-style: none;
-      padding-left: 0;
-      margin: 0;
-    }}
-    li {{
-      margin: 0.5rem 0;
-    }}
-    a {{
+# (表头, 列宽, 单元格样式)；样式编号对应 _XLSX_STYLES 里的 cellXfs
+XLSX_COLUMNS = (("#", 6, 1), ("Français", 60, 2), ("中文", 40, 2))
+XLSX_HEADER_STYLE = 3
+XLSX_MAX_ROWS = 1048576          # Excel 单个工作表的行数上限（含表头）
+XLSX_SHEET_NAME_MAX = 31
+XLSX_ZIP_DATE = (1980, 1, 1, 0, 0, 0)   # 固定 zip 条目时间：内容不变，文件字节也不变
+XLSX_FLUSH_ROWS = 512
+# XML 1.0 不允许的字符（openpyxl 遇到会直接报错，这里去掉）
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+
+_XLSX_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_XLSX_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XLSX_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XLSX_CT = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# 0 默认；1 编号列居中；2 文本列顶端对齐 + 自动换行；3 表头加粗 + 浅灰底
+_XLSX_STYLES = (
+    f'{_XML_DECL}<styleSheet xmlns="{_XLSX_NS}">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="3"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFEEEEEE"/><bgColor indexed="64"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="1" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="top"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyAlignment="1">'
+    '<alignment vertical="top" wrapText="1"/></xf>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1" applyAlignment="1">'
+    '<alignment horizontal="center"/></xf></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+_XLSX_NUM_CELLS = tuple(f'<c s="{style}"><v>' for _header, _width, style in XLSX_COLUMNS)
+_XLSX_STR_CELLS = tuple(f'<c s="{style}" t="inlineStr"><is><t xml:space="preserve">'
+                        for _header, _width, style in XLSX_COLUMNS)
+
+
+def _xlsx_text(value: str) -> str:
+    value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    if _XML_ILLEGAL.search(value):
+        value = _XML_ILLEGAL.sub("", value)
+    return value
+
+
+def _xlsx_sheet_name(name: str, used: set[str]) -> str:
+    """合法且不重复的工作表名：去掉 []:*?/\\，最长 31 个字符，重名时加 (2)、(3)……"""
+    base = re.sub(r"[\[\]:*?/\\]", "_", name).strip("'") or "Sheet"
+    candidate = base[:XLSX_SHEET_NAME_MAX]
+    n = 2
+    while candidate.lower() in used:
+        suffix = f" ({n})"
+        candidate = base[:XLSX_SHEET_NAME_MAX - len(suffix)] + suffix
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+class XlsxWriter:
+    """不依赖 openpyxl 的流式 xlsx 写入器，内存占用与行数无关。
+
+    每个工作表作为 zip 里的一个条目边写边压缩；字符串用 inlineStr 直接写进单元格，
+    不建共享字符串表（那需要把所有字符串留在内存里）。列宽 / 样式见 XLSX_COLUMNS，
+    表头加粗并冻结。一个工作表写满 Excel 的行数上限后自动续到 "<名字> (2)"。
+    先写 <path>.tmp，close 时再替换，中断不会留下半个文件。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._tmp = path.with_name(path.name + ".tmp")
+        self._zip = zipfile.ZipFile(self._tmp, "w")
+        self._sheets: List[str] = []
+        self._used: set[str] = set()
+        self._out: Any = None
+        self._base = ""
+        self._rows = 0
+        self._buf: List[str] = []
+
+    def _entry(self, name: str) -> Any:
+        info = zipfile.ZipInfo(name, date_time=XLSX_ZIP_DATE)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return self._zip.open(info, "w")
+
+    def add_sheet(self, name: str) -> None:
+        """开始一个新工作表，写好列格式和表头；之后的 append 都写进这个表。"""
+        self._end_sheet()
+        self._base = name
+        self._begin_sheet(_xlsx_sheet_name(name, self._used))
+
+    def _begin_sheet(self, title: str) -> None:
+        self._sheets.append(title)
+        self._out = self._entry(f"xl/worksheets/sheet{len(self._sheets)}.xml")
+        cols = "".join(f'<col min="{n}" max="{n}" width="{width}" customWidth="1" style="{style}"/>'
+                       for n, (_header, width, style) in enumerate(XLSX_COLUMNS, start=1))
+        header = "".join(f'<c r="{chr(65 + n)}1" s="{XLSX_HEADER_STYLE}" t="inlineStr">'
+                         f'<is><t>{_xlsx_text(text)}</t></is></c>'
+                         for n, (text, _width, _style) in enumerate(XLSX_COLUMNS))
+        self._out.write(
+            f'{_XML_DECL}<worksheet xmlns="{_XLSX_NS}" xmlns:r="{_XLSX_REL_NS}">'
+            '<sheetViews><sheetView workbookViewId="0">'
+            '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+            '</sheetView></sheetViews><sheetFormatPr defaultRowHeight="15"/>'
+            f'<cols>{cols}</cols><sheetData><row r="1">{header}</row>'.encode("utf-8"))
+        self._rows = 1
+
+    def append(self, values: tuple[Any, ...]) -> None:
+        """写一行；int / float 写成数字，其它写成文本，样式取所在列的。"""
+        if self._rows >= XLSX_MAX_ROWS:
+            self._end_sheet()
+            self._begin_sheet(_xlsx_sheet_name(self._base, self._used))
+        self._rows += 1
+        # 单元格的 r 属性可以省略，按顺序排列即可；每格的开头标签预先拼好
+        cells = []
+        for n, value in enumerate(values):
+            if type(value) is int or type(value) is float:
+                cells.append(f"{_XLSX_NUM_CELLS[n]}{value}</v></c>")
+            else:
+                cells.append(f"{_XLSX_STR_CELLS[n]}{_xlsx_text(str(value))}</t></is></c>")
+        self._buf.append(f'<row r="{self._rows}">{"".join(cells)}</row>')
+        if len(self._buf) >= XLSX_FLUSH_ROWS:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buf:
+            self._out.write("".join(self._buf).encode("utf-8"))
+            self._buf.clear()
+
+    def _end_sheet(self) -> None:
+        if self._out is None:
+            return
+        self._flush()
+        self._out.write(b"</sheetData></worksheet>")
+        self._out.close()
+        self._out = None
+
+    def close(self) -> Path:
+        """写工作簿结构（workbook / rels / 样式 / 内容类型），然后替换成正式文件。"""
+        if not self._sheets:
+            self.add_sheet("Sheet")
+        self._end_sheet()
+        count = len(self._sheets)
+        sheets = "".join(f'<sheet name="{_xlsx_text(title).replace(chr(34), "&quot;")}" '
+                         f'sheetId="{n}" r:id="rId{n}"/>'
+                         for n, title in enumerate(self._sheets, start=1))
+        rels = "".join(f'<Relationship Id="rId{n}" Type="{_XLSX_REL_NS}/worksheet" '
+                       f'Target="worksheets/sheet{n}.xml"/>' for n in range(1, count + 1))
+        overrides = "".join(f'<Override PartName="/xl/worksheets/sheet{n}.xml" '
+                            f'ContentType="{_XLSX_CT}.worksheet+xml"/>' for n in range(1, count + 1))
+        parts = {
+            "[Content_Types].xml":
+                f'{_XML_DECL}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                f'<Override PartName="/xl/workbook.xml" ContentType="{_XLSX_CT}.sheet.main+xml"/>'
+                f'<Override PartName="/xl/styles.xml" ContentType="{_XLSX_CT}.styles+xml"/>'
+                f'{overrides}</Types>',
+            "_rels/.rels":
+                f'{_XML_DECL}<Relationships xmlns="{_XLSX_PKG_REL_NS}">'
+                f'<Relationship Id="rId1" Type="{_XLSX_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+                '</Relationships>',
+            "xl/workbook.xml":
+                f'{_XML_DECL}<workbook xmlns="{_XLSX_NS}" xmlns:r="{_XLSX_REL_NS}">'
+                f'<sheets>{sheets}</sheets></workbook>',
+            "xl/_rels/workbook.xml.rels":
+                f'{_XML_DECL}<Relationships xmlns="{_XLSX_PKG_REL_NS}">{rels}'
+                f'<Relationship Id="rId{count + 1}" Type="{_XLSX_REL_NS}/styles" Target="styles.xml"/>'
+                '</Relationships>',
+            "xl/styles.xml": _XLSX_STYLES,
+        }
+        for name, xml in parts.items():
+            with self._entry(name) as f:
+                f.write(xml.encode("utf-8"))
+        self._zip.close()
+        os.replace(self._tmp, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        self._zip.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+class XlsxSink(LessonSink):
+    fmt = "xlsx"
+    label = "XLSX:"
+
+    def open(self) -> bool:
+        self._writer = XlsxWriter(self.path)
+        self._writer.add_sheet("Phrases")
+        return True
+
+    def write_row(self, idx: int, s: Sentence) -> None:
+        self._writer.append((idx, s.fr, s.zh))
+
+    def close(self) -> Path:
+        self._writer.close()
+        print(f"[OK] {self.label} {self.path}")
+        return self.path
+
+    def abort(self) -> None:
+        self._writer.abort()
+
+
+# 格式名 -> sink 类；产物统一是 build/<id>.<格式名>
+LESSON_SINKS: Dict[str, type[LessonSink]] = {
+    "html": HtmlSink,
+    "md": MdSink,
+    "csv": CsvSink,
+    "xlsx": XlsxSink,
+}
+
+
+def export_lesson(lesson: Lesson, formats: List[str] | None = None,
+                  assets: Dict[str, str] | None = None,
+                  report: BuildReport | None = None) -> Dict[str, Path | None]:
+    """遍历一次 lesson.sentences，把每一行同时喂给所有格式的 sink。
+
+    返回 {格式: 产物路径}；被跳过的格式对应 None。assets 见 build_lesson_html。
+    传入 report 时按格式记录耗时（打开 + 逐行 + 保存）和产物字节数，记在 export.<格式>。
+    """
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    results: Dict[str, Path | None] = {}
+    sinks: List[LessonSink] = []
+    elapsed: Dict[str, float] = {}
+    try:
+        for fmt in formats or list(LESSON_SINKS):
+            start = time.perf_counter()
+            sink = LESSON_SINKS[fmt](lesson, assets)
+            if sink.open():
+                sinks.append(sink)
+            else:
+                results[fmt] = None
+            elapsed[fmt] = time.perf_counter() - start
+
+        # 每行只取 len(sinks) + 1 次时间戳，计时开销相对渲染可以忽略
+        for idx, s in enumerate(lesson.sentences, start=1):
+            start = time.perf_counter()
+            for sink in sinks:
+                sink.write_row(idx, s)
+                now = time.perf_counter()
+                elapsed[sink.fmt] += now - start
+                start = now
+
+        for sink in sinks:
+            start = time.perf_counter()
+            results[sink.fmt] = sink.close()
+            elapsed[sink.fmt] += time.perf_counter() - start
+    except BaseException:
+        for sink in sinks:
+            sink.abort()
+        raise
+    if report is not None:
+        for fmt, path in results.items():
+            size = path.stat().st_size if path is not None else 0
+            report.add(f"export.{fmt}", lesson.id, wall=elapsed[fmt], bytes=size, misses=1)
+    return results
+
+
+def export_lesson_html(lesson: Lesson) -> Path:
+    return export_lesson(lesson, ["html"])["html"]
+
+
+def export_lesson_csv(lesson: Lesson) -> Path:
+    return export_lesson(lesson, ["csv"])["csv"]
+
+
+def export_lesson_md(lesson: Lesson) -> Path:
+    return export_lesson(lesson, ["md"])["md"]
+
+
+def export_lesson_xlsx(lesson: Lesson) -> Path | None:
+    return export_lesson(lesson, ["xlsx"])["xlsx"]
+
+
+COMBINED_XLSX_PATH = OUTPUT_DIR / "lessons.xlsx"
+
+
+def export_combined_xlsx(lessons: List[Lesson], manifest: Dict[str, Any],
+                         report: BuildReport | None = None) -> Path:
+    """把所有 lesson 写进一个工作簿 build/lessons.xlsx，每课一个工作表（表名取 lesson id）。
+
+    和单课 xlsx 一样流式写出；输入指纹记在 manifest["xlsx_combined"]，没有变化时跳过。
+    """
+    key = _sha256(str(EXPORTER_VERSIONS["xlsx"]),
+                  *(f"{lesson.id}:{lesson.source_hash}" for lesson in lessons))
+    if manifest.get("xlsx_combined") == key and COMBINED_XLSX_PATH.exists():
+        print("[SKIP] 合并工作簿: 内容未变化")
+        if report is not None:
+            report.add("xlsx_combined", hits=1)
+        return COMBINED_XLSX_PATH
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    writer = XlsxWriter(COMBINED_XLSX_PATH)
+    try:
+        for lesson in lessons:
+            writer.add_sheet(lesson.id)
+            for idx, s in enumerate(lesson.sentences, start=1):
+                writer.append((idx, s.fr, s.zh))
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    manifest["xlsx_combined"] = key
+    if report is not None:
+        report.add("xlsx_combined", misses=1, bytes=COMBINED_XLSX_PATH.stat().st_size)
+    print(f"[OK] 合并工作簿: {COMBINED_XLSX_PATH}（{len(lessons)} 个工作表）")
+    return COMBINED_XLSX_PATH
+
+
+# ========== Google Cloud TTS ==========
+
+# 并发与限流的默认值（可用命令行参数覆盖）
+TTS_WORKERS = 4
+TTS_REQUESTS_PER_SECOND = 10.0
+TTS_CHARS_PER_MINUTE = 150_000
+TTS_MAX_RETRIES = 5
+TTS_AUDIO_ENCODING = "MP3"
+
+# 这些错误（google.api_core.exceptions 里的类名）一般重试就能好
+TRANSIENT_TTS_ERRORS = {
+    "ServiceUnavailable",
+    "TooManyRequests",
+    "ResourceExhausted",
+    "DeadlineExceeded",
+    "InternalServerError",
+    "BadGateway",
+    "GatewayTimeout",
+    "Aborted",
+}
+
+_tts_client: Any = None
+
+
+class TokenBucket:
+    """线程安全的令牌桶：每秒补充 rate 个令牌，最多攒 capacity 个。"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0) -> None:
+        # 单次请求超过桶容量时按容量算，否则永远等不到
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TtsRateLimiter:
+    """同时限制每秒请求数和每分钟字符数，所有 lesson / 线程共用一个。"""
+
+    def __init__(self,
+                 requests_per_second: float = TTS_REQUESTS_PER_SECOND,
+                 chars_per_minute: float = TTS_CHARS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        # 字符桶最多攒 10 秒的额度，避免开头一次性打满整分钟的配额
+        self.chars = TokenBucket(chars_per_minute / 60, max(1.0, chars_per_minute / 6))
+        # 实际发出的请求数 / 字符数（含重试），供构建报告统计
+        self.sent_requests = 0
+        self.sent_chars = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, text: str) -> None:
+        self.requests.acquire(1)
+        self.chars.acquire(len(text))
+        with self._lock:
+            self.sent_requests += 1
+            self.sent_chars += len(text)
+
+
+def _is_transient_tts_error(e: Exception) -> bool:
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_TTS_ERRORS for cls in type(e).__mro__)
+
+
+def _get_tts_client() -> Any:
+    """创建（并缓存）TTS 客户端；失败时打印原因并返回 None。
+
+    设置环境变量 TTS_API_ENDPOINT（如 http://127.0.0.1:8090）时改走 REST 传输、
+    匿名凭证，方便对着本地的假 TTS 服务调试和压测。
+    """
+    global _tts_client
+    if _tts_client is not None:
+        return _tts_client
+
+    try:
+        from google.cloud import texttospeech
+    except ImportError:
+        print("[ERROR] 未安装 google-cloud-texttospeech，无法生成 mp3。")
+        print("        请先运行：python -m pip install google-cloud-texttospeech")
+        return None
+
+    endpoint = os.environ.get("TTS_API_ENDPOINT")
+    try:
+        if endpoint:
+            from google.auth.credentials import AnonymousCredentials
+            _tts_client = texttospeech.TextToSpeechClient(
+                credentials=AnonymousCredentials(),
+                transport="rest",
+                client_options={"api_endpoint": endpoint},
+            )
+        else:
+            _tts_client = texttospeech.TextToSpeechClient()
+    except Exception as e:
+        print("[ERROR] 创建 TTS 客户端失败（多半是凭证问题）：", repr(e))
+        print("        请检查 GOOGLE_APPLICATION_CREDENTIALS 是否设置正确。")
+        return None
+    return _tts_client
+
+
+def _synthesize_with_retry(client: Any, limiter: TtsRateLimiter, text: str,
+                           voice: Any, audio_config: Any,
+                           max_retries: int = TTS_MAX_RETRIES) -> bytes:
+    """限流后调用 synthesize_speech；临时性错误按指数退避 + 随机抖动重试。"""
+    from google.cloud import texttospeech
+
+    for attempt in range(max_retries + 1):
+        limiter.acquire(text)
+        try:
+            response = client.synthesize_speech(
+                input=texttospeech.SynthesisInput(text=text),
+                voice=voice,
+                audio_config=audio_config,
+            )
+            return response.audio_content
+        except Exception as e:
+            if attempt >= max_retries or not _is_transient_tts_error(e):
+                raise
+            # full jitter：在 [0, min(上限, 0.5 * 2^n)] 里随机等待
+            delay = random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+            print(f"[TTS] 临时错误 {type(e).__name__}，{delay:.1f}s 后第 {attempt + 1} 次重试")
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+# ---------- 共享音频库：按 (文本, 声音, 语速, 编码) 寻址 ----------
+
+def normalize_text(text: str) -> str:
+    """用于去重/寻址的文本规范化：Unicode NFC、统一撇号、压缩空白。"""
+    text = unicodedata.normalize("NFC", text)
+    text = text.replace("\u2019", "'").replace("\u02bc", "'")
+    return " ".join(text.split())
+
+
+def audio_key(text: str, voice_name: str | None, speaking_rate: float,
+              encoding: str = TTS_AUDIO_ENCODING) -> str:
+    """音频库里的 blob 名：同一句话、同一声音和语速只合成一次。"""
+    return _sha256(normalize_text(text), voice_name or "", f"{speaking_rate:g}", encoding)[:32]
+
+
+def _audio_blob(key: str) -> Path:
+    return AUDIO_STORE / f"{key}.mp3"
+
+
+def _load_audio_map(audio_dir: Path) -> Dict[str, str] | None:
+    """读取 audio/<id>/index.json（"01" -> blob key）；没有时返回 None（旧布局）。"""
+    path = audio_dir / AUDIO_MAP_NAME
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"[WARN] 音频映射解析失败，将重新核对: {path} -> {e!r}")
+        return {}
+
+
+def _place_file(src: Path, dst: Path) -> None:
+    """把 src 放到 dst：优先硬链接，不支持时复制；都经由临时文件原子替换。"""
+    if dst.exists() and os.path.samefile(src, dst):
+        # 已经是同一个文件；此时 rename 会什么都不做，临时文件反而留下来
+        return
+    tmp = dst.with_name(dst.name + ".tmp")
+    if tmp.exists():
+        tmp.unlink()
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        # 复制失败（磁盘满、中断等）时不要把半截临时文件留在音频目录里
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def gc_audio_store(max_bytes: int | None = None) -> None:
+    """清理音频库里没有任何 lesson 引用的 blob。
+
+    max_bytes 为 None 时全部删除；否则把未引用的 blob 当作 LRU 缓存，
+    按最近使用时间从旧到新删除，直到整个音频库不超过 max_bytes。
+    被引用的 blob 永远不会删除。
+    """
+    if not AUDIO_STORE.exists():
+        return
+
+    referenced: set[str] = set()
+    for map_path in AUDIO_ROOT.glob(f"*/{AUDIO_MAP_NAME}"):
+        referenced.update((_load_audio_map(map_path.parent) or {}).values())
+
+    blobs = [(p.stat(), p) for p in AUDIO_STORE.glob("*.mp3")]
+    total = sum(st.st_size for st, _ in blobs)
+    unreferenced = sorted(((st, p) for st, p in blobs if p.stem not in referenced),
+                          key=lambda item: item[0].st_mtime)
+
+    removed = freed = 0
+    for st, p in unreferenced:
+        if max_bytes is not None and total <= max_bytes:
+            break
+        p.unlink()
+        total -= st.st_size
+        removed += 1
+        freed += st.st_size
+
+    if removed:
+        print(f"[GC] 音频库删除 {removed} 个未引用 blob，释放 {freed / 1024:.1f} KB")
+
+
+def generate_lesson_tts(lesson: Lesson,
+                        speaking_rate: float = 0.85,
+                        voice_name: str | None = "fr-FR-Wavenet-D",
+                        workers: int = TTS_WORKERS,
+                        limiter: TtsRateLimiter | None = None,
+                        report: BuildReport | None = None) -> None:
+    """为一个 lesson 生成 mp3。
+
+    音频实际存放在共享音频库 build/.audio_store/<key>.mp3，key 由文本、声音、语速、
+    编码决定；build/audio/<id>/<nn>.mp3 是从音频库链接（或复制）出来的，
+    audio/<id>/index.json 记录每个编号对应的 key。这样句子重排/插入后编号与
+    音频仍然对得上，多个 lesson 里的同一句话也只调用一次 API。
+    缺失的句子用线程池并发合成，受 limiter 限流。
+    report 里记录音频库命中 / 需要合成的句数、请求数、字符数和新写入的字节数。
+    """
+    lesson_id = lesson.id
+    audio_dir = AUDIO_ROOT / lesson_id
+
+    wanted: Dict[str, str] = {}
+    texts: Dict[str, str] = {}
+    for idx, s in enumerate(lesson.sentences, start=1):
+        key = audio_key(s.fr, voice_name, speaking_rate)
+        wanted[f"{idx:02d}"] = key
+        texts.setdefault(key, s.fr)
+
+    old_map = _load_audio_map(audio_dir)
+    if old_map == wanted and all((audio_dir / f"{nn}.mp3").exists() for nn in wanted):
+        print(f"[TTS] 跳过 {lesson_id}：音频均已存在")
+        if report is not None:
+            report.add("tts", lesson_id, hits=len(texts))
+        return
+
+    AUDIO_STORE.mkdir(parents=True, exist_ok=True)
+    audio_dir.mkdir(parents=True, exist_ok=True)
+
+    # 音频库里缺的 blob，先看看能不能从已有的单句文件里收回来：
+    # - 映射里记录的 key 与现在一致（blob 被 GC 掉了，但单句文件还在）
+    # - 还没有 index.json 的旧布局：沿用以前"文件存在即可用"的假设
+    for nn, key in wanted.items():
+        blob = _audio_blob(key)
+        legacy = audio_dir / f"{nn}.mp3"
+        if blob.exists() or not legacy.exists():
+            continue
+        if old_map is None or old_map.get(nn) == key:
+            _place_file(legacy, blob)
+
+    todo = [(key, texts[key], _audio_blob(key)) for key in dict.fromkeys(wanted.values())
+            if not _audio_blob(key).exists()]
+
+    if limiter is None:
+        limiter = TtsRateLimiter()
+    sent = (limiter.sent_requests, limiter.sent_chars)
+    if todo:
+        _synthesize_missing(lesson_id, todo, speaking_rate, voice_name, workers, limiter)
+    if report is not None:
+        report.add("tts", lesson_id, hits=len(texts) - len(todo), misses=len(todo),
+                   tts_calls=limiter.sent_requests - sent[0],
+                   tts_chars=limiter.sent_chars - sent[1],
+                   bytes=sum(blob.stat().st_size for _, _, blob in todo if blob.exists()))
+
+    # 按映射把 blob 放到 audio/<id>/<nn>.mp3
+    new_map: Dict[str, str] = {}
+    for nn, key in wanted.items():
+        blob = _audio_blob(key)
+        target = audio_dir / f"{nn}.mp3"
+        if not blob.exists():
+            continue  # 合成失败，下次再试
+        if (old_map or {}).get(nn) != key or not target.exists():
+            _place_file(blob, target)
+        # 更新 mtime，供 gc_audio_store 的 LRU 使用
+        os.utime(blob)
+        new_map[nn] = key
+
+    # lesson 变短时，删掉多出来的旧编号文件。只看纯数字的文件名：sprite.mp3、all.mp3、
+    # <section>_all.mp3 和 NN.<哈希>.mp3 指纹副本都归各自的阶段管
+    for path in audio_dir.glob("*.mp3"):
+        if path.stem.isdigit() and path.stem not in wanted:
+            path.unlink()
+
+    (audio_dir / AUDIO_MAP_NAME).write_text(
+        json.dumps(new_map, indent=2, sort_keys=True), encoding="utf-8")
+
+    missing = len(wanted) - len(new_map)
+    if missing:
+        print(f"[WARN] TTS 完成: {lesson_id}，{missing} 句失败，下次运行会重试")
+    else:
+        print(f"[OK] TTS 完成: {lesson_id}")
+
+
+def _synthesize_missing(lesson_id: str, todo: List[tuple[str, str, Path]],
+                        speaking_rate: float, voice_name: str | None,
+                        workers: int, limiter: TtsRateLimiter) -> None:
+    """用线程池并发合成 todo 里的 (key, 文本, blob 路径)。"""
+    client = _get_tts_client()
+    if client is None:
+        return
+    from google.cloud import texttospeech
+
+    if voice_name:
+        voice = texttospeech.VoiceSelectionParams(
+            language_code="fr-FR",
+            name=voice_name,
+        )
+    else:
+        voice = texttospeech.VoiceSelectionParams(
+            language_code="fr-FR",
+        )
+
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=getattr(texttospeech.AudioEncoding, TTS_AUDIO_ENCODING),
+        speaking_rate=speaking_rate,
+    )
+
+    def synthesize(fr_text: str, blob: Path) -> None:
+        audio = _synthesize_with_retry(client, limiter, fr_text, voice, audio_config)
+        # 先写临时文件再改名，中断时不会留下半个 mp3 被当成缓存
+        tmp = blob.with_name(blob.name + ".tmp")
+        tmp.write_bytes(audio)
+        os.replace(tmp, blob)
+
+    print(f"[TTS] {lesson_id}: 需要生成 {len(todo)} 句（{workers} 个并发）")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(synthesize, fr_text, blob): fr_text
+            for _key, fr_text, blob in todo
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            fr_text = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"[ERROR] 生成 {lesson_id} 「{fr_text}」失败: {e!r}")
+                continue
+            print(f"[TTS] {lesson_id} [{done}/{len(todo)}] {fr_text}")
+
+
+# ========== MP3 帧工具 ==========
+
+# MPEG Layer III 码率表（kbps），下标是帧头里的 bitrate index
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),   # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),       # MPEG-2 / 2.5
+}
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),   # MPEG-1
+    2: (22050, 24000, 16000),   # MPEG-2
+    0: (11025, 12000, 8000),    # MPEG-2.5
+}
+
+
+class Mp3Frame:
+    """MP3 里的一帧：在原始数据中的位置、长度，以及它代表的采样数。"""
+
+    __slots__ = ("offset", "length", "samples", "sample_rate")
+
+    def __init__(self, offset: int, length: int, samples: int, sample_rate: int):
+        self.offset = offset
+        self.length = length
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+
+def _parse_mp3_header(data: bytes, pos: int) -> Mp3Frame | None:
+    """解析 pos 处的 MPEG Layer III 帧头，不是合法帧头时返回 None。"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2 = data[pos + 1], data[pos + 2]
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_idx = b2 >> 4
+    rate_idx = (b2 >> 2) & 0x03
+    if version == 1 or layer != 1 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[1 if mpeg1 else 2][bitrate_idx] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_idx]
+    padding = (b2 >> 1) & 0x01
+    samples = 1152 if mpeg1 else 576
+    length = samples // 8 * bitrate // sample_rate + padding
+    return Mp3Frame(pos, length, samples, sample_rate)
+
+
+def _is_vbr_info_frame(data: bytes, frame: Mp3Frame) -> bool:
+    """Xing / Info / VBRI 头帧只存元数据，拼接时必须丢掉，否则播放器会算错总时长。"""
+    body = data[frame.offset:frame.offset + min(frame.length, 64)]
+    return b"Xing" in body or b"Info" in body or b"VBRI" in body
+
+
+def iter_mp3_frames(data: bytes) -> Iterator[Mp3Frame]:
+    """逐帧产出 MP3 音频帧，跳过 ID3v2 / ID3v1 标签和 VBR 信息帧。"""
+    pos = 0
+    end = len(data)
+    if data[-128:-125] == b"TAG":
+        end -= 128
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+
+    first = True
+    while pos < end:
+        frame = _parse_mp3_header(data, pos)
+        if frame is None or pos + frame.length > end:
+            # 不认识的字节（坏数据/其它标签），往后找下一个帧同步字
+            pos += 1
+            continue
+        if not (first and _is_vbr_info_frame(data, frame)):
+            yield frame
+        first = False
+        pos += frame.length
+
+
+def _silent_frame(header: bytes) -> bytes:
+    """按参考帧头造一个静音帧：同样的版本/采样率/码率/声道，无 CRC、无填充。
+
+    side info 全 0（main_data_begin = 0，part2_3_length = 0），解码出来就是静音，
+    也不会引用前一帧的 bit reservoir。
+    """
+    hdr = bytearray(header[:4])
+    hdr[1] |= 0x01   # protection bit = 1：没有 CRC
+    hdr[2] &= ~0x02  # padding = 0
+    frame = _parse_mp3_header(bytes(hdr), 0)
+    if frame is None:
+        raise ValueError("参考帧头不是合法的 MPEG Layer III 帧头")
+    return bytes(hdr) + bytes(frame.length - 4)
+
+
+def _silence(header: bytes, seconds: float) -> tuple[bytes, float]:
+    """返回至少 seconds 秒的静音帧序列及其实际时长（按整帧取整）。"""
+    if seconds <= 0:
+        return b"", 0.0
+    frame = _parse_mp3_header(header, 0)
+    assert frame is not None
+    count = max(1, round(seconds / frame.duration))
+    return _silent_frame(header) * count, count * frame.duration
+
+
+@contextlib.contextmanager
+def _mapped(path: Path) -> Iterator[Any]:
+    """只读内存映射一个文件；空文件给出 b""（mmap 不能映射长度 0）。"""
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def merge_mp3(inputs: List[Path], out: Path,
+              lead: float = 0.0, gap: float | List[float] = 0.0) -> List[Dict[str, Any] | None]:
+    """按帧拼接若干 mp3，不解码、不重新编码。
+
+    开头插入 lead 秒静音，每个输入之后插入 gap 秒静音（gap 也可以是和 inputs 等长的列表，
+    逐个指定；静音帧按第一个输入的帧头现造）。输入通过 mmap 读取，只拷贝音频帧本身。
+    返回和 inputs 一一对应的列表：每个输入在结果里的 {start, end, byte_start, byte_end}
+    （秒 / 字节）；没有有效 MP3 帧（空文件、截断、损坏）的输入没有写入，对应 None。
+    """
+    spans: List[Dict[str, Any] | None] = []
+    gaps = gap if isinstance(gap, list) else [gap] * len(inputs)
+    silences: Dict[float, tuple[bytes, float]] = {}
+    ref_header: bytes | None = None
+    ref_format: tuple[int, int] | None = None
+    byte_pos = 0
+    seconds = 0.0
+
+    tmp = out.with_name(out.name + ".tmp")
+    with tmp.open("wb") as f:
+        for path, gap_seconds in zip(inputs, gaps):
+            with _mapped(path) as data:
+                frames = iter_mp3_frames(data)
+                first = next(frames, None)
+                if first is None:
+                    print(f"[WARN] 没有找到 MP3 帧，跳过: {path}")
+                    spans.append(None)
+                    continue
+
+                if ref_header is None:
+                    ref_header = bytes(data[first.offset:first.offset + 4])
+                    ref_format = (first.sample_rate, data[first.offset + 3] >> 6)
+                    silence_lead, lead_time = _silence(ref_header, lead)
+                    f.write(silence_lead)
+                    byte_pos += len(silence_lead)
+                    seconds += lead_time
+                elif (first.sample_rate, data[first.offset + 3] >> 6) != ref_format:
+                    print(f"[WARN] 采样率/声道与第一个文件不同，拼接后可能播放异常: {path}")
+
+                start_byte, start_time = byte_pos, seconds
+                for frame in itertools.chain((first,), frames):
+                    f.write(data[frame.offset:frame.offset + frame.length])
+                    byte_pos += frame.length
+                    seconds += frame.duration
+                spans.append({
+                    "start": round(start_time, 4),
+                    "end": round(seconds, 4),
+                    "byte_start": start_byte,
+                    "byte_end": byte_pos,
+                })
+
+            if gap_seconds not in silences:
+                silences[gap_seconds] = _silence(ref_header, gap_seconds)
+            silence_gap, gap_time = silences[gap_seconds]
+            f.write(silence_gap)
+            byte_pos += len(silence_gap)
+            seconds += gap_time
+    os.replace(tmp, out)
+    return spans
+
+
+# ========== 整课音频 sprite ==========
+
+SPRITE_NAME = "sprite.mp3"
+SPRITE_INDEX_NAME = "sprite.json"
+
+
+def build_lesson_sprite(lesson: Lesson, report: BuildReport | None = None) -> Path | None:
+    """把一个 lesson 的逐句 mp3 按编号拼成 audio/<id>/sprite.mp3，并写 sprite.json。
+
+    sprite.json 记录每句在 sprite 里的起止时间（秒）和字节偏移，页面据此 seek。
+    直接按帧拼接、不重新编码；逐句文件保持不变，作为后备。
+    输入（audio/<id>/index.json）没变时跳过。
+    """
+    audio_dir = AUDIO_ROOT / lesson.id
+    map_path = audio_dir / AUDIO_MAP_NAME
+    if not map_path.exists():
+        return None
+
+    index_path = audio_dir / SPRITE_INDEX_NAME
+    sprite_path = audio_dir / SPRITE_NAME
+    key = _sha256(map_path.read_bytes())
+    if index_path.exists() and sprite_path.exists():
+        try:
+            if json.loads(index_path.read_text(encoding="utf-8")).get("key") == key:
+                print(f"[SKIP] sprite {lesson.id}: 音频未变化")
+                if report is not None:
+                    report.add("sprite", lesson.id, hits=1)
+                return sprite_path
+        except ValueError:
+            pass
+
+    numbers = [nn for nn in sorted(json.loads(map_path.read_text(encoding="utf-8")))
+               if (audio_dir / f"{nn}.mp3").exists()]
+    spans = merge_mp3([audio_dir / f"{nn}.mp3" for nn in numbers], sprite_path)
+    # 按下标对应：用不了的文件不写偏移，页面对这一句退回逐句文件
+    sentences: Dict[str, Dict[str, Any]] = {}
+    for nn, span in zip(numbers, spans):
+        if span is None:
+            print(f"[WARN] sprite {lesson.id}: 第 {nn} 句的音频无法使用，页面改用逐句文件")
+        else:
+            sentences[nn] = span
+    seconds = max((span["end"] for span in sentences.values()), default=0.0)
+
+    index = {"key": key, "src": SPRITE_NAME, "duration": round(seconds, 4), "sentences": sentences}
+    index_path.write_text(json.dumps(index, indent=1), encoding="utf-8")
+    print(f"[OK] Sprite: {sprite_path} ({len(sentences)} 句, {seconds:.1f}s)")
+    if report is not None:
+        report.add("sprite", lesson.id, misses=1,
+                   bytes=sprite_path.stat().st_size + index_path.stat().st_size)
+    return sprite_path
+
+
+# ========== 分段 / 整课音频 ==========
+
+PLAYLIST_INDEX_NAME = "playlists.json"
+PLAYLIST_LEAD = 0.2            # 开头留白（秒）
+PLAYLIST_SENTENCE_GAP = 0.4    # 句与句之间
+PLAYLIST_SECTION_GAP = 0.8     # section 与 section 之间
+PLAYLIST_VERSION = 2
+PLAYLIST_UNNAMED_SECTION = "misc"
+
+
+def _section_slug(name: str, used: set[str]) -> str:
+    """section 名 -> 文件名里用的短名（规则同 _catalog_slug），没有 section 的句子用 misc；
+    撞名时加 -2、-3 等后缀。不会带 / 或 ..，文件只会落在 audio/<id>/ 里。"""
+    base = _catalog_slug(name) if name else PLAYLIST_UNNAMED_SECTION
+    slug, n = base, 1
+    while slug in used:
+        n += 1
+        slug = f"{base}-{n}"
+    used.add(slug)
+    return slug
+
+
+def build_lesson_playlists(lesson: Lesson, report: BuildReport | None = None) -> List[Path]:
+    """生成 audio/<id>/<section>_all.mp3 和整课的 audio/<id>/all.mp3，连续播放用。
+
+    句子带 section 时每个 section 一个文件，文件名用 section 的短名（见 _section_slug），
+    显示名另记在 playlists.json 里。all.mp3 总是直接由逐句文件拼成，section 之间换成
+    更长的空白。全部是按帧拼接 + 现成的静音帧，不需要 ffmpeg，也不会有重新编码的损失。
+    """
+    audio_dir = AUDIO_ROOT / lesson.id
+    map_path = audio_dir / AUDIO_MAP_NAME
+    if not map_path.exists():
+        return []
+    audio_map = json.loads(map_path.read_text(encoding="utf-8"))
+
+    sections: Dict[str, List[Path]] = {}
+    for idx, s in enumerate(lesson.sentences, start=1):
+        path = audio_dir / f"{idx:02d}.mp3"
+        if f"{idx:02d}" in audio_map and path.exists():
+            sections.setdefault(s.section, []).append(path)
+    if not sections:
+        return []
+
+    index_path = audio_dir / PLAYLIST_INDEX_NAME
+    layout = {name: [p.name for p in paths] for name, paths in sections.items()}
+    key = _sha256(str(PLAYLIST_VERSION), map_path.read_bytes(), json.dumps(layout, ensure_ascii=False),
+                  f"{PLAYLIST_LEAD}/{PLAYLIST_SENTENCE_GAP}/{PLAYLIST_SECTION_GAP}")
+    old_files: List[str] = []
+    if index_path.exists():
+        try:
+            old = json.loads(index_path.read_text(encoding="utf-8"))
+            old_files = old.get("files", [])
+            outputs = [audio_dir / name for name in old_files]
+            if old.get("key") == key and all(p.exists() for p in outputs):
+                print(f"[SKIP] 合并音频 {lesson.id}: 音频未变化")
+                if report is not None:
+                    report.add("playlists", lesson.id, hits=1)
+                return outputs
+        except ValueError:
+            pass
+
+    outputs: List[Path] = []
+    section_files: List[Dict[str, str]] = []
+    used: set[str] = set()
+    all_inputs: List[Path] = []
+    all_gaps: List[float] = []
+    if list(sections) != [""]:
+        for name, paths in sections.items():
+            sec_path = audio_dir / f"{_section_slug(name, used)}_all.mp3"
+            merge_mp3(paths, sec_path, lead=PLAYLIST_LEAD, gap=PLAYLIST_SENTENCE_GAP)
+            print(f"[MERGE] {sec_path}")
+            outputs.append(sec_path)
+            section_files.append({"name": name, "file": sec_path.name})
+    for paths in sections.values():
+        all_inputs.extend(paths)
+        all_gaps.extend([PLAYLIST_SENTENCE_GAP] * (len(paths) - 1) + [PLAYLIST_SECTION_GAP])
+    all_path = audio_dir / "all.mp3"
+    merge_mp3(all_inputs, all_path, lead=PLAYLIST_LEAD, gap=all_gaps)
+    outputs.append(all_path)
+    print(f"[MERGE] {all_path}")
+
+    # section 改名 / 删除后留下的旧文件
+    for name in set(old_files) - {p.name for p in outputs}:
+        if "/" not in name and name.endswith("_all.mp3"):
+            (audio_dir / name).unlink(missing_ok=True)
+    index_path.write_text(json.dumps({"key": key, "files": [p.name for p in outputs],
+                                      "sections": section_files},
+                                     ensure_ascii=False, indent=1), encoding="utf-8")
+    if report is not None:
+        report.add("playlists", lesson.id, misses=1, bytes=sum(p.stat().st_size for p in outputs))
+    return outputs
+
+
+# ========== 生成总 index.html（根目录） ==========
+
+# ========== 生成总 index.html（根目录，列出 build 里的所有 HTML） ==========
+
+HTML_INDEX_TEMPLATE = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+  <meta charset="UTF-8" />
+  <title>French Learning Index - fr.awtza.com</title>
+  <style>
+    body {{
+      font-family: system-ui, -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+      max-width: 900px;
+      margin: 2rem auto;
+      padding: 0 1rem;
+      background: #f7f7f7;
+    }}
+    h1 {{
+      margin-bottom: 0.5rem;
+    }}
+    .subtitle {{
+      color: #666;
+      margin-bottom: 1.5rem;
+      font-size: 0.9rem;
+    }}
+    .subtitle a {{
+      color: #1976d2;
+    }}
+    ul {{
+      list-style: none;
+      padding-left: 0;
+      margin: 0;
+    }}
+    li {{
+      margin: 0.5rem 0;
+    }}
+    a {{
       text-decoration: none;
       color: inherit;
     }}
@@ -421,154 +2143,2918 @@ HTML_INDEX_TEMPLATE = """<!DOCTYPE html>
       transition: box-shadow 0.2s, transform 0.1s, border-color 0.2s;
       background: #fff;
     }}
-    .card:hover {{
-      box-shadow: 0 4px 12px rgba(0,0,0,0.08);
-      transform: translateY(-1px);
-      border-color: #bbb;
+    .card:hover {{
+      box-shadow: 0 4px 12px rgba(0,0,0,0.08);
+      transform: translateY(-1px);
+      border-color: #bbb;
+    }}
+    .title-line {{
+      font-size: 0.98rem;
+      margin-bottom: 0.2rem;
+    }}
+    .title-zh {{
+      font-size: 0.9rem;
+      color: #555;
+      margin-bottom: 0.2rem;
+    }}
+    .desc {{
+      font-size: 0.86rem;
+      color: #666;
+      margin-bottom: 0.2rem;
+    }}
+    .filename {{
+      font-size: 0.8rem;
+      color: #999;
+    }}
+    .links {{
+      margin-top: 0.25rem;
+      font-size: 0.8rem;
+      color: #666;
+    }}
+    .links a {{
+      color: #1976d2;
+      margin-right: 0.5rem;
+    }}
+    .links a:hover {{
+      text-decoration: underline;
+    }}
+    .categories {{
+      display: flex;
+      flex-wrap: wrap;
+      gap: 0.4rem;
+      margin-bottom: 1rem;
+      font-size: 0.85rem;
+    }}
+    .categories a {{
+      padding: 0.25rem 0.7rem;
+      border: 1px solid #ddd;
+      border-radius: 999px;
+      background: #fff;
+    }}
+    .categories a.current {{
+      border-color: #1976d2;
+      color: #1976d2;
+    }}
+    .categories span {{
+      color: #999;
+    }}
+    .pager {{
+      display: flex;
+      justify-content: space-between;
+      margin: 1.5rem 0;
+      font-size: 0.9rem;
+      color: #666;
+    }}
+    .pager a {{
+      color: #1976d2;
+    }}
+    .search input {{
+      width: 100%;
+      box-sizing: border-box;
+      padding: 0.6rem 0.8rem;
+      font-size: 1rem;
+      border: 1px solid #ddd;
+      border-radius: 0.5rem;
+    }}
+    .search-status {{
+      font-size: 0.8rem;
+      color: #888;
+      margin: 0.4rem 0;
+    }}
+    .search-results {{
+      list-style: none;
+      padding-left: 0;
+      margin: 0 0 1.5rem;
+    }}
+    .search-results .card {{
+      display: block;
+    }}
+    .search-results .fr {{
+      font-weight: 600;
+    }}
+    .search-results .zh,
+    .search-results .from {{
+      font-size: 0.86rem;
+      color: #666;
+    }}
+  </style>
+</head>
+<body>
+  <h1>📚 Bruce 的法语学习首页</h1>
+  <div class="subtitle">{subtitle} · 最后更新：{last_updated}{stats}</div>
+{search}
+{nav}
+  <ul>
+{items}
+  </ul>
+{pager}
+</body>
+</html>
+"""
+
+HTML_INDEX_CARD_TEMPLATE = """    <li>
+      <a href="{href}">
+        <div class="card">
+          <div class="title-line">{title}</div>
+          <div class="title-zh">{title_zh}</div>
+          {desc_html}
+          <div class="filename">{filename}</div>
+          <div class="links">
+            {links_html}
+          </div>
+        </div>
+      </a>
+    </li>"""
+
+HTML_INDEX_DESC_TEMPLATE = """<div class="desc">{desc}</div>"""
+
+HTML_INDEX_STATS_TEMPLATE = """ · <a href="{href}">📊 词汇统计</a>"""
+
+HTML_INDEX_LINK_TEMPLATE = """<a href="{href}">{text}</a>"""
+
+HTML_INDEX_SEARCH_TEMPLATE = """  <form class="search" data-index="{index}" onsubmit="return false;">
+    <input type="search" placeholder="搜索句子：法语 / 中文 / English" autocomplete="off" aria-label="搜索句子">
+    <div class="search-status"></div>
+    <ol class="search-results"></ol>
+  </form>
+  <script src="{src}" defer></script>"""
+
+HTML_INDEX_NAV_TEMPLATE = """  <nav class="categories">{links}</nav>"""
+
+HTML_INDEX_NAV_LINK_TEMPLATE = """<a href="{href}" class="{current}">{name} <span>{count}</span></a>"""
+
+HTML_INDEX_PAGER_TEMPLATE = """  <nav class="pager"><span>{prev}</span><span>第 {page} / {pages} 页</span><span>{next}</span></nav>"""
+
+
+INDEX_PAGE_SIZE = 60             # 每页最多多少张卡片
+CATALOG_DIR = OUTPUT_DIR / "catalog"
+CATALOG_JSON_NAME = "lessons.json"
+UNCATEGORIZED = "未分类"
+
+
+def _extra_html_pages(lesson_ids: set[str]) -> List[str]:
+    """build/ 下手写的 HTML（不是由 lesson 导出的），一次目录读取，不逐个 stat。"""
+    if not OUTPUT_DIR.exists():
+        return []
+    names = [entry.name for entry in os.scandir(OUTPUT_DIR)
+             if entry.name.endswith(".html") and entry.name.lower() != "index.html"]
+    return sorted(name for name in names
+                  if not FINGERPRINTED_NAME.match(name) and name[:-len(".html")] not in lesson_ids)
+
+
+def index_entries(lessons: List[Lesson], manifest: Dict[str, Any],
+                  assets: Dict[str, str] | None = None) -> List[Dict[str, Any]]:
+    """目录里的每张卡片。lesson 有哪些产物直接看 manifest 里记录的 outputs。
+
+    links 是 [格式名, build/ 下的相对路径]，第一项就是卡片本身的链接。
+    """
+    assets = assets or {}
+    entries: List[Dict[str, Any]] = []
+    for lesson in lessons:
+        outputs = manifest["lessons"].get(lesson.id, {}).get("outputs", {})
+        if "html" not in outputs:
+            continue
+        links = []
+        for fmt in LESSON_SINKS:
+            if fmt in outputs:
+                name = f"{lesson.id}.{fmt}"
+                links.append([fmt.upper(), assets.get(name, name)])
+        entries.append({
+            "id": lesson.id,
+            "title": lesson.title,
+            "title_zh": lesson.title_zh,
+            "desc": lesson.description_zh or lesson.description,
+            "category": lesson.category,
+            "file": f"{lesson.id}.html",
+            "links": links,
+        })
+    for name in _extra_html_pages({lesson.id for lesson in lessons}):
+        entries.append({"id": name[:-len(".html")], "title": name[:-len(".html")], "title_zh": "",
+                        "desc": "", "category": "", "file": name, "links": [["HTML", name]]})
+    return entries
+
+
+def _catalog_slug(category: str) -> str:
+    """分类名 -> 文件名里用的短名：纯 ASCII 的直接用，其它（如中文）用哈希。"""
+    slug = re.sub(r"[^a-z0-9_-]+", "-", category.lower()).strip("-")
+    if not slug or slug != category.lower():
+        slug = "c" + hashlib.sha256(category.encode("utf-8")).hexdigest()[:8]
+    return slug
+
+
+def plan_index_pages(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把卡片按"全部"和各分类分页。第一页"全部"就是根目录的 index.html，
+    其余页面在 build/catalog/<分类>-<页码>.html。rel 都是相对根目录的路径。"""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        groups.setdefault(entry["category"] or UNCATEGORIZED, []).append(entry)
+    categorized = len(groups) > 1 or UNCATEGORIZED not in groups
+
+    plan = [("全部", "all", entries)]
+    if categorized:
+        names = sorted(groups, key=lambda name: (name == UNCATEGORIZED, name))
+        plan += [(name, _catalog_slug(name), groups[name]) for name in names]
+
+    def page_rel(slug: str, n: int) -> str:
+        if slug == "all" and n == 1:
+            return "index.html"
+        return f"{_root_rel(CATALOG_DIR)}/{slug}-{n}.html"
+
+    nav = [[name, len(items), page_rel(slug, 1)] for name, slug, items in plan] if categorized else []
+    pages: List[Dict[str, Any]] = []
+    for name, slug, items in plan:
+        count = max(1, -(-len(items) // INDEX_PAGE_SIZE))
+        for n in range(1, count + 1):
+            pages.append({
+                "rel": page_rel(slug, n),
+                "category": name,
+                "page": n,
+                "pages": count,
+                "prev": page_rel(slug, n - 1) if n > 1 else "",
+                "next": page_rel(slug, n + 1) if n < count else "",
+                "nav": nav,
+                "items": items[(n - 1) * INDEX_PAGE_SIZE:n * INDEX_PAGE_SIZE],
+            })
+    return pages
+
+
+def _root_rel(path: Path) -> str:
+    return path.relative_to(BASE_DIR).as_posix()
+
+
+def _href(page_rel: str, target_rel: str) -> str:
+    """从 page_rel 所在页面链接到 target_rel（都相对根目录）。"""
+    return posixpath.relpath(target_rel, posixpath.dirname(page_rel) or ".")
+
+
+def render_index_page(page: Dict[str, Any], assets: Dict[str, str] | None = None,
+                      last_updated: str = "") -> str:
+    """渲染一页目录。根目录的 index.html 另外带上全文搜索框。"""
+    assets = assets or {}
+    rel = page["rel"]
+    build_dir = _root_rel(OUTPUT_DIR)
+
+    item_lines: List[str] = []
+    for entry in page["items"]:
+        links = [[text, _href(rel, f"{build_dir}/{target}")] for text, target in entry["links"]]
+        desc = entry["desc"]
+        desc_html = compile_template(HTML_INDEX_DESC_TEMPLATE).render(desc=desc) if desc else ""
+        item_lines.append(compile_template(HTML_INDEX_CARD_TEMPLATE).render(
+            href=links[0][1],
+            title=entry["title"],
+            title_zh=entry["title_zh"],
+            desc_html=Markup(desc_html),
+            filename=entry["file"],
+            links_html=Markup(" ".join(_index_link(href, text) for text, href in links)),
+        ))
+
+    nav_html = ""
+    if page["nav"]:
+        nav_links = [compile_template(HTML_INDEX_NAV_LINK_TEMPLATE).render(
+            href=_href(rel, target), name=name, count=count,
+            current="current" if name == page["category"] else "")
+            for name, count, target in page["nav"]]
+        nav_html = compile_template(HTML_INDEX_NAV_TEMPLATE).render(links=Markup(" ".join(nav_links)))
+
+    pager_html = ""
+    if page["pages"] > 1:
+        pager_html = compile_template(HTML_INDEX_PAGER_TEMPLATE).render(
+            prev=Markup(_index_link(_href(rel, page["prev"]), "← 上一页") if page["prev"] else ""),
+            next=Markup(_index_link(_href(rel, page["next"]), "下一页 →") if page["next"] else ""),
+            page=page["page"],
+            pages=page["pages"],
+        )
+
+    stats_html = ""
+    if rel == "index.html" and STATS_PATH.exists():
+        stats_html = compile_template(HTML_INDEX_STATS_TEMPLATE).render(href=_href(rel, _root_rel(STATS_PATH)))
+
+    search_html = ""
+    if rel == "index.html" and SEARCH_JS_REL in assets:
+        search_html = compile_template(HTML_INDEX_SEARCH_TEMPLATE).render(
+            index=f"{build_dir}/search/{SEARCH_META_NAME}",
+            src=f"{build_dir}/{assets[SEARCH_JS_REL]}",
+        )
+
+    subtitle = "自动生成目录"
+    if page["nav"] or page["pages"] > 1:
+        subtitle += f" · {page['category']} · 第 {page['page']} / {page['pages']} 页"
+    return compile_template(HTML_INDEX_TEMPLATE).render(
+        subtitle=subtitle,
+        last_updated=last_updated,
+        stats=Markup(stats_html),
+        search=Markup(search_html),
+        nav=Markup(nav_html),
+        items=Markup("\n".join(item_lines)),
+        pager=Markup(pager_html),
+    )
+
+
+def build_index_html(lessons: List[Lesson], manifest: Dict[str, Any],
+                     assets: Dict[str, str] | None = None) -> str:
+    """根目录 index.html 的内容（目录第一页）。"""
+    pages = plan_index_pages(index_entries(lessons, manifest, assets))
+    last_updated = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    return render_index_page(pages[0], assets, last_updated)
+
+
+def _index_link(href: str, text: str) -> str:
+    return compile_template(HTML_INDEX_LINK_TEMPLATE).render(href=href, text=text)
+
+
+def catalog_listing(entries: List[Dict[str, Any]], pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """build/catalog/lessons.json：所有 lesson 的元数据和产物链接，以及每个分类的
+    页面列表（路径都相对根目录），方便脚本或前端自己渲染目录。"""
+    build_dir = _root_rel(OUTPUT_DIR)
+    categories: Dict[str, List[str]] = {}
+    for page in pages:
+        categories.setdefault(page["category"], []).append(page["rel"])
+    return {
+        "categories": [{"name": name, "pages": rels} for name, rels in categories.items()],
+        "lessons": [{"id": e["id"], "title": e["title"], "title_zh": e["title_zh"],
+                     "description": e["desc"], "category": e["category"],
+                     "links": {text.lower(): f"{build_dir}/{target}" for text, target in e["links"]}}
+                    for e in entries],
+    }
+
+
+def export_index_html(lessons: List[Lesson], manifest: Dict[str, Any],
+                      assets: Dict[str, str] | None = None,
+                      report: BuildReport | None = None) -> Path:
+    """
+    生成目录：根目录 index.html（第一页）+ build/catalog/ 下的分页 / 分类页 + lessons.json。
+
+    卡片数据只来自 lessons 元数据和 manifest 里的 outputs，不再逐个探测 build/ 里的文件。
+    每页的输入指纹记在 manifest["index_pages"]，没变化的页面不重写；不再需要的页面删掉。
+    """
+    entries = index_entries(lessons, manifest, assets)
+    pages = plan_index_pages(entries)
+    templates = (HTML_INDEX_TEMPLATE + HTML_INDEX_CARD_TEMPLATE + HTML_INDEX_DESC_TEMPLATE
+                 + HTML_INDEX_LINK_TEMPLATE + HTML_INDEX_SEARCH_TEMPLATE
+                 + HTML_INDEX_NAV_TEMPLATE + HTML_INDEX_NAV_LINK_TEMPLATE + HTML_INDEX_PAGER_TEMPLATE
+                 + HTML_INDEX_STATS_TEMPLATE)
+    # 目录第一页是否带统计页链接也算进页面指纹
+    assets_json = json.dumps(assets or {}, sort_keys=True) + str(STATS_PATH.exists())
+
+    CATALOG_DIR.mkdir(parents=True, exist_ok=True)
+    old: Dict[str, str] = manifest.get("index_pages", {})
+    new: Dict[str, str] = {}
+    last_updated = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    written = written_bytes = 0
+    for page in pages:
+        rel = page["rel"]
+        new[rel] = _sha256(templates, assets_json, json.dumps(page, ensure_ascii=False))
+        path = BASE_DIR / rel
+        if old.get(rel) == new[rel] and path.exists():
+            continue
+        written_bytes += path.write_bytes(render_index_page(page, assets, last_updated).encode("utf-8"))
+        written += 1
+
+    listing_rel = f"{_root_rel(CATALOG_DIR)}/{CATALOG_JSON_NAME}"
+    listing = json.dumps(catalog_listing(entries, pages), ensure_ascii=False, separators=(",", ":"))
+    new[listing_rel] = _sha256(listing)
+    if old.get(listing_rel) != new[listing_rel] or not (BASE_DIR / listing_rel).exists():
+        written_bytes += (BASE_DIR / listing_rel).write_bytes(listing.encode("utf-8"))
+        written += 1
+    if report is not None:
+        report.add("index", hits=len(pages) + 1 - written, misses=written, bytes=written_bytes)
+
+    for rel in old.keys() - new.keys():
+        (BASE_DIR / rel).unlink(missing_ok=True)
+    manifest["index_pages"] = new
+
+    path = BASE_DIR / "index.html"
+    if written:
+        print(f"[OK] Index: {path}（{len(entries)} 个页面，{len(pages)} 页目录，重写 {written} 个文件）")
+    else:
+        print("[SKIP] index.html: 元数据未变化")
+    return path
+
+
+# ========== 全文搜索索引（build/search/） ==========
+
+SEARCH_DIR = OUTPUT_DIR / "search"
+SEARCH_META_NAME = "meta.json"
+SEARCH_INDEX_VERSION = 2
+SEARCH_TOKENS_PER_SHARD = 2048  # 按词项数决定分片数，每片大约这么多词项
+SEARCH_DOCS_PER_CHUNK = 256     # 句子原文按 id 顺序分块，结果页只加载用到的块
+SEARCH_FIELDS = ("fr", "zh", "en")
+
+# 中日文字符（假名 + 汉字），按字切分；其余字母数字连续段算一个词。
+# 和 SEARCH_JS 里的 CJK 正则保持一致
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_SEARCH_TOKEN_RE = re.compile(f"[{_CJK}]+|[^\\W_{_CJK}]+")
+_CJK_RUN = re.compile(f"[{_CJK}]+")
+# NFKD 分解后的组合附加符号（重音等），和 SEARCH_JS 里的 MARKS 保持一致
+_COMBINING_MARKS = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+
+# 目录页的搜索脚本（写成 build/assets/search.<哈希>.js）。切词和分片哈希必须和
+# search_tokens / fnv1a_32 一致；用 raw 字符串，\p{...} 和 \u 转义原样交给浏览器
+SEARCH_JS = r"""
+(function() {
+    "use strict";
+    const form = document.querySelector("form.search");
+    if (!form) {
+        return;
+    }
+    const input = form.querySelector("input");
+    const status = form.querySelector(".search-status");
+    const list = form.querySelector(".search-results");
+    const base = new URL(form.dataset.index, location.href);
+    const MAX_RESULTS = 50;
+    const TOKEN_RE = /[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|(?:(?![\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff])[\p{L}\p{N}])+/gu;
+    const CJK_RUN = /^[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]/u;
+    const MARKS = /[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]/g;
+    const encoder = new TextEncoder();
+    const files = new Map();
+    let metaLoading = null;
+    let seq = 0;
+
+    function loadMeta() {
+        if (!metaLoading) {
+            metaLoading = fetch(base, { cache: "no-cache" }).then(function(r) {
+                if (!r.ok) {
+                    throw new Error("search index: HTTP " + r.status);
+                }
+                return r.json();
+            });
+        }
+        return metaLoading;
+    }
+
+    // 分片 / 原文块：每个文件只下载一次，带上索引版本号方便长缓存
+    function loadFile(meta, name) {
+        if (!files.has(name)) {
+            const url = new URL(name, base);
+            url.search = "v=" + meta.key;
+            files.set(name, fetch(url).then(function(r) { return r.json(); }));
+        }
+        return files.get(name);
+    }
+
+    function fold(text) {
+        return text.normalize("NFKD").replace(MARKS, "").toLowerCase();
+    }
+
+    function queryTokens(text) {
+        const tokens = new Set();
+        for (const run of fold(text).match(TOKEN_RE) || []) {
+            if (!CJK_RUN.test(run)) {
+                if (run.length > 1) {
+                    tokens.add(run);
+                }
+            } else if (run.length === 1) {
+                tokens.add(run);
+            } else {
+                for (let i = 0; i + 1 < run.length; i++) {
+                    tokens.add(run.slice(i, i + 2));
+                }
+            }
+        }
+        return Array.from(tokens);
+    }
+
+    function fnv1a(text) {
+        let h = 0x811c9dc5;
+        for (const b of encoder.encode(text)) {
+            h = Math.imul(h ^ b, 0x01000193) >>> 0;
+        }
+        return h;
+    }
+
+    function decode(deltas) {
+        const ids = new Array(deltas.length);
+        let id = 0;
+        for (let i = 0; i < deltas.length; i++) {
+            id += deltas[i];
+            ids[i] = id;
+        }
+        return ids;
+    }
+
+    function intersect(a, b) {
+        const out = [];
+        let i = 0;
+        let j = 0;
+        while (i < a.length && j < b.length) {
+            if (a[i] === b[j]) {
+                out.push(a[i]);
+                i++;
+                j++;
+            } else if (a[i] < b[j]) {
+                i++;
+            } else {
+                j++;
+            }
+        }
+        return out;
+    }
+
+    function line(cls, text) {
+        const div = document.createElement("div");
+        div.className = cls;
+        div.textContent = text;
+        return div;
+    }
+
+    function render(meta, docs, total, ms) {
+        list.textContent = "";
+        for (const doc of docs) {
+            const lesson = meta.lessons[doc[0]];
+            const num = String(doc[1]).padStart(2, "0");
+            const a = document.createElement("a");
+            a.href = lesson[3] + "#" + lesson[0] + "_" + num;
+            a.className = "card";
+            a.appendChild(line("fr", doc[2]));
+            a.appendChild(line("zh", doc[3]));
+            a.appendChild(line("from", (lesson[2] || lesson[1]) + " · " + num));
+            const li = document.createElement("li");
+            li.appendChild(a);
+            list.appendChild(li);
+        }
+        let text = total ? "共 " + total + " 条" : "没有找到";
+        if (total > docs.length) {
+            text += "，显示前 " + docs.length + " 条";
+        }
+        status.textContent = text + "（" + ms.toFixed(1) + " ms）";
+    }
+
+    function search(text) {
+        const current = ++seq;
+        const started = performance.now();
+        const tokens = queryTokens(text);
+        if (!tokens.length) {
+            list.textContent = "";
+            status.textContent = "";
+            return;
+        }
+        loadMeta().then(function(meta) {
+            return Promise.all(tokens.map(function(t) {
+                return loadFile(meta, "t" + (fnv1a(t) % meta.shards) + ".json").then(function(shard) {
+                    return shard[t] || [];
+                });
+            })).then(function(lists) {
+                lists.sort(function(a, b) { return a.length - b.length; });
+                let ids = decode(lists[0]);
+                for (let i = 1; i < lists.length && ids.length; i++) {
+                    ids = intersect(ids, decode(lists[i]));
+                }
+                return Promise.all(ids.slice(0, MAX_RESULTS).map(function(id) {
+                    return loadFile(meta, "d" + Math.floor(id / meta.chunk) + ".json").then(function(chunk) {
+                        return chunk[id % meta.chunk];
+                    });
+                })).then(function(docs) {
+                    if (current === seq) {
+                        render(meta, docs, ids.length, performance.now() - started);
+                    }
+                });
+            });
+        }).catch(function(e) {
+            console.error(e);
+            status.textContent = "搜索索引加载失败";
+        });
+    }
+
+    input.addEventListener("input", function() { search(input.value); });
+    if (input.value) {
+        search(input.value);
+    }
+})();
+"""
+
+
+def fold_text(text: str) -> str:
+    """去重音、转小写：é / É / e 都当成 e，搜索 "cafe" 能找到 "Café"。"""
+    if text.isascii():
+        return text.lower()
+    return _COMBINING_MARKS.sub("", unicodedata.normalize("NFKD", text)).lower()
+
+
+def search_tokens(text: str, query: bool = False) -> List[str]:
+    """切词。拉丁文按词（单个字母如 l' / j' 丢掉）；中文建索引时取单字 + 相邻两字，
+    查询时有两个字以上就只用两字组合（更精确），只有一个字才用单字。"""
+    tokens: List[str] = []
+    for run in _SEARCH_TOKEN_RE.findall(fold_text(text)):
+        if not _CJK_RUN.match(run):
+            if len(run) > 1:
+                tokens.append(run)
+            continue
+        bigrams = [run[i:i + 2] for i in range(len(run) - 1)]
+        if query:
+            tokens.extend(bigrams or [run])
+        else:
+            tokens.extend(run)
+            tokens.extend(bigrams)
+    return tokens
+
+
+def fnv1a_32(text: str) -> int:
+    """词项 -> 分片用的哈希（FNV-1a 32 位，页面脚本里有同样的实现）。"""
+    h = 0x811C9DC5
+    for b in text.encode("utf-8"):
+        h = ((h ^ b) * 0x01000193) & 0xFFFFFFFF
+    return h
+
+
+def search_input_key(lessons: List[Lesson], assets: Dict[str, str] | None = None) -> str:
+    """搜索索引的输入指纹：所有 lesson 的内容 + 索引格式版本 + 各课程页的地址。"""
+    assets = assets or {}
+    return _sha256(str(SEARCH_INDEX_VERSION),
+                   *(f"{lesson.id}:{lesson.source_hash}:{assets.get(f'{lesson.id}.html', '')}"
+                     for lesson in lessons))
+
+
+def _search_lesson_row(lesson: Lesson, assets: Dict[str, str]) -> List[Any]:
+    html_name = f"{lesson.id}.html"
+    return [lesson.id, lesson.title, lesson.title_zh, f"build/{assets.get(html_name, html_name)}"]
+
+
+def _search_doc_tokens(doc: List[Any]) -> set[str]:
+    """原文块里的一条 [lesson 序号, 句号, fr, zh, en] 的全部词项（和建索引时一样切）。"""
+    return set(search_tokens(" ".join(doc[2:])))
+
+
+def _write_search_json(name: str, data: Any) -> int:
+    """写 build/search/<name>，返回写入的字节数。"""
+    data = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return (SEARCH_DIR / name).write_bytes(data)
+
+
+def build_search_index(lessons: List[Lesson], assets: Dict[str, str] | None = None,
+                       report: BuildReport | None = None) -> Path:
+    """为所有句子的 fr / zh / en 建倒排索引，写到 build/search/：
+
+    - meta.json：分片数、分块大小、词项数、lesson 列表（id、标题、页面地址、首句 id、句数）
+    - t<n>.json：第 n 个词项分片，{词项: 句子 id 的差分编码列表}
+    - d<n>.json：第 n 块句子原文，[lesson 序号, 句号, fr, zh, en]
+
+    页面脚本按查询词的哈希只下载用到的分片，求交集后再取结果所在的原文块。
+    句子逐个流式处理，原文满一块就写盘；倒排表用 array 存，10 万句也只占几十 MB。
+    """
+    assets = assets or {}
+    if SEARCH_DIR.exists():
+        shutil.rmtree(SEARCH_DIR)
+    SEARCH_DIR.mkdir(parents=True)
+
+    postings: Dict[str, array.array] = {}
+    lesson_rows: List[List[Any]] = []
+    chunk: List[List[Any]] = []
+    doc_id = written = 0
+    for lesson_no, lesson in enumerate(lessons):
+        row = _search_lesson_row(lesson, assets) + [doc_id, 0]
+        lesson_rows.append(row)
+        for idx, s in enumerate(lesson.sentences, start=1):
+            for token in set(search_tokens(" ".join(getattr(s, f) for f in SEARCH_FIELDS))):
+                ids = postings.get(token)
+                if ids is None:
+                    ids = postings[token] = array.array("I")
+                ids.append(doc_id)
+            chunk.append([lesson_no, idx, s.fr, s.zh, s.en])
+            doc_id += 1
+            row[5] += 1
+            if len(chunk) == SEARCH_DOCS_PER_CHUNK:
+                written += _write_search_json(f"d{doc_id // SEARCH_DOCS_PER_CHUNK - 1}.json", chunk)
+                chunk = []
+    if chunk:
+        written += _write_search_json(f"d{doc_id // SEARCH_DOCS_PER_CHUNK}.json", chunk)
+
+    shard_count = 1
+    while shard_count * SEARCH_TOKENS_PER_SHARD < len(postings):
+        shard_count *= 2
+    shards: List[Dict[str, List[int]]] = [{} for _ in range(shard_count)]
+    for token, ids in postings.items():
+        # 句子 id 递增，存差分值，数字短、压缩率也高
+        shards[fnv1a_32(token) % shard_count][token] = [ids[0], *map(operator.sub, ids[1:], ids)]
+    for n, shard in enumerate(shards):
+        written += _write_search_json(f"t{n}.json", shard)
+
+    meta = {
+        "version": SEARCH_INDEX_VERSION,
+        "shards": shard_count,
+        "chunk": SEARCH_DOCS_PER_CHUNK,
+        "docs": doc_id,
+        "terms": len(postings),
+        "lessons": lesson_rows,
+        # 页面请求分片时带上 ?v=key，内容一变地址就变
+        "key": search_input_key(lessons, assets)[:12],
+    }
+    written += _write_search_json(SEARCH_META_NAME, meta)
+    if report is not None:
+        report.add("search", misses=1, bytes=written)
+    path = SEARCH_DIR / SEARCH_META_NAME
+    print(f"[OK] 搜索索引: {SEARCH_DIR}（{doc_id} 句，{len(postings)} 个词项，{shard_count} 个分片）")
+    return path
+
+
+def update_search_index(lessons: List[Lesson], changed: set[str], assets: Dict[str, str] | None = None,
+                        report: BuildReport | None = None) -> bool:
+    """--watch 用：只把 changed 里的 lesson 在已有索引里换掉，不重建整个索引。
+
+    旧句子在原文块里清空（置 null），新句子接在 id 末尾，只重写涉及到的原文块和词项分片。
+    lesson 增删 / 换了顺序、分片不够用、或者空出来的 id 比有效的还多时返回 False，交给
+    build_search_index 全量重建（全量重建也会让搜索结果恢复按目录顺序排列）。
+    """
+    assets = assets or {}
+    try:
+        meta = json.loads((SEARCH_DIR / SEARCH_META_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    rows = meta.get("lessons", [])
+    if meta.get("version") != SEARCH_INDEX_VERSION or [row[0] for row in rows] != [lesson.id for lesson in lessons]:
+        return False
+
+    chunk_size, shard_count = meta["chunk"], meta["shards"]
+    chunks: Dict[int, List[Any]] = {}
+
+    def load_chunk(n: int) -> List[Any]:
+        if n not in chunks:
+            path = SEARCH_DIR / f"d{n}.json"
+            chunks[n] = json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
+        return chunks[n]
+
+    removed: Dict[str, set[int]] = {}
+    added: Dict[str, List[int]] = {}
+    doc_id = meta["docs"]
+    for lesson_no, lesson in enumerate(lessons):
+        row = rows[lesson_no]
+        row[:4] = _search_lesson_row(lesson, assets)
+        if lesson.id not in changed:
+            continue
+        first, count = row[4], row[5]
+        for old_id in range(first, first + count):
+            chunk = load_chunk(old_id // chunk_size)
+            for token in _search_doc_tokens(chunk[old_id % chunk_size]):
+                removed.setdefault(token, set()).add(old_id)
+            chunk[old_id % chunk_size] = None
+        row[4], row[5] = doc_id, 0
+        for idx, s in enumerate(lesson.sentences, start=1):
+            doc = [lesson_no, idx, s.fr, s.zh, s.en]
+            for token in _search_doc_tokens(doc):
+                added.setdefault(token, []).append(doc_id)
+            chunk = load_chunk(doc_id // chunk_size)
+            chunk.append(doc)
+            doc_id += 1
+            row[5] += 1
+    if doc_id - sum(row[5] for row in rows) > sum(row[5] for row in rows):
+        return False
+
+    terms = meta["terms"]
+    shards: Dict[int, Dict[str, List[int]]] = {}
+    for token in removed.keys() | added.keys():
+        n = fnv1a_32(token) % shard_count
+        if n not in shards:
+            shards[n] = json.loads((SEARCH_DIR / f"t{n}.json").read_text(encoding="utf-8"))
+        shard = shards[n]
+        ids = list(itertools.accumulate(shard.get(token, [])))
+        terms -= bool(ids)
+        gone = removed.get(token, ())
+        # 新句子的 id 都比已有的大，直接接在后面仍然有序
+        ids = [i for i in ids if i not in gone] + added.get(token, [])
+        if ids:
+            shard[token] = [ids[0], *map(operator.sub, ids[1:], ids)]
+            terms += 1
+        else:
+            shard.pop(token, None)
+    if terms > shard_count * SEARCH_TOKENS_PER_SHARD:
+        # 词项多到该加分片了，交给全量重建重新分片（到这里为止还没有写任何文件）
+        return False
+
+    written = 0
+    for n, shard in shards.items():
+        written += _write_search_json(f"t{n}.json", shard)
+    for n, chunk in chunks.items():
+        written += _write_search_json(f"d{n}.json", chunk)
+
+    meta.update(docs=doc_id, terms=terms, lessons=rows, key=search_input_key(lessons, assets)[:12])
+    written += _write_search_json(SEARCH_META_NAME, meta)
+    if report is not None:
+        report.add("search", misses=1, bytes=written)
+    print(f"[OK] 搜索索引: 增量更新 {', '.join(sorted(changed))}"
+          f"（{sum(row[5] for row in rows)} 句，{terms} 个词项）")
+    return True
+
+
+# ========== 全局句子库（build/sentences.json） ==========
+
+SENTENCES_PATH = OUTPUT_DIR / "sentences.json"
+SENTENCE_MERGES_PATH = OUTPUT_DIR / "sentence_merges.json"
+SENTENCE_REGISTRY_VERSION = 1
+
+
+def sentence_key(text: str) -> str:
+    """句子的全局 id：规范化后的法语原文的哈希（和音频库用同一套规范化）。
+
+    撇号（’ 与 '）、空白、Unicode 组合形式不同的写法得到同一个 id。
+    """
+    return _sha256(normalize_text(text))[:16]
+
+
+def load_sentence_merges() -> Dict[str, str]:
+    """读取 --merge-near-dups 写下的 build/sentence_merges.json：{被合并的句子 id: 共享条目 id}。"""
+    if not SENTENCE_MERGES_PATH.exists():
+        return {}
+    try:
+        return json.loads(SENTENCE_MERGES_PATH.read_text(encoding="utf-8"))
+    except ValueError as e:
+        print(f"[WARN] 句子合并表解析失败，忽略: {SENTENCE_MERGES_PATH} -> {e!r}")
+        return {}
+
+
+def sentence_registry_key(lessons: List[Lesson], merges: Dict[str, str] | None = None) -> str:
+    return _sha256(str(SENTENCE_REGISTRY_VERSION), json.dumps(merges or {}, sort_keys=True),
+                   *(f"{lesson.id}:{lesson.source_hash}" for lesson in lessons))
+
+
+def build_sentence_registry(lessons: List[Lesson],
+                            merges: Dict[str, str] | None = None) -> Dict[str, int]:
+    """把所有 lesson 的句子按规范化文本去重，写 build/sentences.json：
+
+    - sentences：{id: [fr, zh, en, 出现次数]}，每句原文和翻译只存一份
+    - lessons：{lesson id: [句子 id, ...]}，按句号顺序引用上面的句子
+    - merged：merges 里的近似重复句（见 analyze_near_duplicates），它们的引用指向共享条目
+
+    同一句话在不同 lesson 里翻译不一致时保留第一次出现的，打印 [WARN]；
+    第一次出现时没有翻译的，用后面出现的补上。返回 {"total": 总句数, "unique": 不重复句数}。
+    """
+    merges = merges or {}
+    entries: Dict[str, List[Any]] = {}
+    refs: Dict[str, List[str]] = {}
+    origin: Dict[str, str] = {}
+    # 实际出现过的被合并句子，只有它们写进 merged
+    merged: set[str] = set()
+    # 由被合并的句子先占位的共享条目，等共享条目自己的原文出现时再替换
+    provisional: set[str] = set()
+    conflicts: List[str] = []
+    total = 0
+    for lesson in lessons:
+        ids = refs[lesson.id] = []
+        for s in lesson.sentences:
+            key = sentence_key(s.fr)
+            shared = merges.get(key, key)
+            if shared != key:
+                merged.add(key)
+            ids.append(shared)
+            total += 1
+            entry = entries.get(shared)
+            if entry is None:
+                entries[shared] = [s.fr, s.zh, s.en, 1]
+                origin[shared] = lesson.id
+                if shared != key:
+                    provisional.add(shared)
+                continue
+            entry[3] += 1
+            if shared != key:
+                continue
+            if shared in provisional:
+                provisional.discard(shared)
+                entry[0:3] = [s.fr, s.zh or entry[1], s.en or entry[2]]
+                origin[shared] = lesson.id
+                continue
+            for n, value in ((1, s.zh), (2, s.en)):
+                if not value or value == entry[n]:
+                    continue
+                if not entry[n]:
+                    entry[n] = value
+                elif len(conflicts) < 5:
+                    conflicts.append(f"「{entry[0]}」: {origin[key]} 里是「{entry[n]}」，"
+                                     f"{lesson.id} 里是「{value}」")
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    data = {"version": SENTENCE_REGISTRY_VERSION, "total": total, "unique": len(entries),
+            "sentences": entries, "lessons": refs,
+            "merged": {k: merges[k] for k in sorted(merged)}}
+    tmp = SENTENCES_PATH.with_name(SENTENCES_PATH.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, SENTENCES_PATH)
+    for line in conflicts:
+        print(f"[WARN] 翻译不一致，保留第一次出现的: {line}")
+    return {"total": total, "unique": len(entries)}
+
+
+def sentence_duplication_stats(lessons: List[Lesson], merges: Dict[str, str] | None = None) -> Dict[str, int]:
+    """只数不写：和 build_sentence_registry 同样的去重规则（含 merges），
+    返回 {"total": 总句数, "unique": 不重复句数}，内存里只留每个不重复句子的 id。"""
+    merges = merges or {}
+    seen: set[str] = set()
+    total = 0
+    for lesson in lessons:
+        for s in lesson.sentences:
+            key = sentence_key(s.fr)
+            seen.add(merges.get(key, key))
+            total += 1
+    return {"total": total, "unique": len(seen)}
+
+
+def duplication_summary(stats: Dict[str, int]) -> str:
+    total, unique = stats["total"], stats["unique"]
+    ratio = 1 - unique / total if total else 0.0
+    return (f"{total} 句，其中 {unique} 句不重复，重复率 {ratio:.1%}"
+            f"（{total - unique} 句的翻译和音频与别处共用）")
+
+
+# ========== 近似重复句（MinHash / LSH，--near-dups） ==========
+
+NEAR_DUPLICATES_PATH = OUTPUT_DIR / "near_duplicates.json"
+NEAR_DUP_THRESHOLD = 0.7       # 字符 3-gram 的 Jaccard 相似度达到这个值才算近似重复
+NEAR_DUP_HASHES = 64
+NEAR_DUP_BANDS = 16            # 16 段 × 4 行：相似度 0.7 的一对有约 99% 的概率落进同一个桶
+NEAR_DUP_MAX_BUCKET = 64       # 更大的桶只和桶里第一句比较，避免平方级的比较次数
+NEAR_DUP_CHUNK = 65536         # numpy 一次给这么多句算签名
+NEAR_DUP_MAX_REFS = 20         # 报告里每句最多列出这么多处出现位置
+_MINHASH_PRIME = (1 << 31) - 1
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def _near_dup_text(text: str) -> str:
+    """比较用的文本：规范化、去重音、转小写，标点和空白压成一个空格，两端各留一个空格。"""
+    return f" {_NON_WORD.sub(' ', fold_text(normalize_text(text))).strip()} "
+
+
+def _shingles(text: str) -> frozenset[str]:
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def _jaccard(sa: frozenset[str], sb: frozenset[str]) -> float:
+    common = len(sa & sb)
+    return common / (len(sa) + len(sb) - common) if sa or sb else 1.0
+
+
+def _minhash_params() -> tuple[List[int], List[int]]:
+    # 固定种子：每次运行的签名一样，结果可复现
+    rng = random.Random(0x5EED)
+    return ([rng.randrange(1, _MINHASH_PRIME) for _ in range(NEAR_DUP_HASHES)],
+            [rng.randrange(0, _MINHASH_PRIME) for _ in range(NEAR_DUP_HASHES)])
+
+
+def _lsh_buckets_numpy(texts: List[str], np: Any) -> Iterator[List[int]]:
+    """用 numpy 批量算 MinHash 签名，再按段分桶，产出每个多于一句的桶（texts 的下标）。
+
+    一批句子用 \\0 连成一个 UTF-32 数组，相邻三个码点拼成一个 63 位整数就是 3-gram，
+    不需要再哈希；跨句的 3-gram 置为最大值，不影响 minimum.reduceat 的结果。
+    """
+    a, b = (np.array(v, dtype=np.uint64) for v in _minhash_params())
+    prime = np.uint64(_MINHASH_PRIME)
+    sig = np.empty((len(texts), NEAR_DUP_HASHES), dtype=np.uint32)
+    for start in range(0, len(texts), NEAR_DUP_CHUNK):
+        chunk = texts[start:start + NEAR_DUP_CHUNK]
+        points = np.frombuffer("\0".join(chunk).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        codes = ((points[:-2] << np.uint64(42)) | (points[1:-1] << np.uint64(21)) | points[2:]) % prime
+        spans_gap = (points[:-2] == 0) | (points[1:-1] == 0) | (points[2:] == 0)
+        lengths = np.fromiter(map(len, chunk), dtype=np.int64, count=len(chunk))
+        offsets = np.concatenate(([0], np.cumsum(lengths + 1)[:-1]))
+        for n in range(NEAR_DUP_HASHES):
+            values = (codes * a[n] + b[n]) % prime
+            values[spans_gap] = prime
+            sig[start:start + len(chunk), n] = np.minimum.reduceat(values, offsets)
+
+    rows = NEAR_DUP_HASHES // NEAR_DUP_BANDS
+    mix = np.uint64(0x9E3779B97F4A7C15)
+    for band in range(NEAR_DUP_BANDS):
+        cols = sig[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = cols[:, 0]
+        for c in range(1, rows):
+            keys = keys * mix + cols[:, c]   # uint64 溢出回绕，当作哈希用
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bounds = np.concatenate(([0], np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1,
+                                 [len(sorted_keys)]))
+        sizes = np.diff(bounds)
+        for lo, size in zip(bounds[:-1][sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+            yield order[lo:lo + size].tolist()
+
+
+def _lsh_buckets_python(texts: List[str]) -> Iterator[List[int]]:
+    """没有 numpy 时的纯 Python 版本，结果相同，只是慢得多。"""
+    a, b = _minhash_params()
+    rows = NEAR_DUP_HASHES // NEAR_DUP_BANDS
+    bands: List[Dict[tuple[int, ...], List[int]]] = [{} for _ in range(NEAR_DUP_BANDS)]
+    for i, text in enumerate(texts):
+        codes = {((ord(text[j]) << 42) | (ord(text[j + 1]) << 21) | ord(text[j + 2])) % _MINHASH_PRIME
+                 for j in range(len(text) - 2)}
+        sig = [min((an * c + bn) % _MINHASH_PRIME for c in codes) for an, bn in zip(a, b)]
+        for band, buckets in enumerate(bands):
+            buckets.setdefault(tuple(sig[band * rows:(band + 1) * rows]), []).append(i)
+    for buckets in bands:
+        for members in buckets.values():
+            if len(members) > 1:
+                yield members
+
+
+def find_near_duplicates(texts: List[str], threshold: float = NEAR_DUP_THRESHOLD,
+                         weights: List[int] | None = None) -> List[List[int]]:
+    """在 texts（_near_dup_text 处理过的文本）里找近似重复的簇，返回下标列表的列表，每簇第一个是共享句。
+
+    MinHash 签名分段做局部敏感哈希，只有落进同一个桶的句子才算 Jaccard 相似度核实，
+    总体接近线性。成簇时按 weights（出现次数）从高到低挑共享句，簇里每一句都和共享句
+    相似，不会像单链接那样把模板句一路串成一大簇。
+    """
+    candidates = [i for i, text in enumerate(texts) if len(text) >= 3]
+    subset = [texts[i] for i in candidates]
+    try:
+        import numpy as np
+        buckets = _lsh_buckets_numpy(subset, np)
+    except ImportError:
+        print("[WARN] 未安装 numpy，用纯 Python 计算 MinHash，大语料会很慢。可以运行：python -m pip install numpy")
+        buckets = _lsh_buckets_python(subset)
+
+    shingles = [_shingles(text) for text in subset]
+    sizes = [len(sh) for sh in shingles]
+    checked: set[tuple[int, int]] = set()
+    neighbors: Dict[int, List[int]] = {}
+    for members in buckets:
+        if len(members) <= NEAR_DUP_MAX_BUCKET:
+            pairs: Iterator[tuple[int, int]] = itertools.combinations(members, 2)
+        else:
+            pairs = ((members[0], m) for m in members[1:])
+        for i, j in pairs:
+            pair = (i, j) if i < j else (j, i)
+            if pair in checked:
+                continue
+            checked.add(pair)
+            # 集合大小差太多时 Jaccard 不可能达标，不用求交集
+            if min(sizes[i], sizes[j]) < threshold * max(sizes[i], sizes[j]):
+                continue
+            if _jaccard(shingles[i], shingles[j]) >= threshold:
+                neighbors.setdefault(i, []).append(j)
+                neighbors.setdefault(j, []).append(i)
+
+    weight = (lambda i: weights[candidates[i]]) if weights else (lambda i: 0)
+    assigned: set[int] = set()
+    clusters = []
+    for i in sorted(neighbors, key=lambda i: (-weight(i), i)):
+        if i in assigned:
+            continue
+        members = [j for j in sorted(set(neighbors[i])) if j not in assigned]
+        if members:
+            assigned.add(i)
+            assigned.update(members)
+            clusters.append([candidates[j] for j in [i, *members]])
+    return clusters
+
+
+def analyze_near_duplicates(lessons: List[Lesson], threshold: float = NEAR_DUP_THRESHOLD,
+                            merge: bool = False) -> Path:
+    """对所有 lesson 的句子做近似重复检测，报告写到 build/near_duplicates.json。
+
+    先按 sentence_key 精确去重（撇号 / 空白不同的写法本来就是同一句），
+    再在不重复的句子之间找近似重复。每簇里出现次数最多的一句作为共享条目。
+    merge=True 时把其余句子到共享条目的映射写进 build/sentence_merges.json，
+    之后带 --report-duplicates 的构建里 build/sentences.json 会把它们合并成一条。
+    """
+    start = time.perf_counter()
+    index: Dict[str, int] = {}
+    by_raw: Dict[str, int] = {}      # 原文 -> 下标，同一写法不必再规范化、算哈希
+    keys: List[str] = []
+    first_fr: List[str] = []
+    counts: List[int] = []
+    refs: List[List[List[Any]]] = []
+    total = 0
+    for lesson in lessons:
+        for idx, s in enumerate(lesson.sentences, start=1):
+            total += 1
+            u = by_raw.get(s.fr)
+            if u is None:
+                key = sentence_key(s.fr)
+                u = index.get(key)
+                if u is None:
+                    u = index[key] = len(keys)
+                    keys.append(key)
+                    first_fr.append(s.fr)
+                    counts.append(0)
+                    refs.append([])
+                by_raw[s.fr] = u
+            counts[u] += 1
+            if len(refs[u]) < NEAR_DUP_MAX_REFS:
+                refs[u].append([lesson.id, idx])
+
+    texts = [_near_dup_text(fr) for fr in first_fr]
+    clusters = []
+    merges: Dict[str, str] = {}
+    for members in find_near_duplicates(texts, threshold, counts):
+        shared = members[0]
+        members[1:] = sorted(members[1:], key=lambda u: (-counts[u], u))
+        clusters.append({
+            "shared": keys[shared],
+            "count": sum(counts[u] for u in members),
+            "members": [{"id": keys[u], "fr": first_fr[u], "count": counts[u],
+                         "similarity": round(_jaccard(_shingles(texts[shared]), _shingles(texts[u])), 3),
+                         "refs": refs[u]}
+                        for u in members],
+        })
+        merges.update((keys[u], keys[shared]) for u in members if u != shared)
+    clusters.sort(key=lambda c: -c["count"])
+
+    duplicated = sum(len(c["members"]) for c in clusters)
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    NEAR_DUPLICATES_PATH.write_text(json.dumps({
+        "threshold": threshold,
+        "total": total,
+        "unique": len(keys),
+        "clusters": clusters,
+    }, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+
+    print(f"[OK] 近似重复: {total} 句（{len(keys)} 句不重复）里找到 {len(clusters)} 组，"
+          f"涉及 {duplicated} 句，用时 {time.perf_counter() - start:.1f}s -> {NEAR_DUPLICATES_PATH}")
+    for cluster in clusters[:10]:
+        shared, *others = cluster["members"]
+        print(f"  「{shared['fr']}」 ≈ " + "，".join(f"「{m['fr']}」({m['similarity']:.2f})"
+                                                 for m in others[:3])
+              + (f" 等 {len(others)} 句" if len(others) > 3 else ""))
+
+    if merge:
+        SENTENCE_MERGES_PATH.write_text(json.dumps(merges, indent=1, sort_keys=True), encoding="utf-8")
+        print(f"[OK] 合并表: {SENTENCE_MERGES_PATH}（{len(merges)} 句并入共享条目，下次 --report-duplicates 构建的句子库生效）")
+    return NEAR_DUPLICATES_PATH
+
+
+# ========== 词汇统计（stats.html，需要 numpy） ==========
+
+STATS_PATH = BASE_DIR / "stats.html"
+STATS_JSON_PATH = OUTPUT_DIR / "stats.json"
+ANALYTICS_CACHE_PATH = OUTPUT_DIR / ".analytics.json"
+ANALYTICS_VERSION = 1
+STATS_TOP_WORDS = 200              # 高频词表的长度
+STATS_CORE_WORDS = 1000            # 全库最常用的这么多词算"核心词"，统计每课被它们覆盖的比例
+STATS_NEW_WORD_SAMPLES = 8         # 每课列出几个新词示例
+STATS_COVERAGE_LEVELS = (0.5, 0.8, 0.9, 0.95, 0.98)
+
+# 省音形式还原成完整的词（l' 统一算作 le）；aujourd'hui 整体算一个词
+FR_ELISIONS = {"l": "le", "d": "de", "j": "je", "m": "me", "t": "te", "s": "se", "n": "ne",
+               "c": "ce", "qu": "que", "jusqu": "jusque", "lorsqu": "lorsque", "puisqu": "puisque"}
+_FR_WORD = re.compile(r"aujourd'hui|[^\W\d_]+'?")
+
+HTML_STATS_TEMPLATE = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+  <meta charset="UTF-8" />
+  <title>Vocabulaire - fr.awtza.com</title>
+  <style>
+    body {{
+      font-family: system-ui, -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+      max-width: 900px;
+      margin: 2rem auto;
+      padding: 0 1rem;
+      background: #f7f7f7;
+    }}
+    h1 {{
+      margin-bottom: 0.5rem;
     }}
-    .title-line {{
-      font-size: 0.98rem;
-      margin-bottom: 0.2rem;
+    h2 {{
+      font-size: 1.1rem;
+      margin: 2rem 0 0.5rem;
     }}
-    .title-zh {{
+    .subtitle {{
+      color: #666;
+      margin-bottom: 1.5rem;
       font-size: 0.9rem;
-      color: #555;
-      margin-bottom: 0.2rem;
     }}
-    .desc {{
+    .subtitle a,
+    td a {{
+      color: #1976d2;
+      text-decoration: none;
+    }}
+    table {{
+      width: 100%;
+      border-collapse: collapse;
+      background: #fff;
       font-size: 0.86rem;
-      color: #666;
-      margin-bottom: 0.2rem;
     }}
-    .filename {{
-      font-size: 0.8rem;
-      color: #999;
+    th, td {{
+      padding: 0.35rem 0.6rem;
+      border-bottom: 1px solid #eee;
+      text-align: left;
     }}
-    .links {{
-      margin-top: 0.25rem;
-      font-size: 0.8rem;
+    th {{
       color: #666;
+      font-weight: 600;
     }}
-    .links a {{
-      color: #1976d2;
-      margin-right: 0.5rem;
+    td.num {{
+      text-align: right;
+      font-variant-numeric: tabular-nums;
     }}
-    .links a:hover {{
-      text-decoration: underline;
+    .words {{
+      color: #666;
     }}
   </style>
 </head>
 <body>
-  <h1>📚 Bruce 的法语学习首页</h1>
-  <div class="subtitle">自动生成目录 · 最后更新：{last_updated}</div>
-  <ul>
-{items}
-  </ul>
+  <h1>📊 词汇统计</h1>
+  <div class="subtitle"><a href="index.html">← 返回目录</a> · 最后更新：{last_updated}</div>
+  <table>
+{overview}
+  </table>
+  <h2>覆盖率：最常用的多少个词覆盖全部词次的多少</h2>
+  <table>
+    <tr><th>覆盖</th><th>需要的词数</th></tr>
+{coverage}
+  </table>
+  <h2>各课词汇</h2>
+  <table>
+    <tr><th>Lesson</th><th>句数</th><th>词次</th><th>词数</th><th>新词</th><th>新词率</th><th>独有词</th><th>核心词覆盖</th><th>新词示例</th></tr>
+{lessons}
+  </table>
+  <h2>高频词（前 {top} 个）</h2>
+  <table>
+    <tr><th>#</th><th>词</th><th>次数</th><th>占比</th><th>出现的课数</th></tr>
+{words}
+  </table>
 </body>
 </html>
 """
 
-def build_index_html(lessons: list[dict[str, Any]]) -> str:
+HTML_STATS_OVERVIEW_ROW_TEMPLATE = """    <tr><th>{name}</th><td class="num">{value}</td></tr>"""
+
+HTML_STATS_COVERAGE_ROW_TEMPLATE = """    <tr><td>{level}</td><td class="num">{words}</td></tr>"""
+
+HTML_STATS_LESSON_ROW_TEMPLATE = """    <tr><td><a href="{href}">{title}</a></td><td class="num">{sentences}</td><td class="num">{tokens}</td><td class="num">{distinct}</td><td class="num">{new}</td><td class="num">{novelty}</td><td class="num">{unique}</td><td class="num">{core}</td><td class="words">{samples}</td></tr>"""
+
+HTML_STATS_WORD_ROW_TEMPLATE = """    <tr><td class="num">{rank}</td><td>{word}</td><td class="num">{count}</td><td class="num">{share}</td><td class="num">{lessons}</td></tr>"""
+
+
+def fr_words(text: str) -> List[str]:
+    """法语切词：规范化后转小写，按字母串切分（数字、标点都丢掉），连字符也当作分隔；
+    l' / qu' 等省音形式还原成 le / que，这样 l'hôtel 和 le musée 里的冠词算同一个词。"""
+    words = _FR_WORD.findall(normalize_text(text).lower())
+    for n, word in enumerate(words):
+        if word[-1] == "'":
+            words[n] = FR_ELISIONS.get(word[:-1], word[:-1])
+    return words
+
+
+def _lesson_word_counts(lesson: Lesson) -> Dict[str, Any]:
+    # 整课拼成一段一次切完（词不会跨过空格），只聚合成词频，切出来的词不留到下一课
+    texts = [s.fr for s in lesson.sentences]
+    counts = Counter(fr_words("\n".join(texts)))
+    sentences = len(texts)
+    # 按词排序：缓存文件内容稳定，同一份输入得到同一份字节
+    return {"source": lesson.source_hash, "sentences": sentences,
+            "words": dict(sorted(counts.items()))}
+
+
+def update_analytics_cache(lessons: List[Lesson],
+                           only: set[str] | None = None) -> tuple[Dict[str, Dict[str, Any]], int]:
+    """每课的词频缓存在 build/.analytics.json 里，按 lesson 的源文件指纹失效：
+    只有改过的 lesson 需要重新切词。only 非空时（--watch）其它 lesson 直接用缓存里的条目。
+    返回 ({lesson id: 缓存条目}, 重新切词的课数)。"""
+    cached: Dict[str, Dict[str, Any]] = {}
+    if ANALYTICS_CACHE_PATH.exists():
+        try:
+            data = json.loads(ANALYTICS_CACHE_PATH.read_text(encoding="utf-8"))
+            if data.get("version") == ANALYTICS_VERSION:
+                cached = data["lessons"]
+        except (ValueError, KeyError) as e:
+            print(f"[WARN] 词频缓存损坏，重新统计: {ANALYTICS_CACHE_PATH} -> {e!r}")
+
+    entries: Dict[str, Dict[str, Any]] = {}
+    refreshed = 0
+    for lesson in lessons:
+        entry = cached.get(lesson.id)
+        trusted = entry is not None and only is not None and lesson.id not in only
+        if not trusted and (entry is None or entry.get("source") != lesson.source_hash
+                            or not lesson.source_hash):
+            entry = _lesson_word_counts(lesson)
+            refreshed += 1
+        entries[lesson.id] = entry
+    if refreshed or entries.keys() != cached.keys():
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = ANALYTICS_CACHE_PATH.with_name(ANALYTICS_CACHE_PATH.name + ".tmp")
+        tmp.write_text(json.dumps({"version": ANALYTICS_VERSION, "lessons": entries},
+                                  ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, ANALYTICS_CACHE_PATH)
+    return entries, refreshed
+
+
+def corpus_analytics(lessons: List[Lesson], entries: Dict[str, Dict[str, Any]], np: Any) -> Dict[str, Any]:
+    """由每课的词频拼出稀疏的词-课矩阵（COO：课号、词号、次数三个数组），一次性算出：
+
+    - 每个词的总次数、出现的课数，以及最常用的多少个词能覆盖多少比例的词次
+    - 每课的词次、词数、新词（按目录顺序第一次出现在这一课的词）、独有词（只有这一课用到）
+      和核心词覆盖率（这一课的词次里有多少属于全库最常用的 STATS_CORE_WORDS 个词）
+    """
+    # 词表按字母排序：词号稳定，次数相同的词也按字母排
+    vocab = sorted({word for lesson in lessons for word in entries[lesson.id]["words"]})
+    term_of = {word: n for n, word in enumerate(vocab)}
+    n_docs, n_terms = len(lessons), len(vocab)
+    row_lengths = [len(entries[lesson.id]["words"]) for lesson in lessons]
+    doc_ids = np.repeat(np.arange(n_docs, dtype=np.int64), row_lengths)
+    term_ids = np.fromiter((term_of[word] for lesson in lessons for word in entries[lesson.id]["words"]),
+                           dtype=np.int64, count=len(doc_ids))
+    counts = np.fromiter((c for lesson in lessons for c in entries[lesson.id]["words"].values()),
+                         dtype=np.int64, count=len(doc_ids))
+
+    freq = np.bincount(term_ids, weights=counts, minlength=n_terms).astype(np.int64)
+    doc_freq = np.bincount(term_ids, minlength=n_terms)
+    by_freq = np.argsort(-freq, kind="stable")
+    rank = np.empty(n_terms, dtype=np.int64)
+    rank[by_freq] = np.arange(n_terms)
+    total = int(freq.sum())
+    cumulative = np.cumsum(freq[by_freq])
+    coverage = [[level, int(np.searchsorted(cumulative, level * total) + 1)]
+                for level in STATS_COVERAGE_LEVELS] if total else []
+
+    # COO 按课号递增排列，每个词第一次出现的位置就是它第一次出现的那一课
+    _, first_pos = np.unique(term_ids, return_index=True)
+    first_doc = np.empty(n_terms, dtype=np.int64)
+    first_doc[term_ids[first_pos]] = doc_ids[first_pos]
+    is_new = first_doc[term_ids] == doc_ids
+    tokens = np.bincount(doc_ids, weights=counts, minlength=n_docs).astype(np.int64)
+    distinct = np.bincount(doc_ids, minlength=n_docs)
+    new = np.bincount(doc_ids[is_new], minlength=n_docs)
+    unique = np.bincount(doc_ids[doc_freq[term_ids] == 1], minlength=n_docs)
+    core = np.bincount(doc_ids, weights=counts * (rank[term_ids] < STATS_CORE_WORDS), minlength=n_docs)
+
+    offsets = np.concatenate(([0], np.cumsum(row_lengths)))
+    lesson_rows = []
+    for d, lesson in enumerate(lessons):
+        lo, hi = offsets[d], offsets[d + 1]
+        fresh = term_ids[lo:hi][is_new[lo:hi]]
+        samples = fresh[np.argsort(rank[fresh], kind="stable")[:STATS_NEW_WORD_SAMPLES]]
+        lesson_rows.append({
+            "id": lesson.id,
+            "title": lesson.title,
+            "sentences": entries[lesson.id]["sentences"],
+            "tokens": int(tokens[d]),
+            "distinct": int(distinct[d]),
+            "new": int(new[d]),
+            "novelty": round(float(new[d] / distinct[d]), 4) if distinct[d] else 0.0,
+            "unique": int(unique[d]),
+            "core_coverage": round(float(core[d] / tokens[d]), 4) if tokens[d] else 0.0,
+            "new_words": [vocab[t] for t in samples.tolist()],
+        })
+
+    return {
+        "version": ANALYTICS_VERSION,
+        "lessons_count": n_docs,
+        "tokens": total,
+        "vocabulary": n_terms,
+        "hapax": int((freq == 1).sum()),
+        "coverage": coverage,
+        "top_words": [[vocab[t], int(freq[t]), int(doc_freq[t])] for t in by_freq[:STATS_TOP_WORDS].tolist()],
+        "lessons": lesson_rows,
+    }
+
+
+def analytics_input_key(lessons: List[Lesson], assets: Dict[str, str] | None = None) -> str:
+    templates = (HTML_STATS_TEMPLATE + HTML_STATS_OVERVIEW_ROW_TEMPLATE + HTML_STATS_COVERAGE_ROW_TEMPLATE
+                 + HTML_STATS_LESSON_ROW_TEMPLATE + HTML_STATS_WORD_ROW_TEMPLATE)
+    assets = assets or {}
+    return _sha256(str(ANALYTICS_VERSION), templates,
+                   *(f"{lesson.id}:{lesson.source_hash}:{assets.get(f'{lesson.id}.html', '')}"
+                     for lesson in lessons))
+
+
+def render_stats_page(stats: Dict[str, Any], assets: Dict[str, str] | None = None,
+                      last_updated: str = "") -> str:
+    assets = assets or {}
+    build_dir = _root_rel(OUTPUT_DIR)
+    tokens = stats["tokens"]
+    overview = [("Lesson", stats["lessons_count"]), ("句数", sum(row["sentences"] for row in stats["lessons"])),
+                ("词次", tokens), ("词数", stats["vocabulary"]), ("只出现一次的词", stats["hapax"])]
+    lesson_lines = []
+    for row in stats["lessons"]:
+        html_name = f"{row['id']}.html"
+        lesson_lines.append(compile_template(HTML_STATS_LESSON_ROW_TEMPLATE).render(
+            href=f"{build_dir}/{assets.get(html_name, html_name)}",
+            title=row["title"] or row["id"],
+            sentences=row["sentences"],
+            tokens=row["tokens"],
+            distinct=row["distinct"],
+            new=row["new"],
+            novelty=f"{row['novelty']:.0%}",
+            unique=row["unique"],
+            core=f"{row['core_coverage']:.0%}",
+            samples=", ".join(row["new_words"]),
+        ))
+    return compile_template(HTML_STATS_TEMPLATE).render(
+        last_updated=last_updated,
+        top=len(stats["top_words"]),
+        overview=Markup("\n".join(compile_template(HTML_STATS_OVERVIEW_ROW_TEMPLATE).render(name=name, value=value)
+                                  for name, value in overview)),
+        coverage=Markup("\n".join(compile_template(HTML_STATS_COVERAGE_ROW_TEMPLATE).render(
+            level=f"{level:.0%}", words=words) for level, words in stats["coverage"])),
+        lessons=Markup("\n".join(lesson_lines)),
+        words=Markup("\n".join(compile_template(HTML_STATS_WORD_ROW_TEMPLATE).render(
+            rank=n, word=word, count=count, share=f"{count / tokens:.2%}", lessons=docs)
+            for n, (word, count, docs) in enumerate(stats["top_words"], start=1))),
+    )
+
+
+def build_vocabulary_stats(lessons: List[Lesson], assets: Dict[str, str] | None = None,
+                           report: BuildReport | None = None, only: set[str] | None = None) -> Path | None:
+    """统计所有 lesson 的法语词汇，写 build/stats.json 和根目录的 stats.html（目录页链接到它）。
+
+    切词结果按 lesson 缓存（见 update_analytics_cache，only 同那里），每次只重算全库汇总
+    （新词、覆盖率这些依赖所有 lesson 的量），矩阵运算用 numpy；没装 numpy 时跳过。
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        print("[WARN] 未安装 numpy，跳过词汇统计。可以运行：python -m pip install numpy")
+        return None
+
+    entries, refreshed = update_analytics_cache(lessons, only)
+    stats = corpus_analytics(lessons, entries, np)
+    STATS_JSON_PATH.write_text(json.dumps(stats, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    last_updated = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    written = STATS_PATH.write_bytes(render_stats_page(stats, assets, last_updated).encode("utf-8"))
+    if report is not None:
+        report.add("stats", misses=1, bytes=written + STATS_JSON_PATH.stat().st_size)
+        report.info["vocabulary"] = {key: stats[key] for key in ("tokens", "vocabulary", "hapax")}
+    print(f"[OK] 词汇统计: {STATS_PATH}（{stats['tokens']} 词次，{stats['vocabulary']} 个词，"
+          f"重新切词 {refreshed} / {len(lessons)} 课）")
+    return STATS_PATH
+
+
+# ========== 每日 lesson 生成器（--daily） ==========
+
+DAILY_INDEX_DIR = OUTPUT_DIR / ".daily"
+DAILY_INDEX_VERSION = 1
+DAILY_SIZE = 50
+DAILY_AVOID_DAYS = 30          # 最近这么多天的每日 lesson 用过的句子不再抽
+DAILY_WEIGHTS = ("uniform", "easy", "hard", "novelty")
+DAILY_WEIGHT_SCALE = 1000      # 权重放大后取整，抽样全程整数运算，结果和平台无关
+_DAILY_ID = re.compile(r"^daily_\d{4}-\d{2}-\d{2}$")
+
+
+def _daily_pool_key(db: Path | None = None, tag: str | None = None) -> str:
+    """句子池的输入指纹：只看各 lesson 源文件的 (文件名, mtime_ns, 大小)，既不解析也不读内容
+    （生成的每日 lesson 不算在池里）。按文件读取时 tag 只记进指纹，不用为了过滤先把每个 lesson 解析一遍。"""
+    if db is not None:
+        conn = _connect_db(db)
+        try:
+            rows = conn.execute("SELECT id, source_hash FROM lessons ORDER BY id").fetchall()
+        finally:
+            conn.close()
+        parts = [f"{lesson_id}:{source_hash}" for lesson_id, source_hash in rows
+                 if not _DAILY_ID.match(lesson_id)]
+    else:
+        parts = []
+        for path in _lesson_paths():
+            if _DAILY_ID.match(path.stem):
+                continue
+            st = path.stat()
+            parts.append(f"{path.name}:{st.st_mtime_ns}:{st.st_size}")
+    return _sha256(str(DAILY_INDEX_VERSION), str(db or ""), tag or "", *parts)
+
+
+def _fenwick(weights: array.array) -> array.array:
+    """O(n) 建树状数组（1 起始）：tree[i] 是 weights[i - lowbit(i), i) 之和。"""
+    tree = array.array("q", [0])
+    tree.extend(weights)
+    n = len(weights)
+    for i in range(1, n + 1):
+        j = i + (i & -i)
+        if j <= n:
+            tree[j] += tree[i]
+    return tree
+
+
+def _daily_file(name: str) -> Path:
+    return DAILY_INDEX_DIR / name
+
+
+def _write_daily_array(name: str, values: array.array) -> None:
+    with _daily_file(name).open("wb") as f:
+        values.tofile(f)
+
+
+def build_daily_index(lessons: List[Lesson], key: str) -> int:
+    """把所有 lesson 的句子按 sentence_key 去重成句子池，写 build/.daily/：
+
+    - pool.jsonl + offsets：每行一句 [fr, zh, en, 出处]，offsets 是每行的字节偏移（按下标随机读取）
+    - keys + positions：按句子 id 排序的 64 位整数和对应的池下标（二分查找，排除最近用过的句子）
+    - <权重>.fenwick：每种权重的树状数组（抽一句、删一句都是 O(log 池大小)）
+    - meta.json：最后写，它在索引才算完整
+
+    权重：uniform 都是 1；easy / hard 按难度（词越多、越少见越难）平方的倒数 / 本身；
+    novelty 按句中词的平均信息量的平方，少见词多的句子更容易被抽到。返回池里的句数。
     """
-    生成 index.html 内容：
-    - 用 lessons 里的元数据（如果有）补充标题/中文/描述
-    - 扫描 build/*.html，把所有 HTML 页面都做成卡片
+    start = time.perf_counter()
+    if DAILY_INDEX_DIR.exists():
+        shutil.rmtree(DAILY_INDEX_DIR)
+    DAILY_INDEX_DIR.mkdir(parents=True)
+
+    seen: set[str] = set()
+    key_ints: List[int] = []
+    words_of: List[List[str]] = []
+    word_counts: Counter[str] = Counter()
+    offsets = array.array("Q", [0])
+    with _daily_file("pool.jsonl").open("wb") as f:
+        for lesson in lessons:
+            if _DAILY_ID.match(lesson.id):
+                continue
+            for idx, s in enumerate(lesson.sentences, start=1):
+                if s.fr in seen:
+                    continue
+                seen.add(s.fr)
+                sid = sentence_key(s.fr)
+                if sid in seen:
+                    continue
+                seen.add(sid)
+                key_ints.append(int(sid, 16))
+                words = fr_words(s.fr)
+                words_of.append(words)
+                word_counts.update(words)
+                offsets.append(offsets[-1] + f.write(
+                    (json.dumps([s.fr, s.zh, s.en, f"{lesson.id}#{idx}"], ensure_ascii=False) + "\n")
+                    .encode("utf-8")))
+    _write_daily_array("offsets", offsets)
+
+    order = sorted(range(len(key_ints)), key=key_ints.__getitem__)
+    _write_daily_array("keys", array.array("Q", (key_ints[i] for i in order)))
+    _write_daily_array("positions", array.array("I", order))
+
+    rank = {word: n for n, (word, _) in enumerate(sorted(word_counts.items(), key=lambda wc: (-wc[1], wc[0])))}
+    total_words = sum(word_counts.values())
+    # 难度：每个词按词频排名取对数再相加，句子越长、用词越少见越难
+    difficulty = [sum(math.log2(2 + rank[w]) for w in words) or 1.0 for words in words_of]
+    # 少见程度：句中各词信息量（-log2 词频）的平均值
+    rarity = [sum(math.log2(total_words / word_counts[w]) for w in words) / len(words) if words else 0.0
+              for words in words_of]
+    weights = {
+        "uniform": [1] * len(words_of),
+        "easy": [max(1, round(DAILY_WEIGHT_SCALE * 1000 / (d * d))) for d in difficulty],
+        "hard": [max(1, round(d * d)) for d in difficulty],
+        "novelty": [1 + round(DAILY_WEIGHT_SCALE * r * r) for r in rarity],
+    }
+    for mode in DAILY_WEIGHTS:
+        _write_daily_array(f"{mode}.fenwick", _fenwick(array.array("q", weights[mode])))
+
+    _daily_file("meta.json").write_text(json.dumps(
+        {"version": DAILY_INDEX_VERSION, "key": key, "count": len(key_ints)}), encoding="utf-8")
+    print(f"[OK] 每日 lesson 索引: {DAILY_INDEX_DIR}（{len(key_ints)} 句，{time.perf_counter() - start:.1f}s）")
+    return len(key_ints)
+
+
+class DailyIndex:
+    """build/.daily/ 的只读视图。文件都用 mmap 打开，抽样只访问用到的几个位置，
+    不把整个句子池读进内存。"""
+
+    def __init__(self, directory: Path = DAILY_INDEX_DIR):
+        self.directory = directory
+        meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+        self.key = meta["key"]
+        self.count = meta["count"]
+        self._stack = contextlib.ExitStack()
+        self._pool = self._stack.enter_context((directory / "pool.jsonl").open("rb"))
+        self.offsets = self._view("offsets", "Q")
+        self.keys = self._view("keys", "Q")
+        self.positions = self._view("positions", "I")
+
+    def _view(self, name: str, fmt: str) -> memoryview:
+        f = self._stack.enter_context((self.directory / name).open("rb"))
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array.array(fmt))
+        mapped = self._stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        # 关闭 mmap 之前要先释放它导出的 memoryview（ExitStack 按相反顺序执行）
+        raw = memoryview(mapped)
+        self._stack.callback(raw.release)
+        view = raw.cast(fmt)
+        self._stack.callback(view.release)
+        return view
+
+    def close(self) -> None:
+        self._stack.close()
+
+    def __enter__(self) -> "DailyIndex":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def find(self, text: str) -> int | None:
+        """句子原文 -> 池下标（二分查找 keys），不在池里返回 None。"""
+        target = int(sentence_key(text), 16)
+        i = bisect.bisect_left(self.keys, target)
+        if i < len(self.keys) and self.keys[i] == target:
+            return self.positions[i]
+        return None
+
+    def entry(self, i: int) -> List[str]:
+        """第 i 句：[fr, zh, en, 出处]。"""
+        self._pool.seek(self.offsets[i])
+        return json.loads(self._pool.read(self.offsets[i + 1] - self.offsets[i]))
+
+    def sample(self, mode: str, size: int, rng: random.Random, exclude: List[int] | None = None) -> List[int]:
+        """按 mode 的权重不放回地抽 size 句，exclude 里的下标不抽。
+
+        磁盘上的树状数组只读；删除的句子记在一个小字典里（树节点 -> 增量），
+        每次抽取 / 删除都是 O(log 池大小)，总共 O((size + 排除数) · log 池大小)。
+        """
+        tree = self._view(f"{mode}.fenwick", "q")
+        n = self.count
+        delta: Dict[int, int] = {}
+
+        def node(i: int) -> int:
+            return tree[i] + delta.get(i, 0)
+
+        def prefix(i: int) -> int:
+            total = 0
+            while i > 0:
+                total += node(i)
+                i -= i & -i
+            return total
+
+        def remove(i: int) -> int:
+            weight = prefix(i + 1) - prefix(i)
+            j = i + 1
+            while j <= n:
+                delta[j] = delta.get(j, 0) - weight
+                j += j & -j
+            return weight
+
+        total = prefix(n)
+        for i in set(exclude or ()):
+            total -= remove(i)
+        top = 1 << (n.bit_length() - 1) if n else 0
+        picked: List[int] = []
+        while len(picked) < size and total > 0:
+            target = rng.randrange(total)
+            pos, bit = 0, top
+            while bit:
+                nxt = pos + bit
+                if nxt <= n and node(nxt) <= target:
+                    pos = nxt
+                    target -= node(nxt)
+                bit >>= 1
+            picked.append(pos)
+            total -= remove(pos)
+        return picked
+
+
+def _recent_daily_lessons(day: datetime.date, days: int) -> List[Path]:
+    recent = (CONTENT_DIR / f"daily_{day - datetime.timedelta(days=n)}.json" for n in range(1, days + 1))
+    return [path for path in recent if path.exists()]
+
+
+def _format_daily_lesson(data: Dict[str, Any]) -> str:
+    """和手写的 daily_50.json 同样的排版：元数据缩进两格，每句一行。"""
+    sentences = data.pop("sentences")
+    head = json.dumps(data, ensure_ascii=False, indent=2)[:-2]
+    lines = [f'    {{ {json.dumps(s, ensure_ascii=False)[1:-1]} }}' for s in sentences]
+    return f'{head},\n  "sentences": [\n' + ",\n".join(lines) + "\n  ]\n}\n"
+
+
+def generate_daily_lesson(day: datetime.date, size: int = DAILY_SIZE, seed: str = "",
+                          avoid_days: int = DAILY_AVOID_DAYS, weight: str = "uniform",
+                          db: Path | None = None, tag: str | None = None) -> Path | None:
+    """从句子池抽 size 句写成 lessons/daily_<日期>.json，之后的构建会把它当普通 lesson 处理。
+
+    同一个 seed、日期和句子池总是得到同一份 lesson；最近 avoid_days 天的每日 lesson
+    里出现过的句子不会再被抽到。句子池索引（build_daily_index）只在 lesson 变化后重建，
+    平时生成一天只需要 O((size + 排除数) · log 池大小)。
     """
-    # 先把 lessons 做成一个快速索引：id -> meta
-    lesson_meta: dict[str, dict[str, Any]] = {}
-    for lesson in lessons:
-        lesson_meta[lesson["id"]] = lesson
+    if weight not in DAILY_WEIGHTS:
+        raise ValueError(f"未知的权重: {weight}（可选 {', '.join(DAILY_WEIGHTS)}）")
+    if db is not None and not db.exists():
+        print(f"[ERROR] 内容库不存在: {db}，先运行 python build_lessons.py --import-db")
+        return None
+
+    key = _daily_pool_key(db, tag)
+    meta_path = _daily_file("meta.json")
+    fresh = False
+    try:
+        fresh = json.loads(meta_path.read_text(encoding="utf-8")).get("key") == key
+    except (OSError, ValueError):
+        pass
+    if not fresh:
+        build_daily_index(load_lessons(db, tag), key)
 
-    item_lines: list[str] = []
+    path = CONTENT_DIR / f"daily_{day}.json"
+    with DailyIndex() as index:
+        if not index.count:
+            print("[WARN] 句子池是空的，没有生成每日 lesson")
+            return None
+        used: List[int] = []
+        recent = _recent_daily_lessons(day, avoid_days)
+        for recent_path in recent:
+            lesson = load_lesson(recent_path)
+            if lesson is not None:
+                used.extend(i for i in map(index.find, (s.fr for s in lesson.sentences)) if i is not None)
+        rng = random.Random(_sha256("daily", seed, day.isoformat()))
+        picked = index.sample(weight, size, rng, used)
+        if len(picked) < size:
+            print(f"[WARN] 排除最近 {avoid_days} 天用过的句子后只剩 {len(picked)} 句可抽")
+        sentences = []
+        for n, i in enumerate(picked, start=1):
+            fr, zh, en, source = index.entry(i)
+            sentences.append({"id": n, "fr": fr, "zh": zh, "en": en, "source": source})
+        pool = index.count
 
-    # 遍历 build 目录下所有 html（排除自身 index.html，如果存在）
-    if OUTPUT_DIR.exists():
-        html_files = sorted(OUTPUT_DIR.glob("*.html"))
+    CONTENT_DIR.mkdir(parents=True, exist_ok=True)
+    path.write_text(_format_daily_lesson({
+        "title": f"Daily {len(sentences)} French Sentences - {day}",
+        "title_zh": f"每日 {len(sentences)} 句 · {day}",
+        "description_zh": f"从 {pool} 句里抽取（权重 {weight}，避开最近 {avoid_days} 天用过的 {len(set(used))} 句）",
+        "tags": ["daily"],
+        "daily": {"date": day.isoformat(), "seed": seed, "weight": weight, "avoid_days": avoid_days},
+        "sentences": sentences,
+    }), encoding="utf-8")
+    print(f"[OK] 每日 lesson: {path}（{len(sentences)} 句，参考了 {len(recent)} 个最近的每日 lesson）")
+    return path
+
+
+# ========== 资源指纹（--fingerprint） ==========
+
+ASSET_MANIFEST_PATH = OUTPUT_DIR / "asset-manifest.json"
+# 带指纹的文件名：<原名>.<8 位十六进制>.<扩展名>
+FINGERPRINTED_NAME = re.compile(r"^(?P<stem>.+)\.[0-9a-f]{8}(?P<suffix>\.[A-Za-z0-9]+)$")
+
+
+def _build_rel(path: Path) -> str:
+    return path.relative_to(OUTPUT_DIR).as_posix()
+
+
+def fingerprint_file(path: Path, cache: Dict[str, List[Any]] | None = None) -> Path:
+    """在 path 旁边放一个文件名带内容哈希的副本（能硬链接就硬链接），返回副本路径。
+
+    cache（build_all 存在 manifest["fingerprints"] 里）按 {相对 build/ 的路径: [mtime_ns, 大小, 哈希]}
+    记住上次算的哈希，文件没动过就不再整个读一遍。
+    """
+    st = path.stat()
+    rel = _build_rel(path)
+    entry = cache.get(rel) if cache is not None else None
+    if entry is not None and entry[:2] == [st.st_mtime_ns, st.st_size]:
+        digest = entry[2]
     else:
-        html_files = []
+        digest = _file_sha256(path)[:8]
+        if cache is not None:
+            cache[rel] = [st.st_mtime_ns, st.st_size, digest]
+    target = path.with_name(f"{path.stem}.{digest}{path.suffix}")
+    if not target.exists():
+        _place_file(path, target)
+    return target
+
+
+def _fingerprint_bytes(path: Path, data: bytes) -> Path:
+    """把 data 写成 path 的带哈希版本（用于改写过内容的 JSON）。"""
+    target = path.with_name(f"{path.stem}.{hashlib.sha256(data).hexdigest()[:8]}{path.suffix}")
+    if not target.exists():
+        target.write_bytes(data)
+    return target
 
-    for html_path in html_files:
-        if html_path.name.lower() == "index.html":
-            # 以前在 build 下生成过 index 的话，这里跳过
+
+def _prune_fingerprints(directory: Path, keep: set[str], bases: set[str] | None = None) -> None:
+    """删掉 directory 里不再被引用的旧指纹副本；bases 限定只处理这些原文件名的副本。"""
+    for path in directory.iterdir():
+        m = FINGERPRINTED_NAME.match(path.name)
+        if not m or path.name in keep:
+            continue
+        if bases is not None and m.group("stem") + m.group("suffix") not in bases:
             continue
+        path.unlink()
 
-        lid = html_path.stem  # e.g. daily_50
-        meta = lesson_meta.get(lid, {})
 
-        title = meta.get("title", lid)
-        title_zh = meta.get("title_zh", "")
-        desc = meta.get("description_zh") or meta.get("description") or ""
+def fingerprint_lesson_audio(lesson: Lesson, cache: Dict[str, List[Any]] | None = None) -> Dict[str, str]:
+    """给 audio/<id>/ 下的 mp3 和 sprite.json 生成指纹副本，返回路径映射（cache 见 fingerprint_file）。
 
-        # 根目录 index 链接指向 build 下的文件
-        html_href = f"build/{html_path.name}"
+    sprite.json 里的 src 会先改成 sprite mp3 的指纹名，再按改写后的内容取指纹。
+    """
+    audio_dir = AUDIO_ROOT / lesson.id
+    assets: Dict[str, str] = {}
+    if not audio_dir.exists():
+        return assets
 
-        # 可选链接：只在文件存在时显示
-        md_path = OUTPUT_DIR / f"{lid}.md"
-        csv_path = OUTPUT_DIR / f"{lid}.csv"
-        xlsx_path = OUTPUT_DIR / f"{lid}.xlsx"
+    for path in sorted(audio_dir.glob("*.mp3")):
+        if not FINGERPRINTED_NAME.match(path.name):
+            assets[_build_rel(path)] = _build_rel(fingerprint_file(path, cache))
 
-        links_parts: list[str] = [f'<a href="{html_href}">HTML</a>']
-        if md_path.exists():
-            links_parts.append(f'<a href="build/{lid}.md">MD</a>')
-        if csv_path.exists():
-            links_parts.append(f'<a href="build/{lid}.csv">CSV</a>')
-        if xlsx_path.exists():
-            links_parts.append(f'<a href="build/{lid}.xlsx">XLSX</a>')
+    sprite_index = audio_dir / SPRITE_INDEX_NAME
+    sprite_rel = _build_rel(audio_dir / SPRITE_NAME)
+    if sprite_index.exists() and sprite_rel in assets:
+        index = json.loads(sprite_index.read_text(encoding="utf-8"))
+        index["src"] = Path(assets[sprite_rel]).name
+        data = json.dumps(index, indent=1).encode("utf-8")
+        assets[_build_rel(sprite_index)] = _build_rel(_fingerprint_bytes(sprite_index, data))
 
-        links_html = " ".join(links_parts)
+    _prune_fingerprints(audio_dir, {Path(v).name for v in assets.values()})
+    return assets
 
-        block = f"""    <li>
-      <a href="{html_href}">
-        <div class="card">
-          <div class="title-line">{title}</div>
-          <div class="title-zh">{title_zh}</div>
-          {f'<div class="desc">{desc}</div>' if desc else ''}
-          <div class="filename">{html_path.name}</div>
-          <div class="links">
-            {links_html}
-          </div>
-        </div>
-      </a>
-    </li>"""
-        item_lines.append(block)
 
-    items_str = "\n".join(item_lines)
-    last_updated = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-    html = HTML_INDEX_TEMPLATE.format(last_updated=last_updated, items=items_str)
-    return html
+def fingerprint_lesson_artifacts(lesson: Lesson, cache: Dict[str, List[Any]] | None = None) -> Dict[str, str]:
+    """给 build/<id>.html / .md / .csv / .xlsx 生成指纹副本，返回路径映射（cache 见 fingerprint_file）。"""
+    assets: Dict[str, str] = {}
+    bases = {f"{lesson.id}.{fmt}" for fmt in LESSON_SINKS}
+    for name in sorted(bases):
+        path = OUTPUT_DIR / name
+        if path.exists():
+            assets[name] = _build_rel(fingerprint_file(path, cache))
+    _prune_fingerprints(OUTPUT_DIR, set(assets.values()), bases)
+    return assets
 
-def export_index_html(lessons: list[dict[str, Any]]) -> Path:
-    """
-    把 index.html 生在根目录（脚本所在目录），
-    链接指向 build/ 下面的所有 html。
+
+def save_asset_manifest(assets: Dict[str, str]) -> None:
+    """写 build/asset-manifest.json：原路径 -> 指纹路径（都相对 build/）。"""
+    ASSET_MANIFEST_PATH.write_text(json.dumps(assets, indent=2, sort_keys=True), encoding="utf-8")
+    print(f"[OK] 资源指纹: {ASSET_MANIFEST_PATH}（{len(assets)} 个文件）")
+
+
+def remove_lesson_fingerprints(lessons: List[Lesson]) -> None:
+    """不带 --fingerprint 构建时，删掉上次留下的 asset-manifest.json 和各 lesson 的指纹副本，
+    免得它们和页面里的链接对不上（共享的 build/assets/lesson.<哈希>.css / .js 不受影响）。"""
+    for lesson in lessons:
+        audio_dir = AUDIO_ROOT / lesson.id
+        if audio_dir.exists():
+            _prune_fingerprints(audio_dir, set())
+        _prune_fingerprints(OUTPUT_DIR, set(), {f"{lesson.id}.{fmt}" for fmt in LESSON_SINKS})
+    ASSET_MANIFEST_PATH.unlink()
+    print(f"[OK] 没有 --fingerprint：已删除旧的 {ASSET_MANIFEST_PATH.name} 和指纹副本")
+
+
+# ========== 公共样式 / 脚本（build/assets/） ==========
+
+ASSETS_DIR = OUTPUT_DIR / "assets"
+LESSON_CSS_REL = "assets/lesson.css"
+LESSON_JS_REL = "assets/lesson.js"
+LESSON_CRITICAL_CSS_REL = "assets/lesson.critical.css"
+SEARCH_JS_REL = "assets/search.js"
+# 课程页用到的那几项；search.js 只给目录页，改了它不应让所有课程页重新导出
+LESSON_PAGE_ASSETS = (LESSON_CSS_REL, LESSON_JS_REL, LESSON_CRITICAL_CSS_REL)
+
+
+def write_static_assets(inline_critical: bool = False) -> Dict[str, str]:
+    """写出压缩后、文件名带内容哈希的 lesson.css / lesson.js / search.js，返回路径映射。
+
+    映射和音频指纹一样交给页面渲染；inline_critical=True 时映射里多一项首屏样式，
+    页面会把它内联，完整样式表改成异步加载。内容不变时文件名不变，不会重复写。
     """
+    ASSETS_DIR.mkdir(parents=True, exist_ok=True)
+    css = minify_css(LESSON_CSS)
+    contents = {LESSON_CSS_REL: css, LESSON_JS_REL: minify_js(LESSON_JS),
+                SEARCH_JS_REL: minify_js(SEARCH_JS)}
+    if inline_critical:
+        contents[LESSON_CRITICAL_CSS_REL] = critical_css(css)
+
+    assets: Dict[str, str] = {}
+    for rel, text in contents.items():
+        path = _fingerprint_bytes(OUTPUT_DIR / rel, text.encode("utf-8"))
+        assets[rel] = _build_rel(path)
+    _prune_fingerprints(ASSETS_DIR, {Path(v).name for v in assets.values()},
+                        {Path(rel).name for rel in LESSON_PAGE_ASSETS + (SEARCH_JS_REL,)})
+    print(f"[OK] 公共样式 / 脚本: {', '.join(assets.values())}")
+    return assets
+
+
+# ========== 增量构建（build/.manifest.json） ==========
+
+def load_manifest() -> Dict[str, Any]:
+    """读取上次构建的 manifest；不存在、损坏或版本不符时返回空 manifest（即全量构建）。"""
+    empty: Dict[str, Any] = {"version": MANIFEST_VERSION, "lessons": {}, "index_pages": {}}
+    if not MANIFEST_PATH.exists():
+        return empty
+    try:
+        data = json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"[WARN] manifest 解析失败，将全量构建: {e!r}")
+        return empty
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+        return empty
+    data.setdefault("lessons", {})
+    data.setdefault("index_pages", {})
+    return data
+
+
+def save_manifest(manifest: Dict[str, Any]) -> None:
+    """先写临时文件再替换，避免构建中断留下半个 manifest。"""
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    path = BASE_DIR / "index.html"
-    html = build_index_html(lessons)
-    path.write_text(html, encoding="utf-8")
-    print(f"[OK] Index: {path}")
-    return path
+    tmp = MANIFEST_PATH.with_name(MANIFEST_PATH.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True),
+                   encoding="utf-8")
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def lesson_input_key(lesson: Lesson, fmt: str, assets: Dict[str, str] | None = None) -> str:
+    """某个 lesson 某种格式的输入指纹：lesson JSON + 导出器版本（HTML 另加模板和资源指纹）。"""
+    template = ""
+    if fmt == "html":
+        template = (HTML_LESSON_TEMPLATE_HEAD + HTML_PHRASE_TEMPLATE + HTML_LESSON_TEMPLATE_TAIL
+                    + LESSON_CSS + LESSON_JS)
+        if assets:
+            template += json.dumps(assets, sort_keys=True)
+    return _sha256(lesson.source_hash, fmt, str(EXPORTER_VERSIONS[fmt]), template)
+
+
+def stale_formats(lesson: Lesson, outputs: Dict[str, str],
+                  assets: Dict[str, str] | None = None) -> List[str]:
+    """返回需要重新导出的格式：指纹变了，或者产物文件被删了。"""
+    stale: List[str] = []
+    for fmt in LESSON_SINKS:
+        if outputs.get(fmt) != lesson_input_key(lesson, fmt, assets):
+            stale.append(fmt)
+        elif not (OUTPUT_DIR / f"{lesson.id}.{fmt}").exists():
+            stale.append(fmt)
+    return stale
+
+
+# ========== 构建报告（build_report.json） ==========
+
+# 报告每次构建都会变（时间戳、耗时），放在 build/ 外面并且不进 git：build/ 是随 git pull 部署的
+REPORT_PATH = BASE_DIR / "build_report.json"
+PROFILE_PATH = BASE_DIR / "build_profile.pstats"
+REPORT_VERSION = 1
+
+
+class BuildReport:
+    """记录一次构建里每个阶段、每个 lesson 的耗时和计数，最后写 build_report.json。
+
+    数据按 (阶段, lesson id) 累加；lesson id 为 "" 的是不属于单个 lesson 的工作
+    （公共资源、搜索索引、目录、预压缩等）。各字段：
+    - wall / cpu：墙钟时间和本进程 CPU 时间（秒）
+    - bytes：写入的字节数
+    - hits / misses：缓存命中（跳过）/ 重新生成的数量
+    - tts_calls / tts_chars：实际发给 TTS 的请求数和字符数（含重试）
+    export.<格式> 是 export 阶段里各格式的细分，只有墙钟时间（逐行取 CPU 时间太贵）。
+    """
+
+    def __init__(self) -> None:
+        self.started = datetime.datetime.now()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.rows: Dict[tuple[str, str], Dict[str, float]] = {}
+        # 不属于某个阶段的构建结果（例如句子去重统计），原样写进 report.json
+        self.info: Dict[str, Any] = {}
+
+    def add(self, stage: str, lesson_id: str = "", **counts: float) -> None:
+        row = self.rows.setdefault((stage, lesson_id), {})
+        for name, value in counts.items():
+            row[name] = row.get(name, 0) + value
+
+    def merge(self, rows: Dict[tuple[str, str], Dict[str, float]]) -> None:
+        """并入另一个 BuildReport 的 rows（子进程里导出时用）。"""
+        for (stage, lesson_id), counts in rows.items():
+            self.add(stage, lesson_id, **counts)
+
+    @contextlib.contextmanager
+    def stage(self, stage: str, lesson_id: str = "") -> Iterator[None]:
+        """计时一个阶段：with report.stage("tts", lesson.id): ..."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(stage, lesson_id, wall=time.perf_counter() - wall,
+                     cpu=time.process_time() - cpu)
+
+    def stages(self) -> Dict[str, Dict[str, float]]:
+        """各阶段的汇总（所有 lesson 相加）。"""
+        totals: Dict[str, Dict[str, float]] = {}
+        for (stage, _lesson_id), counts in self.rows.items():
+            row = totals.setdefault(stage, {})
+            for name, value in counts.items():
+                row[name] = row.get(name, 0) + value
+        return totals
+
+    def to_json(self) -> Dict[str, Any]:
+        def rounded(counts: Dict[str, float]) -> Dict[str, float]:
+            return {k: round(v, 4) if isinstance(v, float) else v for k, v in counts.items()}
+
+        lessons: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for (stage, lesson_id), counts in self.rows.items():
+            if lesson_id:
+                lessons.setdefault(lesson_id, {})[stage] = rounded(counts)
+        return {
+            "version": REPORT_VERSION,
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall": round(time.perf_counter() - self._wall, 4),
+            "cpu": round(time.process_time() - self._cpu, 4),
+            "stages": {stage: rounded(counts) for stage, counts in self.stages().items()},
+            "lessons": lessons,
+            **self.info,
+        }
+
+    def save(self, path: Path = REPORT_PATH) -> Dict[str, Any]:
+        data = self.to_json()
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, path)
+        return data
+
+    def summary(self, data: Dict[str, Any], slowest: int = 5) -> str:
+        """把 to_json() 的结果排成表格：每个阶段一行，最后列出最慢的几个 lesson。"""
+        def num(counts: Dict[str, float], name: str, fmt: str) -> str:
+            return format(counts[name], fmt) if name in counts else "-"
+
+        lines = [f"{'stage':<14}{'wall s':>9}{'cpu s':>9}{'written':>12}"
+                 f"{'hit/miss':>12}{'tts req/chars':>16}"]
+        for stage, c in data["stages"].items():
+            written = f"{c['bytes'] / 1024:.1f} KB" if "bytes" in c else "-"
+            cache = f"{c.get('hits', 0)}/{c.get('misses', 0)}" if "hits" in c or "misses" in c else "-"
+            tts = f"{c['tts_calls']}/{c['tts_chars']}" if "tts_calls" in c else "-"
+            lines.append(f"{stage:<14}{num(c, 'wall', '.3f'):>9}{num(c, 'cpu', '.3f'):>9}"
+                         f"{written:>12}{cache:>12}{tts:>16}")
+        lines.append(f"{'total':<14}{data['wall']:>9.3f}{data['cpu']:>9.3f}")
+
+        # export.<格式> 是 export 的细分，不重复计入
+        per_lesson = sorted(((sum(c.get("wall", 0) for stage, c in stages.items() if "." not in stage),
+                              lesson_id) for lesson_id, stages in data["lessons"].items()),
+                            reverse=True)[:slowest]
+        if per_lesson and per_lesson[0][0] > 0:
+            lines.append("最慢的 lesson: " + "，".join(f"{lesson_id} {wall:.3f}s"
+                                                       for wall, lesson_id in per_lesson))
+        return "\n".join(lines)
+
+
+# ========== 并行导出（--jobs） ==========
+
+def _export_lesson_job(lesson: Lesson, formats: List[str],
+                       assets: Dict[str, str]) -> tuple[str, Dict[str, str | None], str,
+                                                        Dict[tuple[str, str], Dict[str, float]]]:
+    """导出一个 lesson 的若干格式（可能运行在子进程里）。
+
+    返回 (lesson id, {格式: 输入指纹，跳过时为 None}, 这期间打印的日志, 报告数据)，
+    日志交给主进程按 lesson 顺序输出，多进程时也不会交错；报告数据由主进程并入 BuildReport。
+    """
+    report = BuildReport()
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf), report.stage("export", lesson.id):
+        print(f"\n=== 处理 lesson: {lesson.id} ({', '.join(formats)}) ===")
+        try:
+            paths = export_lesson(lesson, formats, assets, report)
+        except ValueError as e:
+            # 例如 *.jsonl 里某一行不是合法 JSON：这课的临时文件已由 sink.abort 删掉，
+            # 各格式都记为未生成（下次构建重试），其它 lesson 照常导出
+            print(f"[ERROR] {e}，跳过 lesson {lesson.id}")
+            paths = dict.fromkeys(formats)
+    results = {fmt: None if path is None else lesson_input_key(lesson, fmt, assets)
+               for fmt, path in paths.items()}
+    return lesson.id, results, buf.getvalue(), report.rows
+
+
+def run_export_jobs(tasks: List[tuple[Lesson, List[str], Dict[str, str]]],
+                    jobs: int = 1) -> Iterator[tuple[str, Dict[str, str | None], str,
+                                                     Dict[tuple[str, str], Dict[str, float]]]]:
+    """按 tasks 的顺序产出每个 lesson 的导出结果；jobs > 1 时用进程池并行。"""
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield _export_lesson_job(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+        futures = [pool.submit(_export_lesson_job, *task) for task in tasks]
+        for future in futures:
+            yield future.result()
+
+
+# ========== 预压缩（.gz / .br） ==========
+
+# 这些扩展名的产物会生成 .gz / .br 兄弟文件，供 nginx gzip_static / brotli_static 直接发送
+COMPRESSIBLE_SUFFIXES = {".html", ".md", ".csv", ".json", ".css", ".js", ".svg", ".txt"}
+
 
+def _compressible_artifacts() -> List[Path]:
+    """根目录的 index.html / stats.html 加上 build/ 下所有文本产物（跳过 .audio_store 等隐藏文件）。"""
+    paths = [BASE_DIR / "index.html", STATS_PATH]
+    if OUTPUT_DIR.exists():
+        for path in OUTPUT_DIR.rglob("*"):
+            rel = path.relative_to(OUTPUT_DIR)
+            if any(part.startswith(".") for part in rel.parts):
+                continue
+            if path.suffix in COMPRESSIBLE_SUFFIXES and path.is_file():
+                paths.append(path)
+    return [p for p in paths if p.exists()]
+
+
+def _write_sibling(path: Path, data: bytes, original_size: int) -> int:
+    """压缩后更小才写兄弟文件，否则删掉旧的；返回最终会被发送的字节数。"""
+    if len(data) < original_size:
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return len(data)
+    if path.exists():
+        path.unlink()
+    return original_size
+
+
+def compress_artifacts(manifest: Dict[str, Any], report: BuildReport | None = None) -> None:
+    """为每个文本产物生成最高压缩级别的 .gz 和 .br（需要 brotli 包）。
+
+    manifest["compressed"] 记录每个源文件的 [大小, mtime_ns]、sha256，以及每种编码是否值得保留
+    兄弟文件（压缩后不比原文件小就记 False，不写文件）。大小和 mtime 都没变就直接信任记录，
+    不再读文件算哈希；变了才重新算 sha256，内容其实没变时只更新记录。源文件没变、记录为 True 的
+    兄弟文件都在时跳过，所以“压不小”的文件也不会每次构建都重新压缩。最后打印压缩前后的总字节数。
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print("[WARN] 未安装 brotli，只生成 .gz。可以运行：python -m pip install brotli")
+
+    old: Dict[str, Any] = manifest.get("compressed", {})
+    new: Dict[str, Any] = {}
+    updated = written = 0
+    total = total_gz = total_br = 0
+
+    for path in _compressible_artifacts():
+        rel = path.relative_to(BASE_DIR).as_posix()
+        gz_path = path.with_name(path.name + ".gz")
+        br_path = path.with_name(path.name + ".br")
+        st = path.stat()
+        size = st.st_size
+        stat_key = [size, st.st_mtime_ns]
+        total += size
+
+        # 旧版 manifest 这里只存 sha256 字符串，当作没有记录，重新压缩一次
+        entry = old.get(rel)
+        if not isinstance(entry, dict):
+            entry = {}
+        if entry.get("stat") != stat_key:
+            digest = _file_sha256(path)
+            if entry.get("sha256") == digest:
+                # 只是 mtime 变了（例如重新写了同样的内容），压缩结果仍然可用
+                entry = {**entry, "stat": stat_key}
+            else:
+                entry = {"stat": stat_key, "sha256": digest}
+        digest = entry["sha256"]
+        wanted = ["gz"] + (["br"] if brotli is not None else [])
+        siblings = {"gz": gz_path, "br": br_path}
+        fresh = all(coding in entry and (not entry[coding] or siblings[coding].exists())
+                    for coding in wanted)
+        if fresh:
+            new[rel] = entry
+            total_gz += gz_path.stat().st_size if entry["gz"] else size
+            total_br += br_path.stat().st_size if entry.get("br") else size
+            continue
+
+        data = path.read_bytes()
+        gz_size = _write_sibling(gz_path, gzip.compress(data, compresslevel=9, mtime=0), size)
+        entry = {"stat": stat_key, "sha256": digest, "gz": gz_size < size}
+        total_gz += gz_size
+        if brotli is not None:
+            br_size = _write_sibling(br_path, brotli.compress(data, quality=11), size)
+            entry["br"] = br_size < size
+            total_br += br_size
+        else:
+            total_br += size
+        new[rel] = entry
+        updated += 1
+        written += sum(p.stat().st_size for p in (gz_path, br_path) if p.exists())
+
+    # 源文件已经不存在的，兄弟文件也删掉
+    for rel in old.keys() - new.keys():
+        for suffix in (".gz", ".br"):
+            sibling = BASE_DIR / (rel + suffix)
+            if sibling.exists():
+                sibling.unlink()
+
+    manifest["compressed"] = new
+    if report is not None:
+        report.add("compress", hits=len(new) - updated, misses=updated, bytes=written)
+    if total:
+        line = f"[OK] 预压缩: 更新 {updated}/{len(new)} 个文件，原始 {total / 1024:.1f} KB，" \
+               f"gzip 后 {total_gz / 1024:.1f} KB（省 {(total - total_gz) / 1024:.1f} KB）"
+        if brotli is not None:
+            line += f"，brotli 后 {total_br / 1024:.1f} KB（省 {(total - total_br) / 1024:.1f} KB）"
+        print(line)
+
+
+# ========== --watch：改动即重建 + 浏览器自动刷新 ==========
+
+SCRIPT_PATH = Path(__file__).resolve()
+WATCH_DEBOUNCE = 0.03        # 收到第一个事件后再等这么久，把编辑器连续写的几次合并
+WATCH_POLL_INTERVAL = 0.2    # 没有 inotify 时的轮询间隔（秒）
+LIVERELOAD_PATH = "/__livereload"
+
+# 开发服务器往 HTML 响应里注入的脚本（不写进构建产物）。连上后先收到当前构建号，
+# 之后构建号一变就刷新；服务器重启后重连也会拿到新的构建号
+LIVERELOAD_SNIPPET = """<script>
+(function() {
+    var seen = null;
+    var source = new EventSource("/__livereload");
+    source.addEventListener("build", function(e) {
+        if (seen !== null && seen !== e.data) {
+            location.reload();
+        }
+        seen = e.data;
+    });
+})();
+</script>
+"""
+
+
+class InotifyWatcher:
+    """Linux inotify（ctypes 调 libc）：目录里有文件写完 / 改名 / 删除时 fd 变为可读。"""
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, dirs: List[Path]):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+        self._dirs: Dict[int, Path] = {}
+        for d in dirs:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(d), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch 失败: {d}")
+            self._dirs[wd] = d
+
+    def read_changes(self) -> List[Path]:
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed: List[Path] = []
+        pos = 0
+        while pos < len(data):
+            wd, _mask, _cookie, length = self._EVENT.unpack_from(data, pos)
+            pos += self._EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            if name and wd in self._dirs:
+                changed.append(self._dirs[wd] / os.fsdecode(name))
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """没有 inotify（Windows / macOS）时的兜底：定时比较文件的 mtime 和大小。"""
+
+    def __init__(self, dirs: List[Path]):
+        self.dirs = dirs
+        self._state = self._snapshot()
+
+    def _snapshot(self) -> Dict[Path, tuple[int, int]]:
+        state: Dict[Path, tuple[int, int]] = {}
+        for d in self.dirs:
+            with contextlib.suppress(FileNotFoundError):
+                for entry in os.scandir(d):
+                    if entry.is_file():
+                        st = entry.stat()
+                        state[d / entry.name] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def read_changes(self) -> List[Path]:
+        old, self._state = self._state, self._snapshot()
+        return [p for p in old.keys() | self._state.keys() if old.get(p) != self._state.get(p)]
+
+    def close(self) -> None:
+        pass
+
+
+def _watched(path: Path) -> bool:
+    """只关心 lesson 文件和脚本本身（模板常量都在脚本里）。"""
+    if path.parent == CONTENT_DIR:
+        return path.suffix in (".json", ".jsonl")
+    return path.resolve() == SCRIPT_PATH
+
+
+class DevServer:
+    """本机预览 / 压测用的 asyncio 静态文件服务器：/ 对应 BASE_DIR，但只提供 PUBLIC_FILES
+    （index.html、stats.html）和 PUBLIC_DIRS（build/，含 build/catalog/）下的文件，隐藏文件一律 404。
+
+    行为尽量贴近线上的 nginx：HTTP/1.1 keep-alive、单段 Range 请求（mp3 拖动 / seek）、
+    ETag + If-None-Match（304）、按 Accept-Encoding 直接发送预压缩的 .br / .gz、
+    带指纹的文件给一年 immutable 缓存，其余 no-cache（每次用 ETag 校验）。
+    文件内容用 sendfile 发送，不整个读进内存。
+
+    livereload=True（--watch）时 HTML 响应里注入 LIVERELOAD_SNIPPET，
+    LIVERELOAD_PATH 是 SSE 推送通道，每次重建完调用 notify()。
+    """
+
+    IDLE_TIMEOUT = 15.0
+    PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+    # 根目录下只对外提供这些（和线上部署的内容一致）；lessons/、lessons.db、脚本本身等一律 404
+    PUBLIC_FILES = ("index.html", "stats.html")
+    PUBLIC_DIRS = ("build",)
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8000, root: Path = BASE_DIR,
+                 livereload: bool = False):
+        self.host = host
+        self.port = port
+        self.root = root.resolve()
+        self.livereload = livereload
+        self.build_id = str(time.time_ns())
+        self._clients: set[asyncio.StreamWriter] = set()
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"[SERVE] http://{self.host}:{self.port}/")
+
+    async def serve_forever(self) -> None:
+        assert self._server is not None
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+
+    def notify(self) -> None:
+        self.build_id = str(time.time_ns())
+        for writer in list(self._clients):
+            self._send_event(writer)
+
+    def _send_event(self, writer: asyncio.StreamWriter) -> None:
+        if writer.is_closing():
+            self._clients.discard(writer)
+            return
+        writer.write(f"event: build\ndata: {self.build_id}\n\n".encode())
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """一个连接上按顺序处理多个请求（keep-alive），空闲超时或对方要求时关闭。"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, version = lines[0].split(" ", 2)
+                headers: Dict[str, str] = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+
+                if self.livereload and path == LIVERELOAD_PATH:
+                    await self._livereload(reader, writer)
+                    return
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                await self._respond(writer, method, path, headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            if writer not in self._clients:
+                writer.close()
+
+    async def _livereload(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\nretry: 500\n\n")
+        self._send_event(writer)
+        self._clients.add(writer)
+        try:
+            await reader.read()  # 浏览器关掉页面时读到 EOF
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def _resolve(self, url_path: str) -> Path | None:
+        """URL -> 要发送的文件；不在白名单里、或者路径里有 . 开头的文件 / 目录（.manifest.json、
+        .audio_store/、.git/ 等）时返回 None（404）。"""
+        path = (self.root / url_path.lstrip("/")).resolve()
+        if not path.is_relative_to(self.root):
+            return None
+        if path.is_dir():
+            path = path / "index.html"
+        parts = path.relative_to(self.root).parts
+        if any(part.startswith(".") for part in parts):
+            return None
+        public = parts[0] in self.PUBLIC_FILES if len(parts) == 1 else parts[0] in self.PUBLIC_DIRS
+        if not public:
+            return None
+        return path if path.is_file() else None
+
+    def _precompressed(self, path: Path, mtime_ns: int, accept: str) -> tuple[str, Path] | None:
+        """客户端接受、而且不比原文件旧的 .br / .gz（--watch 不压缩，旧的兄弟文件不能用）。"""
+        accepted = set()
+        for item in accept.split(","):
+            coding, _, params = item.strip().partition(";")
+            if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                accepted.add(coding.strip().lower())
+        for coding, suffix in self.PRECOMPRESSED:
+            if coding in accepted:
+                sibling = path.with_name(path.name + suffix)
+                with contextlib.suppress(FileNotFoundError):
+                    if sibling.stat().st_mtime_ns >= mtime_ns:
+                        return coding, sibling
+        return None
+
+    @staticmethod
+    def _byte_range(value: str, size: int) -> tuple[int, int] | None:
+        """解析单段 "bytes=a-b" / "bytes=a-" / "bytes=-n"，返回 [start, end]；
+        多段或格式不对返回 None（按规范直接回整个文件）；越界抛 ValueError。"""
+        unit, _, spec = value.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return None
+        first, sep, last = spec.strip().partition("-")
+        if not sep or not (first or last) or not (first or "0").isdigit() or not (last or "0").isdigit():
+            return None
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            raise ValueError("range not satisfiable")
+        return start, end
+
+    async def _respond(self, writer: asyncio.StreamWriter, method: str, url_path: str,
+                       headers: Dict[str, str], keep_alive: bool) -> None:
+        extra = {"Connection": "keep-alive" if keep_alive else "close"}
+        if method not in ("GET", "HEAD"):
+            await self._send(writer, "405 Method Not Allowed", {**extra, "Allow": "GET, HEAD"}, b"")
+            return
+        path = self._resolve(url_path)
+        if path is None:
+            await self._send(writer, "404 Not Found", {**extra, "Content-Type": "text/plain"}, b"404 Not Found")
+            return
+
+        st = path.stat()
+        content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type in ("application/json", "application/javascript"):
+            content_type += "; charset=utf-8"
+        inject = self.livereload and path.suffix == ".html"
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}{"-lr" if inject else ""}"'
+        immutable = FINGERPRINTED_NAME.match(path.name) is not None
+        out = {
+            **extra,
+            "Content-Type": content_type,
+            "Last-Modified": email.utils.formatdate(st.st_mtime, usegmt=True),
+            "Cache-Control": "public, max-age=31536000, immutable" if immutable else "no-cache",
+            "Accept-Ranges": "bytes",
+        }
+
+        body_path, size = path, st.st_size
+        compressed = None if inject else self._precompressed(path, st.st_mtime_ns,
+                                                             headers.get("accept-encoding", ""))
+        if path.suffix in COMPRESSIBLE_SUFFIXES:
+            out["Vary"] = "Accept-Encoding"
+        if compressed is not None:
+            coding, body_path = compressed
+            size = body_path.stat().st_size
+            etag = etag[:-1] + f'-{coding}"'
+            out["Content-Encoding"] = coding
+        out["ETag"] = etag
+
+        if etag in (tag.strip().removeprefix("W/") for tag in headers.get("if-none-match", "").split(",")) \
+                or headers.get("if-none-match", "").strip() == "*":
+            await self._send(writer, "304 Not Modified", out, b"", length=False)
+            return
+
+        if inject:
+            body = body_path.read_bytes().replace(b"</body>", LIVERELOAD_SNIPPET.encode("utf-8") + b"</body>", 1)
+            await self._send(writer, "200 OK", out, b"" if method == "HEAD" else body, length=len(body))
+            return
+
+        status, start, count = "200 OK", 0, size
+        if "range" in headers and compressed is None and headers.get("if-range", etag) == etag:
+            try:
+                span = self._byte_range(headers["range"], size)
+            except ValueError:
+                await self._send(writer, "416 Range Not Satisfiable",
+                                 {**out, "Content-Range": f"bytes */{size}"}, b"")
+                return
+            if span is not None:
+                start, end = span
+                status, count = "206 Partial Content", end - start + 1
+                out["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+        await self._send(writer, status, out, b"", length=count)
+        if method == "GET" and count:
+            with body_path.open("rb") as f:
+                await asyncio.get_running_loop().sendfile(writer.transport, f, start, count)
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, status: str, headers: Dict[str, str], body: bytes,
+                    length: int | bool = True) -> None:
+        """写状态行和头（length=True 时按 body 长度写 Content-Length）以及 body。"""
+        if length is True:
+            headers = {**headers, "Content-Length": str(len(body))}
+        elif length is not False:
+            headers = {**headers, "Content-Length": str(length)}
+        head = f"HTTP/1.1 {status}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000) -> None:
+    """只启动本地服务器（--serve 在构建完之后调用），Ctrl+C 退出。"""
+    async def run() -> None:
+        server = DevServer(host, port)
+        await server.start()
+        await server.serve_forever()
+
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(run())
+
+
+def watch(host: str = "127.0.0.1", port: int = 8000, **build_kwargs: Any) -> None:
+    """构建一次，然后监视 lessons/ 和脚本本身，有变化就只重建受影响的 lesson，
+    并通过开发服务器通知打开的页面刷新。脚本（模板常量）变了就重启整个进程。"""
+    asyncio.run(_watch(host, port, build_kwargs))
+
+
+async def _watch(host: str, port: int, build_kwargs: Dict[str, Any]) -> None:
+    loop = asyncio.get_running_loop()
+    lessons = {lesson.source_path: lesson for lesson in load_lessons()}
+    build_all(lessons=list(lessons.values()), **build_kwargs)
+
+    server = DevServer(host, port, livereload=True)
+    await server.start()
+
+    dirs = [CONTENT_DIR, SCRIPT_PATH.parent]
+    changes: asyncio.Queue[Path] = asyncio.Queue()
+    try:
+        watcher: InotifyWatcher | PollingWatcher = InotifyWatcher(dirs)
+        loop.add_reader(watcher.fd, lambda: [changes.put_nowait(p) for p in watcher.read_changes()])
+        print("[WATCH] 使用 inotify 监视 lessons/ 和 build_lessons.py")
+    except (OSError, AttributeError) as e:
+        watcher = PollingWatcher(dirs)
+        print(f"[WATCH] inotify 不可用（{e}），改为每 {WATCH_POLL_INTERVAL:g} 秒轮询")
+
+        async def poll() -> None:
+            while True:
+                await asyncio.sleep(WATCH_POLL_INTERVAL)
+                for p in watcher.read_changes():
+                    changes.put_nowait(p)
+
+        loop.create_task(poll())
+
+    while True:
+        changed = {await changes.get()}
+        started = time.perf_counter()
+        await asyncio.sleep(WATCH_DEBOUNCE)
+        while not changes.empty():
+            changed.add(changes.get_nowait())
+        changed = {p for p in changed if _watched(p)}
+        if not changed:
+            continue
+
+        if any(p.parent != CONTENT_DIR for p in changed):
+            print("[WATCH] build_lessons.py 有改动，重启")
+            server.close()
+            watcher.close()
+            os.execv(sys.executable, [sys.executable, *sys.argv])
+
+        only: set[str] = set()
+        for path in sorted(changed):
+            lesson = load_lesson(path) if path.exists() else None
+            if lesson is None:
+                lessons.pop(path, None)
+            else:
+                lessons[path] = lesson
+                only.add(lesson.id)
+        ordered = [lessons[p] for p in sorted(lessons)]
+        await loop.run_in_executor(None, functools.partial(build_all, lessons=ordered, only=only,
+                                                           **build_kwargs))
+        server.notify()
+        print(f"[WATCH] {', '.join(sorted(p.name for p in changed))} -> 重建完成，"
+              f"{(time.perf_counter() - started) * 1000:.0f} ms")
 
 
 # ========== main ==========
 
-def build_all():
-    lessons = load_lessons()
+def build_all(force: bool = False,
+              tts_workers: int = TTS_WORKERS,
+              tts_rps: float = TTS_REQUESTS_PER_SECOND,
+              tts_chars_per_min: float = TTS_CHARS_PER_MINUTE,
+              audio_gc: bool = False,
+              jobs: int = 1,
+              compress: bool = True,
+              fingerprint: bool = False,
+              inline_critical_css: bool = False,
+              xlsx_combined: bool = False,
+              report_duplicates: bool = False,
+              db: Path | None = None,
+              tag: str | None = None,
+              lessons: List[Lesson] | None = None,
+              only: set[str] | None = None) -> BuildReport | None:
+    """构建所有 lesson。
+
+    默认增量：只重新导出输入有变化的产物；force=True 时全量重建。
+    jobs > 1 时各 lesson 的导出分摊到多个进程，index.html 在全部完成后生成一次。
+    compress=True 时最后为文本产物生成 .gz / .br。
+    fingerprint=True 时为音频和各产物生成带内容哈希的副本，页面和目录改用这些
+    文件名（可以放心设置一年的 immutable 缓存），映射写入 build/asset-manifest.json。
+    所有句子的全文搜索索引写到 build/search/，目录页带搜索框。
+    全量构建总会按规范化文本给所有句子去重并报告重复率（结果按内容指纹缓存在 manifest 里）；
+    report_duplicates=True 时另把去重后的全局句子库写成 build/sentences.json，
+    否则删掉上次留下的 sentences.json（没有别的产物读它，不让它过期）。
+    装了 numpy 时统计法语词汇（词频、覆盖率、每课新词），生成根目录的 stats.html。
+    课程页的样式和脚本总是放在共享的 build/assets/lesson.<哈希>.css / .js 里；
+    inline_critical_css=True 时页面内联首屏样式，完整样式表异步加载。
+    xlsx_combined=True 时另外生成一个每课一个工作表的 build/lessons.xlsx。
+    db 非空时从 SQLite 内容库读取 lesson；tag 非空时只构建带这个标签的 lesson：manifest 里
+    其它 lesson 的记录原样保留，目录、搜索索引、句子库、词汇统计和合并的 xlsx 这些覆盖全部
+    lesson 的产物保持上次全量构建的结果。
+    lessons 可以传入已经读好的 lesson（--watch 用）；only 非空时音频和导出只处理这些 id，
+    其它 lesson 的产物直接沿用 manifest 里的记录；搜索索引只改这些 lesson 涉及的分片，
+    词汇统计只重新切这些 lesson，目录照常增量更新。
+    每个阶段 / lesson 的耗时、写入字节、缓存命中和 TTS 用量写到 build_report.json，
+    全量构建结束时打印汇总表；返回这次的 BuildReport。
+    """
+    report = BuildReport()
+    if lessons is None:
+        with report.stage("load"):
+            lessons = load_lessons(db, tag)
     if not lessons:
         print("[WARN] 没有找到任何 lessons/*.json")
-        return
+        return None
+
+    manifest = load_manifest()
+    if force:
+        manifest = {"version": MANIFEST_VERSION, "lessons": {}, "index_pages": {}}
+
+    # 先跑 TTS：指纹模式下页面里的音频链接依赖音频文件的内容哈希。
+    # TTS 是网络 IO，自带线程池和限流，放在主进程里统一跑
+    tts_limiter = TtsRateLimiter(tts_rps, tts_chars_per_min)
+    with report.stage("assets"):
+        page_assets = write_static_assets(inline_critical_css)
+    lesson_assets: Dict[str, Dict[str, str]] = {}
+    # 指纹哈希的缓存：文件的 mtime / 大小没变就沿用上次的哈希
+    fingerprints: Dict[str, List[Any]] = manifest.get("fingerprints", {}) if fingerprint else {}
+    # 内容读不下去的 lesson（例如 *.jsonl 里有坏行），本次不导出
+    failed: set[str] = set()
+    for lesson in lessons:
+        lesson_assets[lesson.id] = {rel: page_assets[rel] for rel in LESSON_PAGE_ASSETS if rel in page_assets}
+        if only is not None and lesson.id not in only:
+            continue
+        try:
+            with report.stage("tts", lesson.id):
+                generate_lesson_tts(lesson, workers=tts_workers, limiter=tts_limiter, report=report)
+        except ValueError as e:
+            print(f"[ERROR] {e}，跳过 lesson {lesson.id}")
+            failed.add(lesson.id)
+            continue
+        with report.stage("sprite", lesson.id):
+            build_lesson_sprite(lesson, report)
+        with report.stage("playlists", lesson.id):
+            build_lesson_playlists(lesson, report)
+        if fingerprint:
+            with report.stage("fingerprint", lesson.id):
+                lesson_assets[lesson.id].update(fingerprint_lesson_audio(lesson, fingerprints))
 
+    if only is None:
+        with report.stage("audio_gc"):
+            gc_audio_store(None if audio_gc else AUDIO_STORE_MAX_BYTES)
+
+    lesson_entries: Dict[str, Any] = {}
+    tasks: List[tuple[Lesson, List[str], Dict[str, str]]] = []
     for lesson in lessons:
-        print(f"\n=== 处理 lesson: {lesson['id']} ===")
-        export_lesson_html(lesson)
-        export_lesson_md(lesson)
-        export_lesson_csv(lesson)
-        export_lesson_xlsx(lesson)
-        generate_lesson_tts(lesson)
+        lesson_id = lesson.id
+        outputs = dict(manifest["lessons"].get(lesson_id, {}).get("outputs", {}))
+        lesson_entries[lesson_id] = {"source": lesson.source_hash, "outputs": outputs}
+        if lesson.source_path is not None and lesson.source_path.parent == CONTENT_DIR:
+            lesson_entries[lesson_id]["file"] = lesson.source_path.name
+
+        if lesson_id in failed:
+            continue
+        if only is not None and lesson_id not in only:
+            # --watch：其它 lesson 没有改动，产物沿用 manifest 里的记录，不再逐个核对指纹
+            continue
+        stale = stale_formats(lesson, outputs, lesson_assets[lesson_id])
+        for fmt in LESSON_SINKS:
+            if fmt not in stale:
+                report.add(f"export.{fmt}", lesson_id, hits=1)
+        if stale:
+            tasks.append((lesson, stale, lesson_assets[lesson_id]))
+        else:
+            print(f"[SKIP] {lesson_id}: 内容未变化")
+
+    for lesson_id, results, log, rows in run_export_jobs(tasks, jobs):
+        print(log, end="")
+        report.merge(rows)
+        outputs = lesson_entries[lesson_id]["outputs"]
+        for fmt, key in results.items():
+            if key is None:
+                # 导出器主动跳过（sink.open 返回 False），下次还要再试
+                outputs.pop(fmt, None)
+            else:
+                outputs[fmt] = key
+
+    if tag is None:
+        # 全量构建：已删除的 lesson 不再保留在 manifest 里
+        manifest["lessons"] = lesson_entries
+    else:
+        # 只构建了一部分：其它 lesson 的记录保留，只删掉源文件确实已经不在的
+        existing = _existing_lesson_ids(db)
+        manifest["lessons"] = {
+            **{lesson_id: entry for lesson_id, entry in manifest["lessons"].items()
+               if lesson_id not in lesson_entries and _lesson_source_exists(lesson_id, entry, existing)},
+            **lesson_entries,
+        }
+        print(f"[SKIP] 只构建了带标签 {tag} 的 lesson，目录 / 搜索 / 句子库 / 统计保持上次全量构建的结果")
+
+    # 读不下去的 lesson 也不进目录、搜索等全局产物（manifest 里的记录保留，修好后再构建）
+    lessons = [lesson for lesson in lessons if lesson.id not in failed]
+
+    if xlsx_combined and tag is None:
+        with report.stage("xlsx_combined"):
+            export_combined_xlsx(lessons, manifest, report)
+
+    assets: Dict[str, str] = dict(page_assets)
+    if fingerprint:
+        for lesson in lessons:
+            with report.stage("fingerprint", lesson.id):
+                assets.update(lesson_assets[lesson.id])
+                assets.update(fingerprint_lesson_artifacts(lesson, fingerprints))
+        if tag is None:
+            save_asset_manifest(assets)
+            fingerprints = {rel: entry for rel, entry in fingerprints.items() if rel in assets}
+        manifest["fingerprints"] = fingerprints
+    else:
+        manifest.pop("fingerprints", None)
+        if tag is None and ASSET_MANIFEST_PATH.exists():
+            remove_lesson_fingerprints(lessons)
+
+    # 目录、搜索、句子库、统计覆盖全部 lesson，只构建了一部分（--tag）时不动它们
+    if tag is None:
+        with report.stage("sentences"):
+            merges = load_sentence_merges()
+            registry_key = sentence_registry_key(lessons, merges)
+            old_registry = manifest.get("sentences") or {}
+            fresh = old_registry.get("key") == registry_key
+            if report_duplicates and not (fresh and old_registry.get("written") and SENTENCES_PATH.exists()):
+                stats = build_sentence_registry(lessons, merges)
+                report.add("sentences", misses=1, bytes=SENTENCES_PATH.stat().st_size)
+            elif not fresh:
+                stats = sentence_duplication_stats(lessons, merges)
+                report.add("sentences", misses=1)
+            else:
+                stats = {"total": old_registry["total"], "unique": old_registry["unique"]}
+                report.add("sentences", hits=1)
+            if not report_duplicates:
+                # 没有别的产物读 sentences.json，不要求写时就别留着过期的旧文件
+                SENTENCES_PATH.unlink(missing_ok=True)
+            manifest["sentences"] = {"key": registry_key, "written": report_duplicates, **stats}
+        print(f"[OK] 句子库: {duplication_summary(stats)}")
+        report.info["sentences"] = {**stats, "duplicate_ratio": round(1 - stats["unique"] / stats["total"], 4)
+                                    if stats["total"] else 0.0}
+
+        with report.stage("search"):
+            search_key = search_input_key(lessons, assets)
+            if manifest.get("search") != search_key or not (SEARCH_DIR / SEARCH_META_NAME).exists():
+                if only is None or not update_search_index(lessons, only, assets, report):
+                    build_search_index(lessons, assets, report)
+                manifest["search"] = search_key
+            else:
+                print("[SKIP] 搜索索引: 内容未变化")
+                report.add("search", hits=1)
+
+        with report.stage("stats"):
+            stats_key = analytics_input_key(lessons, assets)
+            if manifest.get("stats") != stats_key or not STATS_PATH.exists():
+                if build_vocabulary_stats(lessons, assets, report, only):
+                    manifest["stats"] = stats_key
+            else:
+                print("[SKIP] 词汇统计: 内容未变化")
+                report.add("stats", hits=1)
 
-    export_index_html(lessons)
+        with report.stage("index"):
+            export_index_html(lessons, manifest, assets, report)
+
+    if compress:
+        with report.stage("compress"):
+            compress_artifacts(manifest, report)
+
+    with report.stage("manifest"):
+        save_manifest(manifest)
+
+    data = report.save()
+    if only is None:
+        print(f"\n[REPORT] 各阶段统计（详见 {REPORT_PATH}）\n{report.summary(data)}")
+    return report
+
+
+def profile_build(**build_kwargs: Any) -> None:
+    """在 cProfile 下跑一次 build_all，把数据写到 build_profile.pstats 并打印最耗时的函数。
+
+    之后可以用 python -m pstats build_profile.pstats 或 snakeviz 等工具细看。
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.runcall(build_all, **build_kwargs)
+    profiler.dump_stats(PROFILE_PATH)
+    print(f"\n[OK] cProfile: {PROFILE_PATH}（按累计时间排序的前 20 项）")
+    pstats.Stats(profiler).strip_dirs().sort_stats("cumulative").print_stats(20)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="从 lessons/*.json 构建法语学习网页 / 表格 / 音频")
+    parser.add_argument("--force", action="store_true",
+                        help="忽略 build/.manifest.json，全量重新生成所有产物")
+    parser.add_argument("--tts-workers", type=int, default=TTS_WORKERS,
+                        help=f"TTS 并发线程数（默认 {TTS_WORKERS}）")
+    parser.add_argument("--tts-rps", type=float, default=TTS_REQUESTS_PER_SECOND,
+                        help=f"TTS 每秒最多请求数（默认 {TTS_REQUESTS_PER_SECOND:g}）")
+    parser.add_argument("--tts-chars-per-min", type=float, default=TTS_CHARS_PER_MINUTE,
+                        help=f"TTS 每分钟最多字符数（默认 {TTS_CHARS_PER_MINUTE}）")
+    parser.add_argument("--audio-gc", action="store_true",
+                        help="删除音频库里所有未被引用的 mp3（默认只在超过上限时按 LRU 清理）")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="并行导出的进程数（默认 1；0 表示 CPU 核数）")
+    parser.add_argument("--no-compress", action="store_true",
+                        help="不生成 .gz / .br 预压缩文件")
+    parser.add_argument("--fingerprint", action="store_true",
+                        help="生成带内容哈希的资源文件名（如 01.3fa2c1d0.mp3）并改写页面链接")
+    parser.add_argument("--inline-critical-css", action="store_true",
+                        help="课程页内联首屏样式，完整的 lesson.css 异步加载")
+    parser.add_argument("--xlsx-combined", action="store_true",
+                        help="另外生成 build/lessons.xlsx：所有 lesson 合在一个工作簿里，每课一个工作表")
+    parser.add_argument("--report-duplicates", action="store_true",
+                        help="另把去重后的全局句子库写成 build/sentences.json（重复率每次构建都会报告）")
+    parser.add_argument("--import-db", nargs="?", type=Path, const=CONTENT_DB, metavar="PATH",
+                        help=f"把 lessons/*.json(l) 同步进 SQLite 内容库后退出（默认 {CONTENT_DB.name}）")
+    parser.add_argument("--db", nargs="?", type=Path, const=CONTENT_DB, metavar="PATH",
+                        help=f"从 SQLite 内容库读取 lesson，而不是 lessons/*.json（默认 {CONTENT_DB.name}）")
+    parser.add_argument("--tag", help="只构建带这个标签（lesson JSON 里的 tags）的 lesson；"
+                                      "目录、搜索等全局产物不更新")
+    parser.add_argument("--find", metavar="TEXT",
+                        help="在内容库里查包含 TEXT 的句子并退出（用 --db 指定的库，默认 lessons.db）")
+    parser.add_argument("--near-dups", action="store_true",
+                        help="用 MinHash / LSH 找出所有 lesson 里的近似重复句，报告写到 build/near_duplicates.json 后退出")
+    parser.add_argument("--near-dup-threshold", type=float, default=NEAR_DUP_THRESHOLD,
+                        help=f"近似重复的相似度下限（字符 3-gram 的 Jaccard，默认 {NEAR_DUP_THRESHOLD}）")
+    parser.add_argument("--merge-near-dups", action="store_true",
+                        help="同 --near-dups，并把每组近似重复合并成句子库里的一条共享条目（之后用 --report-duplicates 构建）")
+    parser.add_argument("--daily", nargs="?", const=datetime.date.today().isoformat(), metavar="DATE",
+                        help="先从句子池抽句生成 lessons/daily_<DATE>.json（默认今天，格式 2024-01-31），再照常构建")
+    parser.add_argument("--daily-size", type=int, default=DAILY_SIZE,
+                        help=f"每日 lesson 的句数（默认 {DAILY_SIZE}）")
+    parser.add_argument("--daily-seed", default="",
+                        help="抽样种子：同一个种子和日期总是生成同一份 lesson")
+    parser.add_argument("--daily-avoid-days", type=int, default=DAILY_AVOID_DAYS,
+                        help=f"不抽最近多少天的每日 lesson 里用过的句子（默认 {DAILY_AVOID_DAYS}）")
+    parser.add_argument("--daily-weight", choices=DAILY_WEIGHTS, default="uniform",
+                        help="抽样权重：uniform 均匀，easy / hard 偏向简单 / 难的句子，novelty 偏向含少见词的句子")
+    parser.add_argument("--watch", action="store_true",
+                        help="构建后监视 lessons/ 和本脚本，改动即重建对应 lesson，并启动带自动刷新的本地服务器")
+    parser.add_argument("--serve", action="store_true",
+                        help="构建完成后启动本地预览服务器（Range / ETag / 预压缩，和线上行为接近）")
+    parser.add_argument("--host", default="127.0.0.1", help="本地服务器的地址（默认 127.0.0.1）")
+    parser.add_argument("--port", type=int, default=8000, help="本地服务器的端口（默认 8000）")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"用 cProfile 采样整个构建，结果写到 {PROFILE_PATH.relative_to(BASE_DIR)}"
+                             "（多进程导出时子进程不在采样内，建议配合 -j 1）")
+    args = parser.parse_args()
+    if args.import_db:
+        import_lessons_to_db(args.import_db)
+        return
+    if args.find:
+        db_path = args.db or CONTENT_DB
+        if not db_path.exists():
+            print(f"[ERROR] 内容库不存在: {db_path}，先运行 python build_lessons.py --import-db")
+            return
+        matches = find_sentences(db_path, args.find)
+        for lesson_id, idx, sentence in matches:
+            print(f"{lesson_id} #{idx:02d}  {sentence.fr}  {sentence.zh}")
+        print(f"[OK] 找到 {len(matches)} 句" + ("（只显示前 50 句）" if len(matches) == 50 else ""))
+        return
+    if args.daily:
+        try:
+            day = datetime.date.fromisoformat(args.daily)
+        except ValueError:
+            print(f"[ERROR] 日期格式不对: {args.daily}（应为 YYYY-MM-DD）")
+            return
+        if generate_daily_lesson(day, args.daily_size, args.daily_seed, args.daily_avoid_days,
+                                 args.daily_weight, db=args.db, tag=args.tag) is None:
+            return
+        if args.db:
+            # 内容库是 lessons/ 的镜像，把新生成的文件同步进去，下面的构建才看得到
+            import_lessons_to_db(args.db)
+    if args.near_dups or args.merge_near_dups:
+        analyze_near_duplicates(load_lessons(args.db, args.tag), args.near_dup_threshold,
+                                merge=args.merge_near_dups)
+        return
+    if args.watch:
+        if args.db or args.tag:
+            print("[WARN] --watch 直接监视 lessons/ 目录，忽略 --db / --tag")
+        # 开发时追求快：单进程、不压缩、不加指纹
+        watch(host=args.host,
+              port=args.port,
+              inline_critical_css=args.inline_critical_css,
+              tts_workers=args.tts_workers,
+              tts_rps=args.tts_rps,
+              tts_chars_per_min=args.tts_chars_per_min,
+              compress=False)
+        return
+    build_kwargs = dict(force=args.force,
+                        fingerprint=args.fingerprint,
+                        inline_critical_css=args.inline_critical_css,
+                        xlsx_combined=args.xlsx_combined,
+                        report_duplicates=args.report_duplicates,
+                        db=args.db,
+                        tag=args.tag,
+                        compress=not args.no_compress,
+                        jobs=args.jobs or os.cpu_count() or 1,
+                        tts_workers=args.tts_workers,
+                        tts_rps=args.tts_rps,
+                        tts_chars_per_min=args.tts_chars_per_min,
+                        audio_gc=args.audio_gc)
+    if args.profile:
+        profile_build(**build_kwargs)
+    else:
+        build_all(**build_kwargs)
+    if args.serve:
+        serve(args.host, args.port)
 
 
 if __name__ == "__main__":
-    build_all()
+    main()